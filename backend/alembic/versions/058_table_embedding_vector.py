@@ -0,0 +1,61 @@
+"""058_table_embedding_vector
+
+Revision ID: 5e2d8c7b41a9
+Revises: c431a0bf478b
+Create Date: 2025-11-03 10:21:45.317602
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '5e2d8c7b41a9'
+down_revision = 'c431a0bf478b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS vector')
+    # json text -> pgvector
+    op.execute(
+        "ALTER TABLE core_table ALTER COLUMN embedding TYPE vector "
+        "USING NULLIF(replace(embedding, ' ', ''), '')::vector")
+    op.execute(
+        "ALTER TABLE core_datasource ALTER COLUMN embedding TYPE vector "
+        "USING NULLIF(replace(embedding, ' ', ''), '')::vector")
+    op.create_index('ix_core_table_ds_id', 'core_table', ['ds_id'], unique=False)
+    # embedding 维度由模型决定，按已有维度建立部分 hnsw 索引，新维度在写入 embedding 时补建
+    op.execute("""
+        DO $$
+        DECLARE
+            d integer;
+        BEGIN
+            FOR d IN SELECT DISTINCT vector_dims(embedding) FROM core_table WHERE embedding IS NOT NULL LOOP
+                IF d <= 2000 THEN
+                    EXECUTE format('CREATE INDEX IF NOT EXISTS core_table_embedding_hnsw_%s ON core_table '
+                                   'USING hnsw ((embedding::vector(%s)) vector_cosine_ops) '
+                                   'WHERE vector_dims(embedding) = %s', d, d, d);
+                END IF;
+            END LOOP;
+        END $$;
+    """)
+
+
+def downgrade():
+    op.execute("""
+        DO $$
+        DECLARE
+            idx text;
+        BEGIN
+            FOR idx IN SELECT indexname FROM pg_indexes
+                       WHERE tablename = 'core_table' AND indexname LIKE 'core_table_embedding_hnsw_%' LOOP
+                EXECUTE format('DROP INDEX IF EXISTS %I', idx);
+            END LOOP;
+        END $$;
+    """)
+    op.drop_index('ix_core_table_ds_id', table_name='core_table')
+    op.execute("ALTER TABLE core_datasource ALTER COLUMN embedding TYPE text USING embedding::text")
+    op.execute("ALTER TABLE core_table ALTER COLUMN embedding TYPE text USING embedding::text")
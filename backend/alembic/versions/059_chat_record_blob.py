@@ -0,0 +1,37 @@
+"""059_chat_record_blob
+
+Revision ID: 7b3f0e9a2c15
+Revises: 5e2d8c7b41a9
+Create Date: 2026-01-12 15:08:31.482915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+
+
+# revision identifiers, used by Alembic.
+revision = '7b3f0e9a2c15'
+down_revision = '5e2d8c7b41a9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('chat_record_blob',
+    sa.Column('id', sa.BigInteger(), sa.Identity(always=True), nullable=False),
+    sa.Column('record_id', sa.BigInteger(), nullable=False),
+    sa.Column('type', sqlmodel.sql.sqltypes.AutoString(length=32), nullable=False),
+    sa.Column('encoding', sqlmodel.sql.sqltypes.AutoString(length=32), nullable=False),
+    sa.Column('row_count', sa.BigInteger(), nullable=True),
+    sa.Column('size', sa.BigInteger(), nullable=True),
+    sa.Column('content', sa.LargeBinary(), nullable=False),
+    sa.Column('create_time', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_chat_record_blob_record_id'), 'chat_record_blob', ['record_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_chat_record_blob_record_id'), table_name='chat_record_blob')
+    op.drop_table('chat_record_blob')
@@ -0,0 +1,27 @@
+"""060_chat_history_index
+
+Revision ID: 2c8e61d4f0b7
+Revises: 7b3f0e9a2c15
+Create Date: 2026-01-19 10:32:07.164208
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '2c8e61d4f0b7'
+down_revision = '7b3f0e9a2c15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 对话记录与 chat_log 的关联条件 (pid, type, operate)
+    op.create_index('ix_chat_log_pid_type_operate', 'chat_log', ['pid', 'type', 'operate'], unique=False)
+    # 对话记录按 id 倒序分页
+    op.create_index('ix_chat_record_chat_id_id', 'chat_record', ['chat_id', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_chat_record_chat_id_id', table_name='chat_record')
+    op.drop_index('ix_chat_log_pid_type_operate', table_name='chat_log')
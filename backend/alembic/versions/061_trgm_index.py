@@ -0,0 +1,29 @@
+"""061_trgm_index
+
+Revision ID: 9d4a7c2e5f83
+Revises: 2c8e61d4f0b7
+Create Date: 2026-01-26 14:17:52.903614
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '9d4a7c2e5f83'
+down_revision = '2c8e61d4f0b7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # question ILIKE '%...%' / word ILIKE '%...%' 使用 trigram 索引
+    op.execute('CREATE INDEX IF NOT EXISTS ix_data_training_question_trgm ON data_training '
+               'USING gin (question gin_trgm_ops)')
+    op.execute('CREATE INDEX IF NOT EXISTS ix_terminology_word_trgm ON terminology '
+               'USING gin (word gin_trgm_ops)')
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS ix_terminology_word_trgm')
+    op.execute('DROP INDEX IF EXISTS ix_data_training_question_trgm')
@@ -0,0 +1,56 @@
+"""062_embedding_hnsw_index
+
+Revision ID: 4f1b9e6a3d27
+Revises: 9d4a7c2e5f83
+Create Date: 2026-01-28 10:42:16.205384
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '4f1b9e6a3d27'
+down_revision = '9d4a7c2e5f83'
+branch_labels = None
+depends_on = None
+
+EMBEDDING_TABLES = ['terminology', 'data_training']
+
+
+def upgrade():
+    # 向量检索前先按 oid 过滤
+    op.create_index('ix_terminology_oid', 'terminology', ['oid'], unique=False)
+    op.create_index('ix_data_training_oid', 'data_training', ['oid'], unique=False)
+    # 与 core_table 相同，按已有维度建立部分 hnsw 索引，新维度在写入 embedding 时补建
+    for table in EMBEDDING_TABLES:
+        op.execute(f"""
+            DO $$
+            DECLARE
+                d integer;
+            BEGIN
+                FOR d IN SELECT DISTINCT vector_dims(embedding) FROM {table} WHERE embedding IS NOT NULL LOOP
+                    IF d <= 2000 THEN
+                        EXECUTE format('CREATE INDEX IF NOT EXISTS {table}_embedding_hnsw_%s ON {table} '
+                                       'USING hnsw ((embedding::vector(%s)) vector_cosine_ops) '
+                                       'WHERE vector_dims(embedding) = %s', d, d, d);
+                    END IF;
+                END LOOP;
+            END $$;
+        """)
+
+
+def downgrade():
+    for table in EMBEDDING_TABLES:
+        op.execute(f"""
+            DO $$
+            DECLARE
+                idx text;
+            BEGIN
+                FOR idx IN SELECT indexname FROM pg_indexes
+                           WHERE tablename = '{table}' AND indexname LIKE '{table}_embedding_hnsw_%' LOOP
+                    EXECUTE format('DROP INDEX IF EXISTS %I', idx);
+                END LOOP;
+            END $$;
+        """)
+    op.drop_index('ix_data_training_oid', table_name='data_training')
+    op.drop_index('ix_terminology_oid', table_name='terminology')
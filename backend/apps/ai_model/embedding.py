@@ -1,6 +1,12 @@
+import hashlib
+import json
 import os.path
 import threading
-from typing import Optional
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Optional
 
 from langchain_core.embeddings import Embeddings
 from langchain_huggingface import HuggingFaceEmbeddings
@@ -9,6 +15,9 @@ from pydantic import BaseModel
 from modelscope import snapshot_download
 
 from common.core.config import settings
+from common.core.sqlbot_cache import get_sync_redis_client
+from common.utils.task_scheduler import scheduler, EMBEDDING_POOL
+from common.utils.utils import SQLBotLogUtil
 
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
@@ -87,3 +96,151 @@ class EmbeddingModelCache:
                     _embedding_model[key] = model_instance
 
         return model_instance
+
+
+_query_lock = threading.Lock()
+_query_embedding_cache: OrderedDict[str, tuple[float, list[float]]] = OrderedDict()
+_request_query_embedding: ContextVar[Optional[dict[str, list[float]]]] = ContextVar('request_query_embedding',
+                                                                                    default=None)
+
+
+class EmbeddingQueryCache:
+    """
+    问题文本的 embedding 缓存，同一个问题在术语、数据训练、表、数据源检索中只计算一次
+    - 请求级：query_embedding_scope 范围内的 dict
+    - 进程级：按 EMBEDDING_QUERY_CACHE_SIZE / EMBEDDING_QUERY_CACHE_TTL 限制的 LRU
+    - 可选 Redis：EMBEDDING_QUERY_CACHE_REDIS 开启且 CACHE_TYPE 为 redis 时多进程共享
+    """
+
+    @staticmethod
+    def _cache_key(text: str, config: EmbeddingModelInfo) -> str:
+        normalized = ' '.join(text.split())
+        return hashlib.sha256(f'{config.type}:{config.name}:{normalized}'.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _get_local(key: str) -> Optional[list[float]]:
+        with _query_lock:
+            item = _query_embedding_cache.get(key)
+            if item is None:
+                return None
+            expire_time, embedding = item
+            if expire_time < time.monotonic():
+                _query_embedding_cache.pop(key, None)
+                return None
+            _query_embedding_cache.move_to_end(key)
+            return embedding
+
+    @staticmethod
+    def _set_local(key: str, embedding: list[float]):
+        if settings.EMBEDDING_QUERY_CACHE_SIZE <= 0:
+            return
+        with _query_lock:
+            _query_embedding_cache[key] = (time.monotonic() + settings.EMBEDDING_QUERY_CACHE_TTL, embedding)
+            _query_embedding_cache.move_to_end(key)
+            while len(_query_embedding_cache) > settings.EMBEDDING_QUERY_CACHE_SIZE:
+                _query_embedding_cache.popitem(last=False)
+
+    @staticmethod
+    def _get_redis(key: str) -> Optional[list[float]]:
+        redis_client = get_sync_redis_client() if settings.EMBEDDING_QUERY_CACHE_REDIS else None
+        if redis_client is None:
+            return None
+        try:
+            value = redis_client.get(f'sqlbot-cache:embedding:{key}')
+            return json.loads(value) if value else None
+        except Exception as e:
+            SQLBotLogUtil.error(f'Get query embedding from redis failed: {e}')
+            return None
+
+    @staticmethod
+    def _set_redis(key: str, embedding: list[float]):
+        redis_client = get_sync_redis_client() if settings.EMBEDDING_QUERY_CACHE_REDIS else None
+        if redis_client is None:
+            return
+        try:
+            redis_client.set(f'sqlbot-cache:embedding:{key}', json.dumps(embedding),
+                             ex=settings.EMBEDDING_QUERY_CACHE_TTL)
+        except Exception as e:
+            SQLBotLogUtil.error(f'Set query embedding to redis failed: {e}')
+
+    @staticmethod
+    def embed_query(text: str, key: str = settings.DEFAULT_EMBEDDING_MODEL,
+                    config: EmbeddingModelInfo = local_embedding_model) -> list[float]:
+        cache_key = EmbeddingQueryCache._cache_key(text, config)
+
+        request_cache = _request_query_embedding.get()
+        if request_cache is not None and cache_key in request_cache:
+            return request_cache[cache_key]
+
+        embedding = EmbeddingQueryCache._get_local(cache_key)
+        if embedding is None:
+            embedding = EmbeddingQueryCache._get_redis(cache_key)
+            if embedding is not None:
+                EmbeddingQueryCache._set_local(cache_key, embedding)
+        if embedding is None:
+            embedding = EmbeddingModelCache.get_model(key, config).embed_query(text)
+            EmbeddingQueryCache._set_local(cache_key, embedding)
+            EmbeddingQueryCache._set_redis(cache_key, embedding)
+
+        if request_cache is not None:
+            request_cache[cache_key] = embedding
+        return embedding
+
+
+@contextmanager
+def query_embedding_scope():
+    """
+    请求级 embedding 缓存范围，如一次问数的 run_task
+    """
+    token = _request_query_embedding.set({})
+    try:
+        yield
+    finally:
+        _request_query_embedding.reset(token)
+
+
+def run_batch_embedding(name: str, ids: list[int],
+                        load_texts: Callable[[list[int]], list[tuple[int, str]]],
+                        save_embeddings: Callable[[list[dict]], None],
+                        session=None,
+                        batch_size: int = settings.EMBEDDING_BATCH_SIZE) -> set[int]:
+    """
+    分批计算并写入 embedding
+    - load_texts: 按一批 id 批量加载待计算的 (id, text)
+    - save_embeddings: 批量写入 [{"id": id, "embedding": vector}]，每批一个事务
+    - session: 单批出错时回滚
+    单批失败只记录日志，未写入的行 embedding 仍为空，下次补全任务会继续处理
+    返回写入的向量维度
+    """
+    dims: set[int] = set()
+    if not ids:
+        return dims
+    batch_size = max(batch_size, 1)
+    total = len(ids)
+    done = 0
+    failed = 0
+    start_time = time.time()
+    model = EmbeddingModelCache.get_model()
+    SQLBotLogUtil.info(f'start {name} embedding, total: {total}, batch size: {batch_size}')
+    for i in range(0, total, batch_size):
+        # 批次之间为排队中的问数等交互任务让出资源
+        scheduler.wait_for_higher_priority(scheduler.get_pool(EMBEDDING_POOL).priority)
+        batch_ids = ids[i:i + batch_size]
+        try:
+            items = load_texts(batch_ids)
+            if items:
+                results = model.embed_documents([item[1] for item in items])
+                save_embeddings([{"id": items[index][0], "embedding": results[index]}
+                                 for index in range(len(results))])
+                dims.update(len(result) for result in results)
+        except Exception as e:
+            failed += len(batch_ids)
+            SQLBotLogUtil.error(f'{name} embedding batch failed: {e}')
+            if session is not None:
+                session.rollback()
+        done += len(batch_ids)
+        elapsed = time.time() - start_time
+        SQLBotLogUtil.info(f'{name} embedding progress: {done}/{total}, failed: {failed}, '
+                           f'{done / elapsed if elapsed > 0 else 0:.2f} rows/s')
+    SQLBotLogUtil.info(f'{name} embedding finished in: {time.time() - start_time:.2f} seconds')
+    return dims
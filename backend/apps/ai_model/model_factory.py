@@ -1,6 +1,9 @@
-from functools import lru_cache
+import copy
 import json
+import threading
+import time
 from abc import ABC, abstractmethod
+from collections import OrderedDict
 from typing import Optional, Dict, Any, Type
 
 from langchain.chat_models.base import BaseChatModel
@@ -9,9 +12,10 @@ from sqlmodel import Session, select
 
 from apps.ai_model.openai.llm import BaseChatOpenAI
 from apps.system.models.system_model import AiModelDetail
+from common.core.config import settings
 from common.core.db import engine
 from common.utils.crypto import sqlbot_decrypt
-from common.utils.utils import prepare_model_arg
+from common.utils.utils import prepare_model_arg, SQLBotLogUtil
 from langchain_community.llms import VLLMOpenAI
 from langchain_openai import AzureChatOpenAI
 # from langchain_community.llms import Tongyi, VLLM
@@ -43,6 +47,17 @@ class LLMConfig(BaseModel):
             hashable_params
         ))
 
+    def without_thinking(self) -> 'LLMConfig':
+        """
+        关闭思考模式（only work while using qwen），返回新的配置，不修改缓存中共享的配置
+        """
+        extra_body = self.additional_params.get('extra_body') if self.additional_params else None
+        if not isinstance(extra_body, dict) or not extra_body.get('enable_thinking'):
+            return self
+        additional_params = copy.deepcopy(self.additional_params)
+        del additional_params['extra_body']['enable_thinking']
+        return self.model_copy(update={'additional_params': additional_params})
+
 
 class BaseLLM(ABC):
     """Abstract base class for large language models"""
@@ -73,12 +88,10 @@ class OpenAIvLLM(BaseLLM):
 
 class OpenAIAzureLLM(BaseLLM):
     def _init_llm(self) -> AzureChatOpenAI:
-        api_version = self.config.additional_params.get("api_version")
-        deployment_name = self.config.additional_params.get("deployment_name")
-        if api_version:
-            self.config.additional_params.pop("api_version")
-        if deployment_name:
-            self.config.additional_params.pop("deployment_name")
+        # 复制一份再取出参数，配置作为缓存 key 不能被修改
+        additional_params = dict(self.config.additional_params)
+        api_version = additional_params.pop("api_version", None)
+        deployment_name = additional_params.pop("deployment_name", None)
         return AzureChatOpenAI(
             azure_endpoint=self.config.api_base_url,
             api_key=self.config.api_key or 'Empty',
@@ -86,7 +99,7 @@ class OpenAIAzureLLM(BaseLLM):
             api_version=api_version,
             deployment_name=deployment_name,
             streaming=True,
-            **self.config.additional_params,
+            **additional_params,
         )
 class OpenAILLM(BaseLLM):
     def _init_llm(self) -> BaseChatModel:
@@ -112,13 +125,42 @@ class LLMFactory:
         "azure": OpenAIAzureLLM,
     }
 
+    # 按配置缓存已创建的模型客户端，复用其中的 HTTP 连接池
+    _lock = threading.Lock()
+    _instances: OrderedDict[LLMConfig, BaseLLM] = OrderedDict()
+
     @classmethod
-    @lru_cache(maxsize=32)
     def create_llm(cls, config: LLMConfig) -> BaseLLM:
         llm_class = cls._llm_types.get(config.model_type)
         if not llm_class:
             raise ValueError(f"Unsupported LLM type: {config.model_type}")
-        return llm_class(config)
+        # 未保存的模型（如模型校验）不缓存
+        if config.model_id is None or settings.LLM_CLIENT_CACHE_SIZE <= 0:
+            return llm_class(config)
+
+        with cls._lock:
+            instance = cls._instances.get(config)
+            if instance is not None:
+                cls._instances.move_to_end(config)
+                return instance
+
+        instance = llm_class(config)
+        with cls._lock:
+            cached = cls._instances.get(config)
+            if cached is not None:
+                cls._instances.move_to_end(config)
+                return cached
+            cls._instances[config] = instance
+            while len(cls._instances) > settings.LLM_CLIENT_CACHE_SIZE:
+                cls._instances.popitem(last=False)
+        return instance
+
+    @classmethod
+    def invalidate(cls, model_id: Optional[int] = None):
+        with cls._lock:
+            for config in [config for config in cls._instances.keys() if
+                           model_id is None or config.model_id == model_id]:
+                cls._instances.pop(config, None)
 
     @classmethod
     def register_llm(cls, model_type: str, llm_class: Type[BaseLLM]):
@@ -138,33 +180,110 @@ class LLMFactory:
     return config """
 
 
+async def build_llm_config(db_model: AiModelDetail) -> LLMConfig:
+    additional_params = {}
+    if db_model.config:
+        try:
+            config_raw = json.loads(db_model.config)
+            additional_params = {item["key"]: prepare_model_arg(item.get('val')) for item in config_raw if "key" in item and "val" in item}
+        except Exception:
+            pass
+    api_domain = db_model.api_domain
+    api_key = db_model.api_key
+    if not api_domain.startswith("http"):
+        api_domain = await sqlbot_decrypt(api_domain)
+        if api_key:
+            api_key = await sqlbot_decrypt(api_key)
+
+    # 构造 LLMConfig
+    return LLMConfig(
+        model_id=db_model.id,
+        model_type="openai" if db_model.protocol == 1 else "vllm",
+        model_name=db_model.base_model,
+        api_key=api_key,
+        api_base_url=api_domain,
+        additional_params=additional_params,
+    )
+
+
+class LLMConfigRegistry:
+    """
+    缓存解密后的模型配置，问题链路上不再查询数据库和解密
+    修改/删除/设置默认模型时调用 invalidate_llm_config 失效，多进程部署时依赖 LLM_CONFIG_CACHE_TTL 过期
+    """
+    _lock = threading.Lock()
+    _version = 0
+    # model_id -> (缓存时间, 配置)
+    _configs: dict[int, tuple[float, LLMConfig]] = {}
+    # (缓存时间, 默认模型 id)
+    _default_model: Optional[tuple[float, int]] = None
+
+    @classmethod
+    def _fresh(cls, cache_time: float) -> bool:
+        return settings.LLM_CONFIG_CACHE_TTL <= 0 or time.monotonic() - cache_time < settings.LLM_CONFIG_CACHE_TTL
+
+    @classmethod
+    def _put(cls, version: int, config: LLMConfig, is_default: bool = False):
+        with cls._lock:
+            # 加载期间被失效过，结果可能已过期，不写入缓存
+            if version != cls._version:
+                return
+            now = time.monotonic()
+            cls._configs[config.model_id] = (now, config)
+            if is_default:
+                cls._default_model = (now, config.model_id)
+
+    @classmethod
+    async def get_default(cls) -> LLMConfig:
+        with cls._lock:
+            version = cls._version
+            default_model = cls._default_model
+            cached = cls._configs.get(default_model[1]) if default_model else None
+        if cached is not None and cls._fresh(default_model[0]) and cls._fresh(cached[0]):
+            return cached[1]
+
+        with Session(engine) as session:
+            db_model = session.exec(
+                select(AiModelDetail).where(AiModelDetail.default_model == True)
+            ).first()
+            if not db_model:
+                raise Exception("The system default model has not been set")
+            config = await build_llm_config(db_model)
+        cls._put(version, config, True)
+        return config
+
+    @classmethod
+    async def get(cls, model_id: int) -> LLMConfig:
+        with cls._lock:
+            version = cls._version
+            cached = cls._configs.get(model_id)
+        if cached is not None and cls._fresh(cached[0]):
+            return cached[1]
+
+        with Session(engine) as session:
+            db_model = session.get(AiModelDetail, model_id)
+            if not db_model:
+                raise ValueError(f"AiModelDetail with id {model_id} not found")
+            config = await build_llm_config(db_model)
+        cls._put(version, config)
+        return config
+
+    @classmethod
+    def invalidate(cls, model_id: Optional[int] = None):
+        with cls._lock:
+            cls._version += 1
+            cls._default_model = None
+            if model_id is None:
+                cls._configs.clear()
+            else:
+                cls._configs.pop(model_id, None)
+
+
 async def get_default_config() -> LLMConfig:
-    with Session(engine) as session:
-        db_model = session.exec(
-            select(AiModelDetail).where(AiModelDetail.default_model == True)
-        ).first()
-        if not db_model:
-            raise Exception("The system default model has not been set")
-
-        additional_params = {}
-        if db_model.config:
-            try:
-                config_raw = json.loads(db_model.config)
-                additional_params = {item["key"]: prepare_model_arg(item.get('val')) for item in config_raw if "key" in item and "val" in item}
-            except Exception:
-                pass
-        if not db_model.api_domain.startswith("http"):
-            db_model.api_domain = await sqlbot_decrypt(db_model.api_domain)
-            if db_model.api_key:
-                db_model.api_key = await sqlbot_decrypt(db_model.api_key)
-            
-
-        # 构造 LLMConfig
-        return LLMConfig(
-            model_id=db_model.id,
-            model_type="openai" if db_model.protocol == 1 else "vllm",
-            model_name=db_model.base_model,
-            api_key=db_model.api_key,
-            api_base_url=db_model.api_domain,
-            additional_params=additional_params,
-        )
+    return await LLMConfigRegistry.get_default()
+
+
+def invalidate_llm_config(model_id: Optional[int] = None):
+    LLMConfigRegistry.invalidate(model_id)
+    LLMFactory.invalidate(model_id)
+    SQLBotLogUtil.info(f"LLM config cache invalidated, model: {model_id if model_id is not None else 'all'}")
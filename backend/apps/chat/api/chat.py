@@ -1,26 +1,34 @@
 import asyncio
-import io
+import base64
 import traceback
 from typing import Optional, List
 
 import orjson
-import pandas as pd
-from fastapi import APIRouter, HTTPException, Path
+from fastapi import APIRouter, HTTPException, Path, Query
 from fastapi.responses import StreamingResponse
 from sqlalchemy import and_, select
+from starlette.background import BackgroundTask
 from starlette.responses import JSONResponse
 
 from apps.chat.curd.chat import list_chats, get_chat_with_records, create_chat, rename_chat, \
     delete_chat, get_chat_chart_data, get_chat_predict_data, get_chat_with_records_with_data, get_chat_record_by_id, \
-    format_json_data, format_json_list_data, get_chart_config, list_recent_questions
+    format_json_data, format_json_list_data, get_chart_config, list_recent_questions, get_chat_record_reasoning
 from apps.chat.models.chat_model import CreateChat, ChatRecord, RenameChat, ChatQuestion, AxisObj, QuickCommand, \
     ChatInfo, Chat, ChatFinishStep
 from apps.chat.task.llm import LLMService
+from apps.datasource.models.datasource import CoreDatasource
+from apps.db.db import stream_sql as stream_sql_result
 from apps.swagger.i18n import PLACEHOLDER_PREFIX
 from apps.system.schemas.permission import SqlbotPermission, require_permissions
+from common.core.config import settings
 from common.core.deps import CurrentAssistant, SessionDep, CurrentUser, Trans
 from common.utils.command_utils import parse_quick_command
+from common.error import TaskRejectedError
 from common.utils.data_format import DataFormat
+from common.utils.export_stream import build_xlsx_file, build_csv_file, iter_csv_chunks, iter_file_chunks, \
+    normalize_export_value, remove_quietly, EXPORT_TRUNCATED_HEADER
+from common.utils.task_scheduler import scheduler
+from common.utils.utils import SQLBotLogUtil
 from common.audit.models.log_model import OperationType, OperationModules
 from common.audit.schemas.logger_decorator import LogConfig, system_log
 
@@ -34,10 +42,12 @@ async def chats(session: SessionDep, current_user: CurrentUser):
 
 @router.get("/{chart_id}", response_model=ChatInfo, summary=f"{PLACEHOLDER_PREFIX}get_chat")
 async def get_chat(session: SessionDep, current_user: CurrentUser, chart_id: int, current_assistant: CurrentAssistant,
-                   trans: Trans):
+                   trans: Trans, limit: Optional[int] = Query(None, ge=1, le=200),
+                   before_id: Optional[int] = None, with_reasoning: bool = True):
     def inner():
         return get_chat_with_records(chart_id=chart_id, session=session, current_user=current_user,
-                                     current_assistant=current_assistant, trans=trans)
+                                     current_assistant=current_assistant, trans=trans, limit=limit,
+                                     before_id=before_id, with_reasoning=with_reasoning)
 
     return await asyncio.to_thread(inner)
 
@@ -61,6 +71,14 @@ async def chat_record_data(session: SessionDep, chat_record_id: int):
     return await asyncio.to_thread(inner)
 
 
+@router.get("/record/{chat_record_id}/reasoning", summary=f"{PLACEHOLDER_PREFIX}get_chat_record_reasoning")
+async def chat_record_reasoning(session: SessionDep, current_user: CurrentUser, chat_record_id: int):
+    def inner():
+        return get_chat_record_reasoning(session=session, chat_record_id=chat_record_id, current_user=current_user)
+
+    return await asyncio.to_thread(inner)
+
+
 @router.get("/record/{chat_record_id}/predict_data", summary=f"{PLACEHOLDER_PREFIX}get_chart_predict_data")
 async def chat_predict_data(session: SessionDep, chat_record_id: int):
     def inner():
@@ -131,6 +149,20 @@ async def start_chat(session: SessionDep, current_user: CurrentUser):
         )
 
 
+def get_error_status_code(e: Exception, default: int) -> int:
+    # 任务队列已满
+    if isinstance(e, TaskRejectedError):
+        return 429
+    return default
+
+
+@router.get("/scheduler/status", include_in_schema=False)
+async def scheduler_status(current_user: CurrentUser):
+    if not current_user.isAdmin:
+        raise Exception("no permission to execute")
+    return scheduler.status()
+
+
 @router.post("/recommend_questions/{chat_record_id}", summary=f"{PLACEHOLDER_PREFIX}ask_recommend_questions")
 async def ask_recommend_questions(session: SessionDep, current_user: CurrentUser, chat_record_id: int,
                                   current_assistant: CurrentAssistant, articles_number: Optional[int] = 4):
@@ -155,9 +187,9 @@ async def ask_recommend_questions(session: SessionDep, current_user: CurrentUser
         def _err(_e: Exception):
             yield 'data:' + orjson.dumps({'content': str(_e), 'type': 'error'}).decode() + '\n\n'
 
-        return StreamingResponse(_err(e), media_type="text/event-stream")
+        return StreamingResponse(_err(e), media_type="text/event-stream", status_code=get_error_status_code(e, 200))
 
-    return StreamingResponse(llm_service.await_result(), media_type="text/event-stream")
+    return StreamingResponse(llm_service.await_result_async(), media_type="text/event-stream")
 
 
 @router.get("/recent_questions/{datasource_id}", response_model=List[str],
@@ -287,7 +319,11 @@ async def stream_sql(session: SessionDep, current_user: CurrentUser, request_que
         llm_service = await LLMService.create(session, current_user, request_question, current_assistant,
                                               embedding=embedding)
         llm_service.init_record(session=session)
-        llm_service.run_task_async(in_chat=in_chat, stream=stream, finish_step=finish_step)
+        try:
+            llm_service.run_task_async(in_chat=in_chat, stream=stream, finish_step=finish_step)
+        except TaskRejectedError as e:
+            llm_service.save_error(session=session, message=str(e))
+            raise e
     except Exception as e:
         traceback.print_exc()
 
@@ -295,18 +331,19 @@ async def stream_sql(session: SessionDep, current_user: CurrentUser, request_que
             def _err(_e: Exception):
                 yield 'data:' + orjson.dumps({'content': str(_e), 'type': 'error'}).decode() + '\n\n'
 
-            return StreamingResponse(_err(e), media_type="text/event-stream")
+            return StreamingResponse(_err(e), media_type="text/event-stream",
+                                     status_code=get_error_status_code(e, 200))
         else:
             return JSONResponse(
                 content={'message': str(e)},
-                status_code=500,
+                status_code=get_error_status_code(e, 500),
             )
     if stream:
-        return StreamingResponse(llm_service.await_result(), media_type="text/event-stream")
+        return StreamingResponse(llm_service.await_result_async(), media_type="text/event-stream")
     else:
-        res = llm_service.await_result()
+        res = llm_service.await_result_async()
         raw_data = {}
-        for chunk in res:
+        async for chunk in res:
             if chunk:
                 raw_data = chunk
         status_code = 200
@@ -366,18 +403,19 @@ async def analysis_or_predict(session: SessionDep, current_user: CurrentUser, ch
                     yield f'&#x274c; **ERROR:**\n'
                     yield f'> {str(_e)}\n'
 
-            return StreamingResponse(_err(e), media_type="text/event-stream")
+            return StreamingResponse(_err(e), media_type="text/event-stream",
+                                     status_code=get_error_status_code(e, 200))
         else:
             return JSONResponse(
                 content={'message': str(e)},
-                status_code=500,
+                status_code=get_error_status_code(e, 500),
             )
     if stream:
-        return StreamingResponse(llm_service.await_result(), media_type="text/event-stream")
+        return StreamingResponse(llm_service.await_result_async(), media_type="text/event-stream")
     else:
-        res = llm_service.await_result()
+        res = llm_service.await_result_async()
         raw_data = {}
-        for chunk in res:
+        async for chunk in res:
             if chunk:
                 raw_data = chunk
         status_code = 200
@@ -391,7 +429,8 @@ async def analysis_or_predict(session: SessionDep, current_user: CurrentUser, ch
 
 
 @router.get("/record/{chat_record_id}/excel/export", summary=f"{PLACEHOLDER_PREFIX}export_chart_data")
-async def export_excel(session: SessionDep, chat_record_id: int, trans: Trans):
+async def export_excel(session: SessionDep, current_user: CurrentUser, chat_record_id: int, trans: Trans,
+                       file_type: str = Query('xlsx', pattern='^(xlsx|csv)$')):
     chat_record = session.get(ChatRecord, chat_record_id)
     if not chat_record:
         raise HTTPException(
@@ -401,12 +440,27 @@ async def export_excel(session: SessionDep, chat_record_id: int, trans: Trans):
 
     is_predict_data = chat_record.predict_record_id is not None
 
-    _origin_data = format_json_data(get_chat_chart_data(chat_record_id=chat_record_id, session=session))
+    _stored_data = get_chat_chart_data(chat_record_id=chat_record_id, session=session)
+    _origin_data = format_json_data(_stored_data)
 
-    _base_field = _origin_data.get('fields')
     _data = _origin_data.get('data')
 
-    if not _data:
+    # 保存的数据被截断时（超过展示行数或执行时的行数/字节上限），用服务端游标重新执行保存的 SQL 导出全部数据
+    stored_truncated = bool(_stored_data.get('limit') or _stored_data.get('truncated'))
+    rerun_ds: CoreDatasource | None = None
+    rerun_sql: str | None = None
+    # 小助手的数据源可能是外部数据源，不重新执行；只有提问人本人且仍可访问该数据源时才重新执行
+    if stored_truncated and _stored_data.get('sql') and chat_record.datasource:
+        chat = session.get(Chat, chat_record.chat_id)
+        ds = session.get(CoreDatasource, chat_record.datasource) if chat and chat.origin != 2 else None
+        if ds and chat_record.create_by == current_user.id and ds.oid == current_user.oid:
+            rerun_ds = CoreDatasource(**ds.model_dump())
+            rerun_sql = base64.b64decode(_stored_data.get('sql')).decode('utf-8')
+        elif ds:
+            SQLBotLogUtil.info(f"User {current_user.id} can not rerun the sql of chat record {chat_record_id}, "
+                               f"export the stored data only")
+
+    if not _data and not rerun_sql:
         raise HTTPException(
             status_code=500,
             detail=trans("i18n_excel_export.data_is_empty")
@@ -430,34 +484,45 @@ async def export_excel(session: SessionDep, chat_record_id: int, trans: Trans):
     if is_predict_data:
         _predict_data = format_json_list_data(get_chat_predict_data(chat_record_id=chat_record_id, session=session))
 
-    def inner():
-
-        data_list = DataFormat.convert_large_numbers_in_object_array(_data + _predict_data)
-
-        md_data, _fields_list = DataFormat.convert_object_array_for_pandas(fields, data_list)
-
-        # data, _fields_list, col_formats = LLMService.format_pd_data(fields, _data + _predict_data)
-
-        df = pd.DataFrame(md_data, columns=_fields_list)
-
-        buffer = io.BytesIO()
-
-        with pd.ExcelWriter(buffer, engine='xlsxwriter',
-                            engine_kwargs={'options': {'strings_to_numbers': False}}) as writer:
-            df.to_excel(writer, sheet_name='Sheet1', index=False)
-
-            # 获取 xlsxwriter 的工作簿和工作表对象
-            # workbook = writer.book
-            # worksheet = writer.sheets['Sheet1']
-            #
-            # for col_idx, fmt_type in col_formats.items():
-            #     if fmt_type == 'text':
-            #         worksheet.set_column(col_idx, col_idx, None, workbook.add_format({'num_format': '@'}))
-            #     elif fmt_type == 'number':
-            #         worksheet.set_column(col_idx, col_idx, None, workbook.add_format({'num_format': '0'}))
-
-        buffer.seek(0)
-        return io.BytesIO(buffer.getvalue())
-
-    result = await asyncio.to_thread(inner)
-    return StreamingResponse(result, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+    def format_rows(data_list: list[dict]):
+        data_list = DataFormat.convert_large_numbers_in_object_array(data_list)
+        md_data, _ = DataFormat.convert_object_array_for_pandas(fields, data_list)
+        return md_data
+
+    # 导出数据是否不完整：未重新执行时以保存的数据为准，重新执行时以是否达到 EXPORT_MAX_ROWS 为准
+    export_state = {'truncated': stored_truncated and not rerun_sql}
+
+    def iter_rows():
+        if rerun_sql:
+            with stream_sql_result(rerun_ds, rerun_sql, max_rows=settings.EXPORT_MAX_ROWS) as stream:
+                columns = stream.columns
+                for batch in stream.batches():
+                    yield from format_rows(format_json_list_data(
+                        [{columns[i]: normalize_export_value(value) for i, value in enumerate(row)}
+                         for row in batch]))
+                if stream.truncated:
+                    export_state['truncated'] = True
+                    SQLBotLogUtil.info(f"Export of chat record {chat_record_id} truncated at {stream.row_count} rows")
+        else:
+            yield from format_rows(_data)
+        if _predict_data:
+            yield from format_rows(_predict_data)
+
+    header = [field.name for field in fields]
+
+    if file_type == 'csv' and not rerun_sql:
+        # 逐批生成，不在内存中保留完整数据
+        return StreamingResponse(iter_csv_chunks(header, iter_rows(), settings.SQL_FETCH_BATCH_SIZE),
+                                 media_type="text/csv",
+                                 headers={EXPORT_TRUNCATED_HEADER: str(export_state['truncated']).lower()})
+
+    # 重新执行时是否截断要在读完数据后才知道，先写入临时文件再通过响应头返回
+    if file_type == 'csv':
+        path = await asyncio.to_thread(build_csv_file, header, iter_rows(), settings.SQL_FETCH_BATCH_SIZE)
+        media_type = "text/csv"
+    else:
+        path = await asyncio.to_thread(build_xlsx_file, header, iter_rows())
+        media_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    return StreamingResponse(iter_file_chunks(path), media_type=media_type,
+                             headers={EXPORT_TRUNCATED_HEADER: str(export_state['truncated']).lower()},
+                             background=BackgroundTask(remove_quietly, path))
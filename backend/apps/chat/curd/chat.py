@@ -1,5 +1,5 @@
 import datetime
-from typing import List
+from typing import List, Optional
 
 import orjson
 import sqlparse
@@ -7,12 +7,15 @@ from sqlalchemy import and_, select, update
 from sqlalchemy import desc, func
 from sqlalchemy.orm import aliased
 
+from apps.chat.curd.record_blob import pack_result_data, unpack_result_data, unpack_predict_data, \
+    unpack_record_results, delete_chat_blobs, is_blob_ref, BLOB_TYPE_DATA, BLOB_TYPE_PREDICT_DATA
 from apps.chat.models.chat_model import Chat, ChatRecord, CreateChat, ChatInfo, RenameChat, ChatQuestion, ChatLog, \
     TypeEnum, OperationEnum, ChatRecordResult
 from apps.datasource.crud.recommended_problem import get_datasource_recommended_chart
 from apps.datasource.models.datasource import CoreDatasource
 from apps.system.crud.assistant import AssistantOutDsFactory
 from common.core.deps import CurrentAssistant, SessionDep, CurrentUser, Trans
+from common.utils.data_format import DataFormat
 from common.utils.utils import extract_nested_json
 
 
@@ -81,6 +84,7 @@ def delete_chat(session, chart_id) -> str:
     if not chat:
         return f'Chat with id {chart_id} has been deleted'
 
+    delete_chat_blobs(session, chart_id)
     session.delete(chat)
     session.commit()
 
@@ -133,6 +137,7 @@ def get_last_execute_sql_error(session: SessionDep, chart_id: int):
 
 
 def format_json_data(origin_data: dict):
+    origin_data = DataFormat.columnar_to_rows(origin_data)
     result = {'fields': origin_data.get('fields') if origin_data.get('fields') else []}
     _list = origin_data.get('data') if origin_data.get('data') else []
     data = format_json_list_data(_list)
@@ -179,7 +184,7 @@ def get_chat_chart_data(session: SessionDep, chat_record_id: int):
     res = session.execute(stmt)
     for row in res:
         try:
-            return orjson.loads(row.data)
+            return unpack_result_data(session, orjson.loads(row.data))
         except Exception:
             pass
     return {}
@@ -190,7 +195,7 @@ def get_chat_predict_data(session: SessionDep, chat_record_id: int):
     res = session.execute(stmt)
     for row in res:
         try:
-            return orjson.loads(row.predict_data)
+            return unpack_predict_data(session, orjson.loads(row.predict_data))
         except Exception:
             pass
     return {}
@@ -206,7 +211,14 @@ dynamic_ds_types = [1, 3]
 
 def get_chat_with_records(session: SessionDep, chart_id: int, current_user: CurrentUser,
                           current_assistant: CurrentAssistant, with_data: bool = False,
-                          trans: Trans = None) -> ChatInfo:
+                          trans: Trans = None, limit: Optional[int] = None, before_id: Optional[int] = None,
+                          with_reasoning: bool = True) -> ChatInfo:
+    """
+    limit 不为空时按记录 id 倒序分页，返回 before_id 之前最近的 limit 条记录（仍按时间正序排列），
+    has_more 表示是否还有更早的记录，前端以当前最早的记录 id 作为下一页的 before_id
+    with_reasoning 为 False 时不查询思考过程（sql_answer/chart_answer 及 chat_log 中的 reasoning_content），
+    通过 get_chat_record_reasoning 按记录单独获取
+    """
     chat = session.get(Chat, chart_id)
     if not chat:
         raise Exception(f"Chat with id {chart_id} not found")
@@ -227,83 +239,24 @@ def get_chat_with_records(session: SessionDep, chart_id: int, current_user: Curr
         chat_info.datasource_name = ds.name
         chat_info.ds_type = ds.type
 
-    sql_alias_log = aliased(ChatLog)
-    chart_alias_log = aliased(ChatLog)
-    analysis_alias_log = aliased(ChatLog)
-    predict_alias_log = aliased(ChatLog)
-
-    stmt = (select(ChatRecord.id, ChatRecord.chat_id, ChatRecord.create_time, ChatRecord.finish_time,
-                   ChatRecord.question, ChatRecord.sql_answer, ChatRecord.sql,
-                   ChatRecord.chart_answer, ChatRecord.chart, ChatRecord.analysis, ChatRecord.predict,
-                   ChatRecord.datasource_select_answer, ChatRecord.analysis_record_id, ChatRecord.predict_record_id,
-                   ChatRecord.regenerate_record_id,
-                   ChatRecord.recommended_question, ChatRecord.first_chat,
-                   ChatRecord.finish, ChatRecord.error,
-                   sql_alias_log.reasoning_content.label('sql_reasoning_content'),
-                   chart_alias_log.reasoning_content.label('chart_reasoning_content'),
-                   analysis_alias_log.reasoning_content.label('analysis_reasoning_content'),
-                   predict_alias_log.reasoning_content.label('predict_reasoning_content')
-                   )
-    .outerjoin(sql_alias_log, and_(sql_alias_log.pid == ChatRecord.id,
-                                   sql_alias_log.type == TypeEnum.CHAT,
-                                   sql_alias_log.operate == OperationEnum.GENERATE_SQL))
-    .outerjoin(chart_alias_log, and_(chart_alias_log.pid == ChatRecord.id,
-                                     chart_alias_log.type == TypeEnum.CHAT,
-                                     chart_alias_log.operate == OperationEnum.GENERATE_CHART))
-    .outerjoin(analysis_alias_log, and_(analysis_alias_log.pid == ChatRecord.id,
-                                        analysis_alias_log.type == TypeEnum.CHAT,
-                                        analysis_alias_log.operate == OperationEnum.ANALYSIS))
-    .outerjoin(predict_alias_log, and_(predict_alias_log.pid == ChatRecord.id,
-                                       predict_alias_log.type == TypeEnum.CHAT,
-                                       predict_alias_log.operate == OperationEnum.PREDICT_DATA))
-    .where(and_(ChatRecord.create_by == current_user.id, ChatRecord.chat_id == chart_id)).order_by(
-        ChatRecord.create_time))
-    if with_data:
-        stmt = select(ChatRecord.id, ChatRecord.chat_id, ChatRecord.create_time, ChatRecord.finish_time,
-                      ChatRecord.question, ChatRecord.sql_answer, ChatRecord.sql,
-                      ChatRecord.chart_answer, ChatRecord.chart, ChatRecord.analysis, ChatRecord.predict,
-                      ChatRecord.datasource_select_answer, ChatRecord.analysis_record_id, ChatRecord.predict_record_id,
-                      ChatRecord.regenerate_record_id,
-                      ChatRecord.recommended_question, ChatRecord.first_chat,
-                      ChatRecord.finish, ChatRecord.error, ChatRecord.data, ChatRecord.predict_data).where(
-            and_(ChatRecord.create_by == current_user.id, ChatRecord.chat_id == chart_id)).order_by(
-            ChatRecord.create_time)
+    stmt = build_chat_record_stmt(with_data=with_data, with_reasoning=with_reasoning).where(
+        and_(ChatRecord.create_by == current_user.id, ChatRecord.chat_id == chart_id))
+    if limit is not None and limit > 0:
+        if before_id is not None:
+            stmt = stmt.where(ChatRecord.id < before_id)
+        rows = session.execute(stmt.order_by(ChatRecord.id.desc()).limit(limit + 1)).all()
+        chat_info.has_more = len(rows) > limit
+        rows = list(reversed(rows[:limit]))
+    else:
+        rows = session.execute(stmt.order_by(ChatRecord.create_time)).all()
 
-    result = session.execute(stmt).all()
-    record_list: list[ChatRecordResult] = []
-    for row in result:
-        if not with_data:
-            record_list.append(
-                ChatRecordResult(id=row.id, chat_id=row.chat_id, create_time=row.create_time,
-                                 finish_time=row.finish_time,
-                                 question=row.question, sql_answer=row.sql_answer, sql=row.sql,
-                                 chart_answer=row.chart_answer, chart=row.chart,
-                                 analysis=row.analysis, predict=row.predict,
-                                 datasource_select_answer=row.datasource_select_answer,
-                                 analysis_record_id=row.analysis_record_id, predict_record_id=row.predict_record_id,
-                                 regenerate_record_id=row.regenerate_record_id,
-                                 recommended_question=row.recommended_question, first_chat=row.first_chat,
-                                 finish=row.finish, error=row.error,
-                                 sql_reasoning_content=row.sql_reasoning_content,
-                                 chart_reasoning_content=row.chart_reasoning_content,
-                                 analysis_reasoning_content=row.analysis_reasoning_content,
-                                 predict_reasoning_content=row.predict_reasoning_content,
-                                 ))
-        else:
-            record_list.append(
-                ChatRecordResult(id=row.id, chat_id=row.chat_id, create_time=row.create_time,
-                                 finish_time=row.finish_time,
-                                 question=row.question, sql_answer=row.sql_answer, sql=row.sql,
-                                 chart_answer=row.chart_answer, chart=row.chart,
-                                 analysis=row.analysis, predict=row.predict,
-                                 datasource_select_answer=row.datasource_select_answer,
-                                 analysis_record_id=row.analysis_record_id, predict_record_id=row.predict_record_id,
-                                 regenerate_record_id=row.regenerate_record_id,
-                                 recommended_question=row.recommended_question, first_chat=row.first_chat,
-                                 finish=row.finish, error=row.error, data=row.data, predict_data=row.predict_data))
+    record_list: list[ChatRecordResult] = [ChatRecordResult(**row._mapping) for row in rows]
 
     result = list(map(format_record, record_list))
 
+    if with_data:
+        unpack_record_results(session, result)
+
     for row in result:
         try:
             data_value = row.get('data')
@@ -317,6 +270,59 @@ def get_chat_with_records(session: SessionDep, chart_id: int, current_user: Curr
     return chat_info
 
 
+def build_chat_record_stmt(with_data: bool = False, with_reasoning: bool = True):
+    columns = [ChatRecord.id, ChatRecord.chat_id, ChatRecord.create_time, ChatRecord.finish_time,
+               ChatRecord.question, ChatRecord.sql, ChatRecord.chart, ChatRecord.analysis, ChatRecord.predict,
+               ChatRecord.datasource_select_answer, ChatRecord.analysis_record_id, ChatRecord.predict_record_id,
+               ChatRecord.regenerate_record_id,
+               ChatRecord.recommended_question, ChatRecord.first_chat,
+               ChatRecord.finish, ChatRecord.error]
+    if with_reasoning:
+        columns += [ChatRecord.sql_answer, ChatRecord.chart_answer]
+    if with_data:
+        columns += [ChatRecord.data, ChatRecord.predict_data]
+    # 带数据的查询不关联 chat_log
+    if not with_reasoning or with_data:
+        return select(*columns)
+
+    sql_alias_log = aliased(ChatLog)
+    chart_alias_log = aliased(ChatLog)
+    analysis_alias_log = aliased(ChatLog)
+    predict_alias_log = aliased(ChatLog)
+
+    return (select(*columns,
+                   sql_alias_log.reasoning_content.label('sql_reasoning_content'),
+                   chart_alias_log.reasoning_content.label('chart_reasoning_content'),
+                   analysis_alias_log.reasoning_content.label('analysis_reasoning_content'),
+                   predict_alias_log.reasoning_content.label('predict_reasoning_content'))
+            .outerjoin(sql_alias_log, and_(sql_alias_log.pid == ChatRecord.id,
+                                           sql_alias_log.type == TypeEnum.CHAT,
+                                           sql_alias_log.operate == OperationEnum.GENERATE_SQL))
+            .outerjoin(chart_alias_log, and_(chart_alias_log.pid == ChatRecord.id,
+                                             chart_alias_log.type == TypeEnum.CHAT,
+                                             chart_alias_log.operate == OperationEnum.GENERATE_CHART))
+            .outerjoin(analysis_alias_log, and_(analysis_alias_log.pid == ChatRecord.id,
+                                                analysis_alias_log.type == TypeEnum.CHAT,
+                                                analysis_alias_log.operate == OperationEnum.ANALYSIS))
+            .outerjoin(predict_alias_log, and_(predict_alias_log.pid == ChatRecord.id,
+                                               predict_alias_log.type == TypeEnum.CHAT,
+                                               predict_alias_log.operate == OperationEnum.PREDICT_DATA)))
+
+
+def get_chat_record_reasoning(session: SessionDep, chat_record_id: int, current_user: CurrentUser) -> dict:
+    stmt = build_chat_record_stmt().where(
+        and_(ChatRecord.id == chat_record_id, ChatRecord.create_by == current_user.id))
+    row = session.execute(stmt).first()
+    if not row:
+        raise Exception(f"Chat record with id {chat_record_id} not found")
+    _dict = format_record(ChatRecordResult(**row._mapping))
+    return {'id': chat_record_id,
+            'sql_answer': _dict.get('sql_answer'),
+            'chart_answer': _dict.get('chart_answer'),
+            'analysis_thinking': _dict.get('analysis_thinking'),
+            'predict': _dict.get('predict')}
+
+
 def format_record(record: ChatRecordResult):
     _dict = record.model_dump()
 
@@ -349,7 +355,7 @@ def format_record(record: ChatRecordResult):
     if record.data and record.data.strip() != '':
         try:
             _obj = orjson.loads(record.data)
-            _dict['data'] = _obj
+            _dict['data'] = DataFormat.columnar_to_rows(_obj)
         except Exception:
             pass
     if record.predict_data and record.predict_data.strip() != '':
@@ -524,6 +530,13 @@ def save_analysis_predict_record(session: SessionDep, base_record: ChatRecord, a
     session.flush()
     session.refresh(record)
     result.id = record.id
+
+    # data 为 blob 引用时按新记录重新保存，不与原记录共用 blob（原记录重新保存或删除 blob 后会退化为预览数据）
+    data_obj = orjson.loads(base_record.data) if base_record.data else None
+    if is_blob_ref(data_obj):
+        record.data = pack_result_data(session, record.id,
+                                       orjson.dumps(unpack_result_data(session, data_obj)).decode(), BLOB_TYPE_DATA)
+        result.data = record.data
     session.commit()
 
     return result
@@ -746,7 +759,7 @@ def save_predict_data(session: SessionDep, record_id: int, data: str = '') -> Ch
         raise Exception("Record id cannot be None")
     record = get_chat_record_by_id(session, record_id)
 
-    record.predict_data = data
+    record.predict_data = pack_result_data(session, record_id, data, BLOB_TYPE_PREDICT_DATA)
 
     result = ChatRecord(**record.model_dump())
 
@@ -790,7 +803,7 @@ def save_sql_exec_data(session: SessionDep, record_id: int, data: str) -> ChatRe
         raise Exception("Record id cannot be None")
     record = get_chat_record_by_id(session, record_id)
 
-    record.data = data
+    record.data = pack_result_data(session, record_id, data, BLOB_TYPE_DATA)
 
     result = ChatRecord(**record.model_dump())
 
@@ -0,0 +1,125 @@
+import datetime
+import zlib
+from typing import Any, Optional
+
+import orjson
+from sqlalchemy import select, delete, and_
+
+from apps.chat.models.chat_model import ChatRecord, ChatRecordBlob
+from common.core.config import settings
+from common.core.deps import SessionDep
+from common.utils.data_format import DataFormat
+
+BLOB_ENCODING = 'zlib+columnar-json'
+BLOB_TYPE_DATA = 'data'
+BLOB_TYPE_PREDICT_DATA = 'predict_data'
+
+
+def pack_result_data(session: SessionDep, record_id: int, data: Optional[str], blob_type: str) -> Optional[str]:
+    """
+    结果 JSON 超过 CHAT_RESULT_BLOB_THRESHOLD 时按列式编码、zlib 压缩写入 chat_record_blob（随调用方一起提交），
+    返回保存到 chat_record 的引用：{原结果中数据以外的字段, "data": 前 CHAT_RESULT_PREVIEW_ROWS 行, "blob_id", "row_count"}
+    同一记录同类型的旧 blob 会先删除
+    """
+    session.execute(delete(ChatRecordBlob).where(
+        and_(ChatRecordBlob.record_id == record_id, ChatRecordBlob.type == blob_type)))
+    if not data or settings.CHAT_RESULT_BLOB_THRESHOLD <= 0 or len(data) <= settings.CHAT_RESULT_BLOB_THRESHOLD:
+        return data
+    obj = orjson.loads(data)
+    if blob_type == BLOB_TYPE_PREDICT_DATA:
+        if not isinstance(obj, list):
+            return data
+        obj = {'data': obj}
+    elif not isinstance(obj, dict):
+        return data
+
+    columnar = DataFormat.rows_to_columnar(obj)
+    columns = columnar.get('columns') or []
+    row_count = len(columns[0]) if columns else 0
+    blob = ChatRecordBlob(record_id=record_id, type=blob_type, encoding=BLOB_ENCODING, row_count=row_count,
+                          size=len(data), content=zlib.compress(orjson.dumps(columnar)),
+                          create_time=datetime.datetime.now())
+    session.add(blob)
+    session.flush()
+
+    preview_size = max(settings.CHAT_RESULT_PREVIEW_ROWS, 0)
+    if DataFormat.is_columnar(obj):
+        ref = DataFormat.columnar_to_rows({**obj, 'columns': [values[:preview_size] for values in columns]})
+    else:
+        ref = {**obj, 'data': (obj.get('data') or [])[:preview_size]}
+    ref['blob_id'] = blob.id
+    ref['row_count'] = row_count
+    return orjson.dumps(ref).decode()
+
+
+def delete_chat_blobs(session: SessionDep, chat_id: int):
+    """
+    删除对话下所有记录的 blob（随调用方一起提交）
+    """
+    record_ids = select(ChatRecord.id).where(ChatRecord.chat_id == chat_id)
+    session.execute(delete(ChatRecordBlob).where(ChatRecordBlob.record_id.in_(record_ids)))
+
+
+def is_blob_ref(obj: Any) -> bool:
+    return isinstance(obj, dict) and obj.get('blob_id') is not None
+
+
+def load_result_blobs(session: SessionDep, blob_ids: list[int]) -> dict[int, dict]:
+    if not blob_ids:
+        return {}
+    stmt = select(ChatRecordBlob.id, ChatRecordBlob.encoding, ChatRecordBlob.content).where(
+        ChatRecordBlob.id.in_(list(set(blob_ids))))
+    blobs = {}
+    for row in session.execute(stmt):
+        if row.encoding != BLOB_ENCODING:
+            continue
+        blobs[row.id] = DataFormat.columnar_to_rows(orjson.loads(zlib.decompress(row.content)))
+    return blobs
+
+
+def _merge_blob(ref: dict, blob: Optional[dict]) -> dict:
+    result = {key: value for key, value in ref.items() if key != 'blob_id' and key != 'row_count'}
+    if blob is not None:
+        result['data'] = blob.get('data') or []
+    return result
+
+
+def unpack_result_data(session: SessionDep, obj: Any, blobs: Optional[dict[int, dict]] = None):
+    """
+    还原 chat_record.data，返回行格式 {"fields", "data": [dict]}；blob 丢失时返回预览数据
+    """
+    if not is_blob_ref(obj):
+        return DataFormat.columnar_to_rows(obj)
+    if blobs is None:
+        blobs = load_result_blobs(session, [obj.get('blob_id')])
+    return _merge_blob(obj, blobs.get(obj.get('blob_id')))
+
+
+def unpack_predict_data(session: SessionDep, obj: Any, blobs: Optional[dict[int, dict]] = None):
+    """
+    还原 chat_record.predict_data，返回 list[dict]
+    """
+    if not is_blob_ref(obj):
+        return obj
+    if blobs is None:
+        blobs = load_result_blobs(session, [obj.get('blob_id')])
+    return _merge_blob(obj, blobs.get(obj.get('blob_id'))).get('data') or []
+
+
+def unpack_record_results(session: SessionDep, records: list[dict]):
+    """
+    批量还原多条记录中的 data/predict_data，blob 只查询一次
+    """
+    blob_ids = []
+    for record in records:
+        for key in ('data', 'predict_data'):
+            if is_blob_ref(record.get(key)):
+                blob_ids.append(record.get(key).get('blob_id'))
+    if not blob_ids:
+        return
+    blobs = load_result_blobs(session, blob_ids)
+    for record in records:
+        if is_blob_ref(record.get('data')):
+            record['data'] = unpack_result_data(session, record.get('data'), blobs)
+        if is_blob_ref(record.get('predict_data')):
+            record['predict_data'] = unpack_predict_data(session, record.get('predict_data'), blobs)
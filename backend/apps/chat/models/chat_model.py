@@ -4,7 +4,7 @@ from typing import List, Optional, Union
 
 from fastapi import Body
 from pydantic import BaseModel
-from sqlalchemy import Column, Integer, Text, BigInteger, DateTime, Identity, Boolean
+from sqlalchemy import Column, Integer, Text, BigInteger, DateTime, Identity, Boolean, LargeBinary
 from sqlalchemy import Enum as SQLAlchemyEnum
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlmodel import SQLModel, Field
@@ -119,6 +119,21 @@ class ChatRecord(SQLModel, table=True):
     regenerate_record_id: int = Field(sa_column=Column(BigInteger, nullable=True))
 
 
+class ChatRecordBlob(SQLModel, table=True):
+    """
+    较大的查询结果（data/predict_data）压缩后单独保存，chat_record 中只保留引用、行数和少量预览数据
+    """
+    __tablename__ = "chat_record_blob"
+    id: Optional[int] = Field(sa_column=Column(BigInteger, Identity(always=True), primary_key=True))
+    record_id: int = Field(sa_column=Column(BigInteger, nullable=False, index=True))
+    type: str = Field(max_length=32, nullable=False)
+    encoding: str = Field(max_length=32, nullable=False)
+    row_count: int = Field(sa_column=Column(BigInteger, nullable=True))
+    size: int = Field(sa_column=Column(BigInteger, nullable=True))
+    content: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+    create_time: datetime = Field(sa_column=Column(DateTime(timezone=False), nullable=True))
+
+
 class ChatRecordResult(BaseModel):
     id: Optional[int] = None
     chat_id: Optional[int] = None
@@ -173,6 +188,7 @@ class ChatInfo(BaseModel):
     datasource_name: str = ''
     datasource_exists: bool = True
     records: List[ChatRecord | dict] = []
+    has_more: bool = False
 
 
 class AiModelQuestion(BaseModel):
@@ -1,12 +1,12 @@
-import concurrent
+import asyncio
 import json
 import os
 import traceback
 import urllib.parse
 import warnings
-from concurrent.futures import ThreadPoolExecutor, Future
+from concurrent.futures import Future
 from datetime import datetime
-from typing import Any, List, Optional, Union, Dict, Iterator
+from typing import Any, List, Optional, Union, Dict, Iterator, AsyncIterator
 
 import orjson
 import pandas as pd
@@ -25,6 +25,7 @@ from apps.system.models.custom_prompt_model import CustomPromptTypeEnum
 from sqlbot_xpack.license.license_manage import SQLBotLicenseUtil
 from sqlmodel import Session
 
+from apps.ai_model.embedding import query_embedding_scope
 from apps.ai_model.model_factory import LLMConfig, LLMFactory, get_default_config
 from apps.chat.curd.chat import save_question, save_sql_answer, save_sql, \
     save_error_message, save_sql_exec_data, save_chart_answer, save_chart, \
@@ -41,7 +42,8 @@ from apps.datasource.crud.datasource import get_table_schema
 from apps.datasource.crud.permission import get_row_permission_filters, is_normal_user
 from apps.datasource.embedding.ds_embedding import get_ds_embedding
 from apps.datasource.models.datasource import CoreDatasource
-from apps.db.db import exec_sql, get_version, check_connection
+from apps.db.db import exec_sql, check_connection
+from apps.db.ds_metadata import get_ds_version
 from apps.system.crud.assistant import AssistantOutDs, AssistantOutDsFactory, get_assistant_ds
 from apps.system.crud.parameter_manage import get_groups
 from apps.system.schemas.system_schema import AssistantOutDsSchema
@@ -49,22 +51,27 @@ from apps.terminology.curd.terminology import get_terminology_template
 from common.core.config import settings
 from common.core.db import engine
 from common.core.deps import CurrentAssistant, CurrentUser
-from common.error import SingleMessageError, SQLBotDBError, ParseSQLResultError, SQLBotDBConnectionError
+from common.error import SingleMessageError, SQLBotDBError, ParseSQLResultError, SQLBotDBConnectionError, \
+    TaskRejectedError
 from common.utils.data_format import DataFormat
 from common.utils.locale import I18n, I18nHelper
+from common.utils.chunk_stream import ChunkStream, iterate_async_generator
+from common.utils.task_scheduler import scheduler, CHAT_POOL, ANALYSIS_POOL, RECOMMEND_POOL, DB_EXECUTOR, \
+    DATASOURCE_EXECUTOR
 from common.utils.utils import SQLBotLogUtil, extract_nested_json, prepare_for_orjson
 
 warnings.filterwarnings("ignore")
 
 base_message_count_limit = 6
 
-executor = ThreadPoolExecutor(max_workers=200)
-
 dynamic_ds_types = [1, 3]
 dynamic_subsql_prefix = 'select * from sqlbot_dynamic_temp_table_'
 
 session_maker = scoped_session(sessionmaker(bind=engine, class_=Session))
 
+# 异步模式下运行中的任务，保持引用避免被回收
+_running_tasks: set[asyncio.Task] = set()
+
 i18n = I18n()
 
 
@@ -88,8 +95,9 @@ class LLMService:
 
     current_logs: dict[OperationEnum, ChatLog] = {}
 
-    chunk_list: List[str] = []
+    chunk_stream: ChunkStream = None
     future: Future
+    async_mode: bool = False
 
     trans: I18nHelper = None
 
@@ -101,7 +109,7 @@ class LLMService:
     def __init__(self, session: Session, current_user: CurrentUser, chat_question: ChatQuestion,
                  current_assistant: Optional[CurrentAssistant] = None, no_reasoning: bool = False,
                  embedding: bool = False, config: LLMConfig = None):
-        self.chunk_list = []
+        self.chunk_stream = None
         self.current_user = current_user
         self.current_assistant = current_assistant
         chat_id = chat_question.chat_id
@@ -116,13 +124,13 @@ class LLMService:
                 ds = self.out_ds_instance.get_ds(chat.datasource)
                 if not ds:
                     raise SingleMessageError("No available datasource configuration found")
-                chat_question.engine = ds.type + get_version(ds)
+                chat_question.engine = ds.type + get_ds_version(ds)
                 chat_question.db_schema = self.out_ds_instance.get_db_schema(ds.id, chat_question.question)
             else:
                 ds = session.get(CoreDatasource, chat.datasource)
                 if not ds:
                     raise SingleMessageError("No available datasource configuration found")
-                chat_question.engine = (ds.type_name if ds.type != 'excel' else 'PostgreSQL') + get_version(ds)
+                chat_question.engine = (ds.type_name if ds.type != 'excel' else 'PostgreSQL') + get_ds_version(ds)
                 chat_question.db_schema = get_table_schema(session=session, current_user=current_user, ds=ds,
                                                            question=chat_question.question, embedding=embedding)
 
@@ -137,13 +145,8 @@ class LLMService:
         self.ds = (
             ds if isinstance(ds, AssistantOutDsSchema) else CoreDatasource(**ds.model_dump())) if ds else None
         self.chat_question = chat_question
-        self.config = config
-        if no_reasoning:
-            # only work while using qwen
-            if self.config.additional_params:
-                if self.config.additional_params.get('extra_body'):
-                    if self.config.additional_params.get('extra_body').get('enable_thinking'):
-                        del self.config.additional_params['extra_body']['enable_thinking']
+        # config 来自缓存，不能直接修改
+        self.config = config.without_thinking() if no_reasoning else config
 
         self.chat_question.ai_modal_id = self.config.model_id
         self.chat_question.ai_modal_name = self.config.model_name
@@ -175,16 +178,6 @@ class LLMService:
                     instance.enable_sql_row_limit = False
         return instance
 
-    def is_running(self, timeout=0.5):
-        try:
-            r = concurrent.futures.wait([self.future], timeout)
-            if len(r.not_done) > 0:
-                return True
-            else:
-                return False
-        except Exception as e:
-            return True
-
     def init_messages(self):
         last_sql_messages: List[dict[str, Any]] = self.generate_sql_logs[-1].messages if len(
             self.generate_sql_logs) > 0 else []
@@ -243,11 +236,36 @@ class LLMService:
     def set_articles_number(self, articles_number: int):
         self.articles_number = articles_number
 
+    async def run_sync(self, fn, *args, **kwargs):
+        """
+        同步的数据库/网络调用：异步模式下放到专用的有界线程池中执行，避免阻塞事件循环；线程模式下直接执行
+        """
+        if self.async_mode:
+            return await scheduler.run_blocking(DB_EXECUTOR, fn, *args, **kwargs)
+        return fn(*args, **kwargs)
+
+    async def run_datasource_sync(self, fn, *args, **kwargs):
+        """
+        访问目标数据源的同步调用（连接检查、版本探测、执行 SQL），与 SQLBot 自身数据库的调用使用不同线程池，
+        慢数据源不会占满其他对话读写元数据的线程
+        """
+        if self.async_mode:
+            return await scheduler.run_blocking(DATASOURCE_EXECUTOR, fn, *args, **kwargs)
+        return fn(*args, **kwargs)
+
+    async def stream_llm(self, messages: List[Union[BaseMessage, dict[str, Any]]], token_usage: Dict[str, Any]):
+        if self.async_mode:
+            async for chunk in aprocess_stream(self.llm.astream(messages), token_usage):
+                yield chunk
+        else:
+            for chunk in process_stream(self.llm.stream(messages), token_usage):
+                yield chunk
+
     def get_fields_from_chart(self, _session: Session):
         chart_info = get_chart_config(_session, self.record.id)
         return format_chart_fields(chart_info)
 
-    def generate_analysis(self, _session: Session):
+    def prepare_analysis(self, _session: Session) -> List[Union[BaseMessage, dict[str, Any]]]:
         fields = self.get_fields_from_chart(_session)
         self.chat_question.fields = orjson.dumps(fields).decode()
         data = get_chat_chart_data(_session, self.record.id)
@@ -259,7 +277,7 @@ class LLMService:
                                                                     self.current_user.oid, ds_id)
         # if SQLBotLicenseUtil.valid():
         self.chat_question.custom_prompt = find_custom_prompts(_session, CustomPromptTypeEnum.ANALYSIS,
-                                                                   self.current_user.oid, ds_id)
+                                                               self.current_user.oid, ds_id)
 
         analysis_msg.append(SystemMessage(content=self.chat_question.analysis_sys_question()))
         analysis_msg.append(HumanMessage(content=self.chat_question.analysis_user_question()))
@@ -274,17 +292,10 @@ class LLMService:
                                                                    'content': msg.content} for
                                                                   msg
                                                                   in analysis_msg])
-        full_thinking_text = ''
-        full_analysis_text = ''
-        token_usage = {}
-        res = process_stream(self.llm.stream(analysis_msg), token_usage)
-        for chunk in res:
-            if chunk.get('content'):
-                full_analysis_text += chunk.get('content')
-            if chunk.get('reasoning_content'):
-                full_thinking_text += chunk.get('reasoning_content')
-            yield chunk
+        return analysis_msg
 
+    def finish_analysis(self, _session: Session, analysis_msg: List[Union[BaseMessage, dict[str, Any]]],
+                        full_analysis_text: str, full_thinking_text: str, token_usage: Dict[str, Any]):
         analysis_msg.append(AIMessage(full_analysis_text))
 
         self.current_logs[OperationEnum.ANALYSIS] = end_log(session=_session,
@@ -299,7 +310,22 @@ class LLMService:
         self.record = save_analysis_answer(session=_session, record_id=self.record.id,
                                            answer=orjson.dumps({'content': full_analysis_text}).decode())
 
-    def generate_predict(self, _session: Session):
+    async def generate_analysis(self, _session: Session):
+        analysis_msg = await self.run_sync(self.prepare_analysis, _session)
+        full_thinking_text = ''
+        full_analysis_text = ''
+        token_usage = {}
+        async for chunk in self.stream_llm(analysis_msg, token_usage):
+            if chunk.get('content'):
+                full_analysis_text += chunk.get('content')
+            if chunk.get('reasoning_content'):
+                full_thinking_text += chunk.get('reasoning_content')
+            yield chunk
+
+        await self.run_sync(self.finish_analysis, _session, analysis_msg, full_analysis_text, full_thinking_text,
+                            token_usage)
+
+    def prepare_predict(self, _session: Session) -> List[Union[BaseMessage, dict[str, Any]]]:
         fields = self.get_fields_from_chart(_session)
         self.chat_question.fields = orjson.dumps(fields).decode()
         data = get_chat_chart_data(_session, self.record.id)
@@ -308,7 +334,7 @@ class LLMService:
         # if SQLBotLicenseUtil.valid():
         ds_id = self.ds.id if isinstance(self.ds, CoreDatasource) else None
         self.chat_question.custom_prompt = find_custom_prompts(_session, CustomPromptTypeEnum.PREDICT_DATA,
-                                                                   self.current_user.oid, ds_id)
+                                                               self.current_user.oid, ds_id)
 
         predict_msg: List[Union[BaseMessage, dict[str, Any]]] = []
         predict_msg.append(SystemMessage(content=self.chat_question.predict_sys_question()))
@@ -324,17 +350,10 @@ class LLMService:
                                                                        'content': msg.content} for
                                                                       msg
                                                                       in predict_msg])
-        full_thinking_text = ''
-        full_predict_text = ''
-        token_usage = {}
-        res = process_stream(self.llm.stream(predict_msg), token_usage)
-        for chunk in res:
-            if chunk.get('content'):
-                full_predict_text += chunk.get('content')
-            if chunk.get('reasoning_content'):
-                full_thinking_text += chunk.get('reasoning_content')
-            yield chunk
+        return predict_msg
 
+    def finish_predict(self, _session: Session, predict_msg: List[Union[BaseMessage, dict[str, Any]]],
+                       full_predict_text: str, full_thinking_text: str, token_usage: Dict[str, Any]):
         predict_msg.append(AIMessage(full_predict_text))
         self.record = save_predict_answer(session=_session, record_id=self.record.id,
                                           answer=orjson.dumps({'content': full_predict_text}).decode())
@@ -348,8 +367,22 @@ class LLMService:
                                                                 reasoning_content=full_thinking_text,
                                                                 token_usage=token_usage)
 
-    def generate_recommend_questions_task(self, _session: Session):
+    async def generate_predict(self, _session: Session):
+        predict_msg = await self.run_sync(self.prepare_predict, _session)
+        full_thinking_text = ''
+        full_predict_text = ''
+        token_usage = {}
+        async for chunk in self.stream_llm(predict_msg, token_usage):
+            if chunk.get('content'):
+                full_predict_text += chunk.get('content')
+            if chunk.get('reasoning_content'):
+                full_thinking_text += chunk.get('reasoning_content')
+            yield chunk
+
+        await self.run_sync(self.finish_predict, _session, predict_msg, full_predict_text, full_thinking_text,
+                            token_usage)
 
+    def prepare_recommend_questions(self, _session: Session) -> List[Union[BaseMessage, dict[str, Any]]]:
         # get schema
         if self.ds and not self.chat_question.db_schema:
             self.chat_question.db_schema = self.out_ds_instance.get_db_schema(
@@ -376,17 +409,10 @@ class LLMService:
                                                                                          'content': msg.content} for
                                                                                         msg
                                                                                         in guess_msg])
-        full_thinking_text = ''
-        full_guess_text = ''
-        token_usage = {}
-        res = process_stream(self.llm.stream(guess_msg), token_usage)
-        for chunk in res:
-            if chunk.get('content'):
-                full_guess_text += chunk.get('content')
-            if chunk.get('reasoning_content'):
-                full_thinking_text += chunk.get('reasoning_content')
-            yield chunk
+        return guess_msg
 
+    def finish_recommend_questions(self, _session: Session, guess_msg: List[Union[BaseMessage, dict[str, Any]]],
+                                   full_guess_text: str, full_thinking_text: str, token_usage: Dict[str, Any]):
         guess_msg.append(AIMessage(full_guess_text))
 
         self.current_logs[OperationEnum.GENERATE_RECOMMENDED_QUESTIONS] = end_log(session=_session,
@@ -401,11 +427,24 @@ class LLMService:
         self.record = save_recommend_question_answer(session=_session, record_id=self.record.id,
                                                      answer={'content': full_guess_text})
 
+    async def generate_recommend_questions_task(self, _session: Session):
+        guess_msg = await self.run_sync(self.prepare_recommend_questions, _session)
+        full_thinking_text = ''
+        full_guess_text = ''
+        token_usage = {}
+        async for chunk in self.stream_llm(guess_msg, token_usage):
+            if chunk.get('content'):
+                full_guess_text += chunk.get('content')
+            if chunk.get('reasoning_content'):
+                full_thinking_text += chunk.get('reasoning_content')
+            yield chunk
+
+        await self.run_sync(self.finish_recommend_questions, _session, guess_msg, full_guess_text,
+                            full_thinking_text, token_usage)
+
         yield {'recommended_question': self.record.recommended_question}
 
-    def select_datasource(self, _session: Session):
-        datasource_msg: List[Union[BaseMessage, dict[str, Any]]] = []
-        datasource_msg.append(SystemMessage(self.chat_question.datasource_sys_question()))
+    def get_datasource_list(self, _session: Session) -> list[dict]:
         if self.current_assistant and self.current_assistant.type != 4:
             _ds_list = get_assistant_ds(session=_session, llm_service=self)
         else:
@@ -421,65 +460,37 @@ class LLMService:
             ]
         if not _ds_list:
             raise SingleMessageError('No available datasource configuration found')
-        ignore_auto_select = _ds_list and len(_ds_list) == 1
-        # ignore auto select ds
-
-        full_thinking_text = ''
-        full_text = ''
-        if not ignore_auto_select:
-            if settings.TABLE_EMBEDDING_ENABLED and (
-                    not self.current_assistant or (self.current_assistant and self.current_assistant.type != 1)):
-                _ds_list = get_ds_embedding(_session, self.current_user, _ds_list, self.out_ds_instance,
-                                            self.chat_question.question, self.current_assistant)
-                # yield {'content': '{"id":' + str(ds.get('id')) + '}'}
-
-            _ds_list_dict = []
-            for _ds in _ds_list:
-                _ds_list_dict.append(_ds)
-            datasource_msg.append(
-                HumanMessage(self.chat_question.datasource_user_question(orjson.dumps(_ds_list_dict).decode())))
-
-            self.current_logs[OperationEnum.CHOOSE_DATASOURCE] = start_log(session=_session,
-                                                                           ai_modal_id=self.chat_question.ai_modal_id,
-                                                                           ai_modal_name=self.chat_question.ai_modal_name,
-                                                                           operate=OperationEnum.CHOOSE_DATASOURCE,
-                                                                           record_id=self.record.id,
-                                                                           full_message=[{'type': msg.type,
-                                                                                          'content': msg.content}
-                                                                                         for
-                                                                                         msg in datasource_msg])
-
-            token_usage = {}
-            res = process_stream(self.llm.stream(datasource_msg), token_usage)
-            for chunk in res:
-                if chunk.get('content'):
-                    full_text += chunk.get('content')
-                if chunk.get('reasoning_content'):
-                    full_thinking_text += chunk.get('reasoning_content')
-                yield chunk
-            datasource_msg.append(AIMessage(full_text))
-
-            self.current_logs[OperationEnum.CHOOSE_DATASOURCE] = end_log(session=_session,
-                                                                         log=self.current_logs[
-                                                                             OperationEnum.CHOOSE_DATASOURCE],
-                                                                         full_message=[
-                                                                             {'type': msg.type,
-                                                                              'content': msg.content}
-                                                                             for msg in datasource_msg],
-                                                                         reasoning_content=full_thinking_text,
-                                                                         token_usage=token_usage)
-
-            json_str = extract_nested_json(full_text)
-            if json_str is None:
-                raise SingleMessageError(f'Cannot parse datasource from answer: {full_text}')
-            ds = orjson.loads(json_str)
+        return _ds_list
+
+    def prepare_select_datasource(self, _session: Session, _ds_list: list[dict],
+                                  datasource_msg: List[Union[BaseMessage, dict[str, Any]]]) -> None:
+        if settings.TABLE_EMBEDDING_ENABLED and (
+                not self.current_assistant or (self.current_assistant and self.current_assistant.type != 1)):
+            _ds_list = get_ds_embedding(_session, self.current_user, _ds_list, self.out_ds_instance,
+                                        self.chat_question.question, self.current_assistant)
+            # yield {'content': '{"id":' + str(ds.get('id')) + '}'}
+
+        _ds_list_dict = []
+        for _ds in _ds_list:
+            _ds_list_dict.append(_ds)
+        datasource_msg.append(
+            HumanMessage(self.chat_question.datasource_user_question(orjson.dumps(_ds_list_dict).decode())))
+
+        self.current_logs[OperationEnum.CHOOSE_DATASOURCE] = start_log(session=_session,
+                                                                       ai_modal_id=self.chat_question.ai_modal_id,
+                                                                       ai_modal_name=self.chat_question.ai_modal_name,
+                                                                       operate=OperationEnum.CHOOSE_DATASOURCE,
+                                                                       record_id=self.record.id,
+                                                                       full_message=[{'type': msg.type,
+                                                                                      'content': msg.content}
+                                                                                     for
+                                                                                     msg in datasource_msg])
 
+    def apply_select_datasource(self, _session: Session, data: dict, ignore_auto_select: bool, full_text: str):
         _error: Exception | None = None
         _datasource: int | None = None
         _engine_type: str | None = None
         try:
-            data: dict = _ds_list[0] if ignore_auto_select else ds
-
             if data.get('id') and data.get('id') != 0:
                 _datasource = data['id']
                 _chat = _session.get(Chat, self.record.chat_id)
@@ -487,7 +498,7 @@ class LLMService:
                 if self.current_assistant and self.current_assistant.type in dynamic_ds_types:
                     _ds = self.out_ds_instance.get_ds(data['id'])
                     self.ds = _ds
-                    self.chat_question.engine = _ds.type + get_version(self.ds)
+                    self.chat_question.engine = _ds.type + get_ds_version(self.ds)
                     self.chat_question.db_schema = self.out_ds_instance.get_db_schema(self.ds.id,
                                                                                       self.chat_question.question)
                     _engine_type = self.chat_question.engine
@@ -498,7 +509,7 @@ class LLMService:
                         _datasource = None
                         raise SingleMessageError(f"Datasource configuration with id {_datasource} not found")
                     self.ds = CoreDatasource(**_ds.model_dump())
-                    self.chat_question.engine = (_ds.type_name if _ds.type != 'excel' else 'PostgreSQL') + get_version(
+                    self.chat_question.engine = (_ds.type_name if _ds.type != 'excel' else 'PostgreSQL') + get_ds_version(
                         self.ds)
                     self.chat_question.db_schema = get_table_schema(session=_session,
                                                                     current_user=self.current_user, ds=self.ds,
@@ -531,45 +542,65 @@ class LLMService:
                                                         datasource=_datasource,
                                                         engine_type=_engine_type)
         if self.ds:
-            oid = self.ds.oid if isinstance(self.ds, CoreDatasource) else 1
-            ds_id = self.ds.id if isinstance(self.ds, CoreDatasource) else None
-
-            self.chat_question.terminologies = get_terminology_template(_session, self.chat_question.question, oid,
-                                                                        ds_id)
-            if self.current_assistant and self.current_assistant.type == 1:
-                self.chat_question.data_training = get_training_template(_session, self.chat_question.question,
-                                                                         oid, None, self.current_assistant.id)
-            else:
-                self.chat_question.data_training = get_training_template(_session, self.chat_question.question,
-                                                                         oid, ds_id)
-            # if SQLBotLicenseUtil.valid():
-            self.chat_question.custom_prompt = find_custom_prompts(_session, CustomPromptTypeEnum.GENERATE_SQL,
-                                                                       oid, ds_id)
-
-            self.init_messages()
+            self.init_sql_context(_session)
 
         if _error:
             raise _error
 
-    def generate_sql(self, _session: Session):
+    async def select_datasource(self, _session: Session):
+        datasource_msg: List[Union[BaseMessage, dict[str, Any]]] = []
+        datasource_msg.append(SystemMessage(self.chat_question.datasource_sys_question()))
+        _ds_list = await self.run_sync(self.get_datasource_list, _session)
+        ignore_auto_select = _ds_list and len(_ds_list) == 1
+        # ignore auto select ds
+
+        full_thinking_text = ''
+        full_text = ''
+        ds = None
+        if not ignore_auto_select:
+            await self.run_sync(self.prepare_select_datasource, _session, _ds_list, datasource_msg)
+
+            token_usage = {}
+            async for chunk in self.stream_llm(datasource_msg, token_usage):
+                if chunk.get('content'):
+                    full_text += chunk.get('content')
+                if chunk.get('reasoning_content'):
+                    full_thinking_text += chunk.get('reasoning_content')
+                yield chunk
+            datasource_msg.append(AIMessage(full_text))
+
+            self.current_logs[OperationEnum.CHOOSE_DATASOURCE] = await self.run_sync(
+                end_log, session=_session,
+                log=self.current_logs[OperationEnum.CHOOSE_DATASOURCE],
+                full_message=[{'type': msg.type, 'content': msg.content} for msg in datasource_msg],
+                reasoning_content=full_thinking_text,
+                token_usage=token_usage)
+
+            json_str = extract_nested_json(full_text)
+            if json_str is None:
+                raise SingleMessageError(f'Cannot parse datasource from answer: {full_text}')
+            ds = orjson.loads(json_str)
+
+        data: dict = _ds_list[0] if ignore_auto_select else ds
+        await self.run_sync(self.apply_select_datasource, _session, data, ignore_auto_select, full_text)
+
+    async def generate_sql(self, _session: Session):
         # append current question
         self.sql_message.append(HumanMessage(
             self.chat_question.sql_user_question(current_time=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
                                                  change_title=self.change_title)))
 
-        self.current_logs[OperationEnum.GENERATE_SQL] = start_log(session=_session,
-                                                                  ai_modal_id=self.chat_question.ai_modal_id,
-                                                                  ai_modal_name=self.chat_question.ai_modal_name,
-                                                                  operate=OperationEnum.GENERATE_SQL,
-                                                                  record_id=self.record.id,
-                                                                  full_message=[
-                                                                      {'type': msg.type, 'content': msg.content} for msg
-                                                                      in self.sql_message])
+        self.current_logs[OperationEnum.GENERATE_SQL] = await self.run_sync(
+            start_log, session=_session,
+            ai_modal_id=self.chat_question.ai_modal_id,
+            ai_modal_name=self.chat_question.ai_modal_name,
+            operate=OperationEnum.GENERATE_SQL,
+            record_id=self.record.id,
+            full_message=[{'type': msg.type, 'content': msg.content} for msg in self.sql_message])
         full_thinking_text = ''
         full_sql_text = ''
         token_usage = {}
-        res = process_stream(self.llm.stream(self.sql_message), token_usage)
-        for chunk in res:
+        async for chunk in self.stream_llm(self.sql_message, token_usage):
             if chunk.get('content'):
                 full_sql_text += chunk.get('content')
             if chunk.get('reasoning_content'):
@@ -578,16 +609,16 @@ class LLMService:
 
         self.sql_message.append(AIMessage(full_sql_text))
 
-        self.current_logs[OperationEnum.GENERATE_SQL] = end_log(session=_session,
-                                                                log=self.current_logs[OperationEnum.GENERATE_SQL],
-                                                                full_message=[{'type': msg.type, 'content': msg.content}
-                                                                              for msg in self.sql_message],
-                                                                reasoning_content=full_thinking_text,
-                                                                token_usage=token_usage)
-        self.record = save_sql_answer(session=_session, record_id=self.record.id,
-                                      answer=orjson.dumps({'content': full_sql_text}).decode())
+        self.current_logs[OperationEnum.GENERATE_SQL] = await self.run_sync(
+            end_log, session=_session,
+            log=self.current_logs[OperationEnum.GENERATE_SQL],
+            full_message=[{'type': msg.type, 'content': msg.content} for msg in self.sql_message],
+            reasoning_content=full_thinking_text,
+            token_usage=token_usage)
+        self.record = await self.run_sync(save_sql_answer, session=_session, record_id=self.record.id,
+                                          answer=orjson.dumps({'content': full_sql_text}).decode())
 
-    def generate_with_sub_sql(self, session: Session, sql, sub_mappings: list):
+    async def generate_with_sub_sql(self, session: Session, sql, sub_mappings: list):
         sub_query = json.dumps(sub_mappings, ensure_ascii=False)
         self.chat_question.sql = sql
         self.chat_question.sub_query = sub_query
@@ -595,21 +626,18 @@ class LLMService:
         dynamic_sql_msg.append(SystemMessage(content=self.chat_question.dynamic_sys_question()))
         dynamic_sql_msg.append(HumanMessage(content=self.chat_question.dynamic_user_question()))
 
-        self.current_logs[OperationEnum.GENERATE_DYNAMIC_SQL] = start_log(session=session,
-                                                                          ai_modal_id=self.chat_question.ai_modal_id,
-                                                                          ai_modal_name=self.chat_question.ai_modal_name,
-                                                                          operate=OperationEnum.GENERATE_DYNAMIC_SQL,
-                                                                          record_id=self.record.id,
-                                                                          full_message=[{'type': msg.type,
-                                                                                         'content': msg.content}
-                                                                                        for
-                                                                                        msg in dynamic_sql_msg])
+        self.current_logs[OperationEnum.GENERATE_DYNAMIC_SQL] = await self.run_sync(
+            start_log, session=session,
+            ai_modal_id=self.chat_question.ai_modal_id,
+            ai_modal_name=self.chat_question.ai_modal_name,
+            operate=OperationEnum.GENERATE_DYNAMIC_SQL,
+            record_id=self.record.id,
+            full_message=[{'type': msg.type, 'content': msg.content} for msg in dynamic_sql_msg])
 
         full_thinking_text = ''
         full_dynamic_text = ''
         token_usage = {}
-        res = process_stream(self.llm.stream(dynamic_sql_msg), token_usage)
-        for chunk in res:
+        async for chunk in self.stream_llm(dynamic_sql_msg, token_usage):
             if chunk.get('content'):
                 full_dynamic_text += chunk.get('content')
             if chunk.get('reasoning_content'):
@@ -617,20 +645,17 @@ class LLMService:
 
         dynamic_sql_msg.append(AIMessage(full_dynamic_text))
 
-        self.current_logs[OperationEnum.GENERATE_DYNAMIC_SQL] = end_log(session=session,
-                                                                        log=self.current_logs[
-                                                                            OperationEnum.GENERATE_DYNAMIC_SQL],
-                                                                        full_message=[
-                                                                            {'type': msg.type,
-                                                                             'content': msg.content}
-                                                                            for msg in dynamic_sql_msg],
-                                                                        reasoning_content=full_thinking_text,
-                                                                        token_usage=token_usage)
+        self.current_logs[OperationEnum.GENERATE_DYNAMIC_SQL] = await self.run_sync(
+            end_log, session=session,
+            log=self.current_logs[OperationEnum.GENERATE_DYNAMIC_SQL],
+            full_message=[{'type': msg.type, 'content': msg.content} for msg in dynamic_sql_msg],
+            reasoning_content=full_thinking_text,
+            token_usage=token_usage)
 
         SQLBotLogUtil.info(full_dynamic_text)
         return full_dynamic_text
 
-    def generate_assistant_dynamic_sql(self, _session: Session, sql, tables: List):
+    async def generate_assistant_dynamic_sql(self, _session: Session, sql, tables: List):
         ds: AssistantOutDsSchema = self.ds
         sub_query = []
         result_dict = {}
@@ -641,11 +666,11 @@ class LLMService:
                 sub_query.append({"table": table.name, "query": f'{dynamic_subsql_prefix}{table.name}'})
         if not sub_query:
             return None
-        temp_sql_text = self.generate_with_sub_sql(session=_session, sql=sql, sub_mappings=sub_query)
+        temp_sql_text = await self.generate_with_sub_sql(session=_session, sql=sql, sub_mappings=sub_query)
         result_dict['sqlbot_temp_sql_text'] = temp_sql_text
         return result_dict
 
-    def build_table_filter(self, session: Session, sql: str, filters: list):
+    async def build_table_filter(self, session: Session, sql: str, filters: list):
         filter = json.dumps(filters, ensure_ascii=False)
         self.chat_question.sql = sql
         self.chat_question.filter = filter
@@ -653,21 +678,17 @@ class LLMService:
         permission_sql_msg.append(SystemMessage(content=self.chat_question.filter_sys_question()))
         permission_sql_msg.append(HumanMessage(content=self.chat_question.filter_user_question()))
 
-        self.current_logs[OperationEnum.GENERATE_SQL_WITH_PERMISSIONS] = start_log(session=session,
-                                                                                   ai_modal_id=self.chat_question.ai_modal_id,
-                                                                                   ai_modal_name=self.chat_question.ai_modal_name,
-                                                                                   operate=OperationEnum.GENERATE_SQL_WITH_PERMISSIONS,
-                                                                                   record_id=self.record.id,
-                                                                                   full_message=[
-                                                                                       {'type': msg.type,
-                                                                                        'content': msg.content} for
-                                                                                       msg
-                                                                                       in permission_sql_msg])
+        self.current_logs[OperationEnum.GENERATE_SQL_WITH_PERMISSIONS] = await self.run_sync(
+            start_log, session=session,
+            ai_modal_id=self.chat_question.ai_modal_id,
+            ai_modal_name=self.chat_question.ai_modal_name,
+            operate=OperationEnum.GENERATE_SQL_WITH_PERMISSIONS,
+            record_id=self.record.id,
+            full_message=[{'type': msg.type, 'content': msg.content} for msg in permission_sql_msg])
         full_thinking_text = ''
         full_filter_text = ''
         token_usage = {}
-        res = process_stream(self.llm.stream(permission_sql_msg), token_usage)
-        for chunk in res:
+        async for chunk in self.stream_llm(permission_sql_msg, token_usage):
             if chunk.get('content'):
                 full_filter_text += chunk.get('content')
             if chunk.get('reasoning_content'):
@@ -675,27 +696,24 @@ class LLMService:
 
         permission_sql_msg.append(AIMessage(full_filter_text))
 
-        self.current_logs[OperationEnum.GENERATE_SQL_WITH_PERMISSIONS] = end_log(session=session,
-                                                                                 log=self.current_logs[
-                                                                                     OperationEnum.GENERATE_SQL_WITH_PERMISSIONS],
-                                                                                 full_message=[
-                                                                                     {'type': msg.type,
-                                                                                      'content': msg.content}
-                                                                                     for msg in permission_sql_msg],
-                                                                                 reasoning_content=full_thinking_text,
-                                                                                 token_usage=token_usage)
+        self.current_logs[OperationEnum.GENERATE_SQL_WITH_PERMISSIONS] = await self.run_sync(
+            end_log, session=session,
+            log=self.current_logs[OperationEnum.GENERATE_SQL_WITH_PERMISSIONS],
+            full_message=[{'type': msg.type, 'content': msg.content} for msg in permission_sql_msg],
+            reasoning_content=full_thinking_text,
+            token_usage=token_usage)
 
         SQLBotLogUtil.info(full_filter_text)
         return full_filter_text
 
-    def generate_filter(self, _session: Session, sql: str, tables: List):
-        filters = get_row_permission_filters(session=_session, current_user=self.current_user, ds=self.ds,
-                                             tables=tables)
+    async def generate_filter(self, _session: Session, sql: str, tables: List):
+        filters = await self.run_sync(get_row_permission_filters, session=_session, current_user=self.current_user,
+                                      ds=self.ds, tables=tables)
         if not filters:
             return None
-        return self.build_table_filter(session=_session, sql=sql, filters=filters)
+        return await self.build_table_filter(session=_session, sql=sql, filters=filters)
 
-    def generate_assistant_filter(self, _session: Session, sql, tables: List):
+    async def generate_assistant_filter(self, _session: Session, sql, tables: List):
         ds: AssistantOutDsSchema = self.ds
         filters = []
         for table in ds.tables:
@@ -703,26 +721,23 @@ class LLMService:
                 filters.append({"table": table.name, "filter": table.rule})
         if not filters:
             return None
-        return self.build_table_filter(session=_session, sql=sql, filters=filters)
+        return await self.build_table_filter(session=_session, sql=sql, filters=filters)
 
-    def generate_chart(self, _session: Session, chart_type: Optional[str] = ''):
+    async def generate_chart(self, _session: Session, chart_type: Optional[str] = ''):
         # append current question
         self.chart_message.append(HumanMessage(self.chat_question.chart_user_question(chart_type)))
 
-        self.current_logs[OperationEnum.GENERATE_CHART] = start_log(session=_session,
-                                                                    ai_modal_id=self.chat_question.ai_modal_id,
-                                                                    ai_modal_name=self.chat_question.ai_modal_name,
-                                                                    operate=OperationEnum.GENERATE_CHART,
-                                                                    record_id=self.record.id,
-                                                                    full_message=[
-                                                                        {'type': msg.type, 'content': msg.content} for
-                                                                        msg
-                                                                        in self.chart_message])
+        self.current_logs[OperationEnum.GENERATE_CHART] = await self.run_sync(
+            start_log, session=_session,
+            ai_modal_id=self.chat_question.ai_modal_id,
+            ai_modal_name=self.chat_question.ai_modal_name,
+            operate=OperationEnum.GENERATE_CHART,
+            record_id=self.record.id,
+            full_message=[{'type': msg.type, 'content': msg.content} for msg in self.chart_message])
         full_thinking_text = ''
         full_chart_text = ''
         token_usage = {}
-        res = process_stream(self.llm.stream(self.chart_message), token_usage)
-        for chunk in res:
+        async for chunk in self.stream_llm(self.chart_message, token_usage):
             if chunk.get('content'):
                 full_chart_text += chunk.get('content')
             if chunk.get('reasoning_content'):
@@ -731,15 +746,14 @@ class LLMService:
 
         self.chart_message.append(AIMessage(full_chart_text))
 
-        self.record = save_chart_answer(session=_session, record_id=self.record.id,
-                                        answer=orjson.dumps({'content': full_chart_text}).decode())
-        self.current_logs[OperationEnum.GENERATE_CHART] = end_log(session=_session,
-                                                                  log=self.current_logs[OperationEnum.GENERATE_CHART],
-                                                                  full_message=[
-                                                                      {'type': msg.type, 'content': msg.content}
-                                                                      for msg in self.chart_message],
-                                                                  reasoning_content=full_thinking_text,
-                                                                  token_usage=token_usage)
+        self.record = await self.run_sync(save_chart_answer, session=_session, record_id=self.record.id,
+                                          answer=orjson.dumps({'content': full_chart_text}).decode())
+        self.current_logs[OperationEnum.GENERATE_CHART] = await self.run_sync(
+            end_log, session=_session,
+            log=self.current_logs[OperationEnum.GENERATE_CHART],
+            full_message=[{'type': msg.type, 'content': msg.content} for msg in self.chart_message],
+            reasoning_content=full_thinking_text,
+            token_usage=token_usage)
 
     @staticmethod
     def check_sql(res: str) -> tuple[str, Optional[list]]:
@@ -878,15 +892,28 @@ class LLMService:
 
     def save_sql_data(self, session: Session, data_obj: Dict[str, Any]):
         try:
-            data_result = data_obj.get('data')
             limit = 1000
-            if data_result:
-                data_result = prepare_for_orjson(data_result)
-                if data_result and len(data_result) > limit and self.enable_sql_row_limit:
-                    data_obj['data'] = data_result[:limit]
+            if DataFormat.is_columnar(data_obj):
+                columns = prepare_for_orjson(data_obj.get('columns'))
+                row_count = len(columns[0]) if columns else 0
+                if row_count > limit and self.enable_sql_row_limit:
+                    data_obj['columns'] = [values[:limit] for values in columns]
                     data_obj['limit'] = limit
                 else:
-                    data_obj['data'] = data_result
+                    data_obj['columns'] = columns
+            else:
+                data_result = data_obj.get('data')
+                row_count = len(data_result) if data_result else 0
+                if data_result:
+                    data_result = prepare_for_orjson(data_result)
+                    if data_result and len(data_result) > limit and self.enable_sql_row_limit:
+                        data_obj['data'] = data_result[:limit]
+                        data_obj['limit'] = limit
+                    else:
+                        data_obj['data'] = data_result
+            if data_obj.get('truncated') and not data_obj.get('limit'):
+                # 执行时已按 SQL_RESULT_MAX_ROWS/SQL_RESULT_MAX_BYTES 截断，提示用户只展示了部分数据
+                data_obj['limit'] = row_count
             return save_sql_exec_data(session=session, record_id=self.record.id,
                                       data=orjson.dumps(data_obj).decode())
         except Exception as e:
@@ -907,7 +934,8 @@ class LLMService:
         """
         SQLBotLogUtil.info(f"Executing SQL on ds_id {self.ds.id}: {sql}")
         try:
-            return exec_sql(ds=self.ds, sql=sql, origin_column=False)
+            return exec_sql(ds=self.ds, sql=sql, origin_column=False, columnar=settings.SQL_RESULT_COLUMNAR_ENABLED,
+                            max_rows=settings.SQL_RESULT_MAX_ROWS, max_bytes=settings.SQL_RESULT_MAX_BYTES)
         except Exception as e:
             if isinstance(e, ParseSQLResultError):
                 raise e
@@ -915,60 +943,105 @@ class LLMService:
                 err = traceback.format_exc(limit=1, chain=True)
                 raise SQLBotDBError(err)
 
-    def pop_chunk(self):
+    def submit_task(self, pool_name: str, fn, *args):
+        # 需在事件循环中调用，chunk_stream 绑定当前循环，由 await_result_async 读取
+        self.chunk_stream = ChunkStream()
         try:
-            chunk = self.chunk_list.pop(0)
-            return chunk
-        except IndexError as e:
-            return None
+            self.future = scheduler.submit(pool_name, fn, *args)
+        except Exception:
+            self.chunk_stream.close()
+            raise
 
-    def await_result(self):
-        while self.is_running():
-            while True:
-                chunk = self.pop_chunk()
-                if chunk is not None:
-                    yield chunk
-                else:
-                    break
-        while True:
-            chunk = self.pop_chunk()
-            if chunk is None:
-                break
+    def start_async_task(self, pool_name: str, agen: AsyncIterator):
+        """
+        异步模式：任务直接运行在当前事件循环中，LLM 使用 astream，数据库操作放到专用线程池中执行
+        与线程模式一样受任务池的排队上限（超出抛出 TaskRejectedError）和并发数限制，客户端断开后任务仍会执行完成
+        """
+        self.async_mode = True
+        self.chunk_stream = ChunkStream()
+        try:
+            task = scheduler.submit_async(pool_name, self.pump_chunks, agen)
+        except Exception:
+            self.chunk_stream.close()
+            raise
+        _running_tasks.add(task)
+        task.add_done_callback(_running_tasks.discard)
+
+    async def pump_chunks(self, agen: AsyncIterator):
+        try:
+            with query_embedding_scope():
+                async for chunk in agen:
+                    self.chunk_stream.put(chunk)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            self.chunk_stream.close()
+
+    def put_chunks(self, chunks: Iterator):
+        try:
+            for chunk in chunks:
+                self.chunk_stream.put(chunk)
+        finally:
+            self.chunk_stream.close()
+
+    async def await_result_async(self) -> AsyncIterator:
+        async for chunk in self.chunk_stream.aiter():
             yield chunk
 
+    def await_result(self):
+        yield from self.chunk_stream.iter()
+
     def run_task_async(self, in_chat: bool = True, stream: bool = True,
                        finish_step: ChatFinishStep = ChatFinishStep.GENERATE_CHART):
         if in_chat:
             stream = True
-        self.future = executor.submit(self.run_task_cache, in_chat, stream, finish_step)
+        if settings.TASK_ASYNC_ENABLED:
+            self.start_async_task(CHAT_POOL, self.arun_task(in_chat, stream, finish_step))
+        else:
+            self.submit_task(CHAT_POOL, self.run_task_cache, in_chat, stream, finish_step)
 
     def run_task_cache(self, in_chat: bool = True, stream: bool = True,
                        finish_step: ChatFinishStep = ChatFinishStep.GENERATE_CHART):
-        for chunk in self.run_task(in_chat, stream, finish_step):
-            self.chunk_list.append(chunk)
+        with query_embedding_scope():
+            self.put_chunks(self.run_task(in_chat, stream, finish_step))
 
     def run_task(self, in_chat: bool = True, stream: bool = True,
                  finish_step: ChatFinishStep = ChatFinishStep.GENERATE_CHART):
+        yield from iterate_async_generator(self.arun_task(in_chat, stream, finish_step))
+
+    def init_sql_context(self, _session: Session):
+        oid = self.ds.oid if isinstance(self.ds, CoreDatasource) else 1
+        ds_id = self.ds.id if isinstance(self.ds, CoreDatasource) else None
+        self.chat_question.terminologies = get_terminology_template(_session, self.chat_question.question,
+                                                                    oid, ds_id)
+        if self.current_assistant and self.current_assistant.type == 1:
+            self.chat_question.data_training = get_training_template(_session, self.chat_question.question,
+                                                                     oid, None, self.current_assistant.id)
+        else:
+            self.chat_question.data_training = get_training_template(_session, self.chat_question.question,
+                                                                     oid, ds_id)
+        # if SQLBotLicenseUtil.valid():
+        self.chat_question.custom_prompt = find_custom_prompts(_session,
+                                                               CustomPromptTypeEnum.GENERATE_SQL,
+                                                               oid, ds_id)
+        self.init_messages()
+
+    def get_db_schema(self, _session: Session):
+        if self.out_ds_instance:
+            return self.out_ds_instance.get_db_schema(self.ds.id, self.chat_question.question)
+        return get_table_schema(session=_session,
+                                current_user=self.current_user,
+                                ds=self.ds,
+                                question=self.chat_question.question)
+
+    async def arun_task(self, in_chat: bool = True, stream: bool = True,
+                        finish_step: ChatFinishStep = ChatFinishStep.GENERATE_CHART):
         json_result: Dict[str, Any] = {'success': True}
         _session = None
         try:
-            _session = session_maker()
+            _session = session_maker.session_factory()
             if self.ds:
-                oid = self.ds.oid if isinstance(self.ds, CoreDatasource) else 1
-                ds_id = self.ds.id if isinstance(self.ds, CoreDatasource) else None
-                self.chat_question.terminologies = get_terminology_template(_session, self.chat_question.question,
-                                                                            oid, ds_id)
-                if self.current_assistant and self.current_assistant.type == 1:
-                    self.chat_question.data_training = get_training_template(_session, self.chat_question.question,
-                                                                             oid, None, self.current_assistant.id)
-                else:
-                    self.chat_question.data_training = get_training_template(_session, self.chat_question.question,
-                                                                             oid, ds_id)
-                # if SQLBotLicenseUtil.valid():
-                self.chat_question.custom_prompt = find_custom_prompts(_session,
-                                                                           CustomPromptTypeEnum.GENERATE_SQL,
-                                                                           oid, ds_id)
-                self.init_messages()
+                await self.run_datasource_sync(self.init_sql_context, _session)
 
             # return id
             if in_chat:
@@ -987,9 +1060,7 @@ class LLMService:
 
                 # select datasource if datasource is none
             if not self.ds:
-                ds_res = self.select_datasource(_session)
-
-                for chunk in ds_res:
+                async for chunk in self.select_datasource(_session):
                     SQLBotLogUtil.info(chunk)
                     if in_chat:
                         yield 'data:' + orjson.dumps(
@@ -1000,24 +1071,18 @@ class LLMService:
                                                   'engine_type': self.ds.type_name or self.ds.type,
                                                   'type': 'datasource'}).decode() + '\n\n'
 
-                self.chat_question.db_schema = self.out_ds_instance.get_db_schema(
-                    self.ds.id, self.chat_question.question) if self.out_ds_instance else get_table_schema(
-                    session=_session,
-                    current_user=self.current_user,
-                    ds=self.ds,
-                    question=self.chat_question.question)
+                self.chat_question.db_schema = await self.run_sync(self.get_db_schema, _session)
             else:
-                self.validate_history_ds(_session)
+                await self.run_sync(self.validate_history_ds, _session)
 
             # check connection
-            connected = check_connection(ds=self.ds, trans=None)
+            connected = await self.run_datasource_sync(check_connection, ds=self.ds, trans=None)
             if not connected:
                 raise SQLBotDBConnectionError('Connect DB failed')
 
             # generate sql
-            sql_res = self.generate_sql(_session)
             full_sql_text = ''
-            for chunk in sql_res:
+            async for chunk in self.generate_sql(_session):
                 full_sql_text += chunk.get('content')
                 if in_chat:
                     yield 'data:' + orjson.dumps(
@@ -1037,9 +1102,10 @@ class LLMService:
                 if llm_brief_generated or (self.chat_question.question and self.chat_question.question.strip() != ''):
                     save_brief = llm_brief if (llm_brief and llm_brief != '') else self.chat_question.question.strip()[
                                                                                    :20]
-                    brief = rename_chat(session=_session,
-                                        rename_object=RenameChat(id=self.get_record().chat_id,
-                                                                 brief=save_brief, brief_generate=llm_brief_generated))
+                    brief = await self.run_sync(rename_chat, session=_session,
+                                                rename_object=RenameChat(id=self.get_record().chat_id,
+                                                                         brief=save_brief,
+                                                                         brief_generate=llm_brief_generated))
                     if in_chat:
                         yield 'data:' + orjson.dumps({'type': 'brief', 'brief': brief}).decode() + '\n\n'
                     if not stream:
@@ -1057,22 +1123,23 @@ class LLMService:
                 sql_result = None
 
                 if use_dynamic_ds:
-                    dynamic_sql_result = self.generate_assistant_dynamic_sql(_session, sql, tables)
+                    dynamic_sql_result = await self.generate_assistant_dynamic_sql(_session, sql, tables)
                     sqlbot_temp_sql_text = dynamic_sql_result.get(
                         'sqlbot_temp_sql_text') if dynamic_sql_result else None
                     # sql_result = self.generate_assistant_filter(sql, tables)
                 else:
-                    sql_result = self.generate_filter(_session, sql, tables)  # maybe no sql and tables
+                    sql_result = await self.generate_filter(_session, sql, tables)  # maybe no sql and tables
 
                 if sql_result:
                     SQLBotLogUtil.info(sql_result)
-                    sql = self.check_save_sql(session=_session, res=sql_result)
+                    sql = await self.run_sync(self.check_save_sql, session=_session, res=sql_result)
                 elif dynamic_sql_result and sqlbot_temp_sql_text:
-                    assistant_dynamic_sql = self.check_save_sql(session=_session, res=sqlbot_temp_sql_text)
+                    assistant_dynamic_sql = await self.run_sync(self.check_save_sql, session=_session,
+                                                                res=sqlbot_temp_sql_text)
                 else:
-                    sql = self.check_save_sql(session=_session, res=full_sql_text)
+                    sql = await self.run_sync(self.check_save_sql, session=_session, res=full_sql_text)
             else:
-                sql = self.check_save_sql(session=_session, res=full_sql_text)
+                sql = await self.run_sync(self.check_save_sql, session=_session, res=full_sql_text)
 
             SQLBotLogUtil.info('sql: ' + sql)
 
@@ -1102,28 +1169,31 @@ class LLMService:
                     yield json_result
                 return
 
-            result = self.execute_sql(sql=real_execute_sql)
+            result = await self.run_datasource_sync(self.execute_sql, sql=real_execute_sql)
 
-            _data = DataFormat.convert_large_numbers_in_object_array(result.get('data'))
-            result["data"] = _data
+            if DataFormat.is_columnar(result):
+                result['columns'] = DataFormat.convert_large_numbers_in_columns(result.get('columns'))
+            else:
+                result['data'] = DataFormat.convert_large_numbers_in_object_array(result.get('data'))
 
-            self.save_sql_data(session=_session, data_obj=result)
+            await self.run_sync(self.save_sql_data, session=_session, data_obj=result)
             if in_chat:
-                yield 'data:' + orjson.dumps({'content': 'execute-success', 'type': 'sql-data'}).decode() + '\n\n'
+                yield 'data:' + orjson.dumps({'content': 'execute-success', 'type': 'sql-data',
+                                              'truncated': bool(result.get('truncated'))}).decode() + '\n\n'
             if not stream:
-                json_result['data'] = get_chat_chart_data(_session, self.record.id)
+                json_result['data'] = await self.run_sync(get_chat_chart_data, _session, self.record.id)
 
             if finish_step.value <= ChatFinishStep.QUERY_DATA.value:
                 if stream:
                     if in_chat:
                         yield 'data:' + orjson.dumps({'type': 'finish'}).decode() + '\n\n'
                     else:
+                        _data = DataFormat.columnar_to_rows(result).get('data')
                         _column_list = []
                         for field in result.get('fields'):
                             _column_list.append(AxisObj(name=field, value=field))
 
-                        md_data, _fields_list = DataFormat.convert_object_array_for_pandas(_column_list,
-                                                                                           result.get('data'))
+                        md_data, _fields_list = DataFormat.convert_object_array_for_pandas(_column_list, _data)
 
                         # data, _fields_list, col_formats = self.format_pd_data(_column_list, result.get('data'))
 
@@ -1139,9 +1209,8 @@ class LLMService:
                 return
 
             # generate chart
-            chart_res = self.generate_chart(_session, chart_type)
             full_chart_text = ''
-            for chunk in chart_res:
+            async for chunk in self.generate_chart(_session, chart_type):
                 full_chart_text += chunk.get('content')
                 if in_chat:
                     yield 'data:' + orjson.dumps(
@@ -1152,7 +1221,7 @@ class LLMService:
 
             # filter chart
             SQLBotLogUtil.info(full_chart_text)
-            chart = self.check_save_chart(session=_session, res=full_chart_text)
+            chart = await self.run_sync(self.check_save_chart, session=_session, res=full_chart_text)
             SQLBotLogUtil.info(chart)
 
             if not stream:
@@ -1163,8 +1232,8 @@ class LLMService:
                     {'content': orjson.dumps(chart).decode(), 'type': 'chart'}).decode() + '\n\n'
             else:
                 if stream:
-                    md_data, _fields_list = DataFormat.convert_data_fields_for_pandas(chart, result.get('fields'),
-                                                                                      result.get('data'))
+                    md_data, _fields_list = DataFormat.convert_data_fields_for_pandas(
+                        chart, result.get('fields'), DataFormat.columnar_to_rows(result).get('data'))
                     # data, _fields_list, col_formats = self.format_pd_data(_column_list, result.get('data'))
 
                     if not md_data or not _fields_list:
@@ -1182,8 +1251,8 @@ class LLMService:
                 try:
                     if chart.get('type') != 'table':
                         # yield '### generated chart picture\n\n'
-                        image_url, error = request_picture(self.record.chat_id, self.record.id, chart,
-                                                           format_json_data(result))
+                        image_url, error = await self.run_sync(request_picture, self.record.chat_id, self.record.id,
+                                                               chart, format_json_data(result))
                         SQLBotLogUtil.info(image_url)
                         if stream:
                             yield f'![{chart.get("type")}]({image_url})'
@@ -1214,7 +1283,7 @@ class LLMService:
             else:
                 error_msg = orjson.dumps({'message': str(e), 'traceback': traceback.format_exc(limit=1)}).decode()
             if _session:
-                self.save_error(session=_session, message=error_msg)
+                await self.run_sync(self.save_error, session=_session, message=error_msg)
             if in_chat:
                 yield 'data:' + orjson.dumps({'content': error_msg, 'type': 'error'}).decode() + '\n\n'
             else:
@@ -1226,22 +1295,29 @@ class LLMService:
                     json_result['message'] = error_msg
                     yield json_result
         finally:
-            self.finish(_session)
-            session_maker.remove()
+            try:
+                await self.run_sync(self.finish, _session)
+            finally:
+                if _session:
+                    await self.run_sync(_session.close)
 
     def run_recommend_questions_task_async(self):
-        self.future = executor.submit(self.run_recommend_questions_task_cache)
+        if settings.TASK_ASYNC_ENABLED:
+            self.start_async_task(RECOMMEND_POOL, self.arun_recommend_questions_task())
+        else:
+            self.submit_task(RECOMMEND_POOL, self.run_recommend_questions_task_cache)
 
     def run_recommend_questions_task_cache(self):
-        for chunk in self.run_recommend_questions_task():
-            self.chunk_list.append(chunk)
+        self.put_chunks(self.run_recommend_questions_task())
 
     def run_recommend_questions_task(self):
-        try:
-            _session = session_maker()
-            res = self.generate_recommend_questions_task(_session)
+        yield from iterate_async_generator(self.arun_recommend_questions_task())
 
-            for chunk in res:
+    async def arun_recommend_questions_task(self):
+        _session = None
+        try:
+            _session = session_maker.session_factory()
+            async for chunk in self.generate_recommend_questions_task(_session):
                 if chunk.get('recommended_question'):
                     yield 'data:' + orjson.dumps(
                         {'content': chunk.get('recommended_question'),
@@ -1253,22 +1329,33 @@ class LLMService:
         except Exception:
             traceback.print_exc()
         finally:
-            session_maker.remove()
+            if _session:
+                await self.run_sync(_session.close)
 
     def run_analysis_or_predict_task_async(self, session: Session, action_type: str, base_record: ChatRecord,
                                            in_chat: bool = True, stream: bool = True):
         self.set_record(save_analysis_predict_record(session, base_record, action_type))
-        self.future = executor.submit(self.run_analysis_or_predict_task_cache, action_type, in_chat, stream)
+        try:
+            if settings.TASK_ASYNC_ENABLED:
+                self.start_async_task(ANALYSIS_POOL, self.arun_analysis_or_predict_task(action_type, in_chat, stream))
+            else:
+                self.submit_task(ANALYSIS_POOL, self.run_analysis_or_predict_task_cache, action_type, in_chat, stream)
+        except TaskRejectedError as e:
+            # 记录已提交，任务被拒绝时需标记为结束，避免前端一直显示处理中
+            self.save_error(session=session, message=str(e))
+            raise e
 
     def run_analysis_or_predict_task_cache(self, action_type: str, in_chat: bool = True, stream: bool = True):
-        for chunk in self.run_analysis_or_predict_task(action_type, in_chat, stream):
-            self.chunk_list.append(chunk)
+        self.put_chunks(self.run_analysis_or_predict_task(action_type, in_chat, stream))
 
     def run_analysis_or_predict_task(self, action_type: str, in_chat: bool = True, stream: bool = True):
+        yield from iterate_async_generator(self.arun_analysis_or_predict_task(action_type, in_chat, stream))
+
+    async def arun_analysis_or_predict_task(self, action_type: str, in_chat: bool = True, stream: bool = True):
         json_result: Dict[str, Any] = {'success': True}
         _session = None
         try:
-            _session = session_maker()
+            _session = session_maker.session_factory()
             if in_chat:
                 yield 'data:' + orjson.dumps({'type': 'id', 'id': self.get_record().id}).decode() + '\n\n'
             else:
@@ -1280,9 +1367,8 @@ class LLMService:
 
             if action_type == 'analysis':
                 # generate analysis
-                analysis_res = self.generate_analysis(_session)
                 full_text = ''
-                for chunk in analysis_res:
+                async for chunk in self.generate_analysis(_session):
                     full_text += chunk.get('content')
                     if in_chat:
                         yield 'data:' + orjson.dumps(
@@ -1302,9 +1388,8 @@ class LLMService:
 
             elif action_type == 'predict':
                 # generate predict
-                analysis_res = self.generate_predict(_session)
                 full_text = ''
-                for chunk in analysis_res:
+                async for chunk in self.generate_predict(_session):
                     full_text += chunk.get('content')
                     if in_chat:
                         yield 'data:' + orjson.dumps(
@@ -1313,14 +1398,14 @@ class LLMService:
                 if in_chat:
                     yield 'data:' + orjson.dumps({'type': 'info', 'msg': 'predict generated'}).decode() + '\n\n'
 
-                has_data = self.check_save_predict_data(session=_session, res=full_text)
+                has_data = await self.run_sync(self.check_save_predict_data, session=_session, res=full_text)
                 if has_data:
                     if in_chat:
                         yield 'data:' + orjson.dumps({'type': 'predict-success'}).decode() + '\n\n'
                     else:
-                        chart = get_chat_chart_config(_session, self.record.id)
-                        origin_data = get_chat_chart_data(_session, self.record.id)
-                        predict_data = get_chat_predict_data(_session, self.record.id)
+                        chart = await self.run_sync(get_chat_chart_config, _session, self.record.id)
+                        origin_data = await self.run_sync(get_chat_chart_data, _session, self.record.id)
+                        predict_data = await self.run_sync(get_chat_predict_data, _session, self.record.id)
 
                         if stream:
                             md_data, _fields_list = DataFormat.convert_data_fields_for_pandas(chart,
@@ -1343,11 +1428,11 @@ class LLMService:
                             if chart.get('type') != 'table':
                                 # yield '### generated chart picture\n\n'
 
-                                _data = get_chat_chart_data(_session, self.record.id)
+                                _data = await self.run_sync(get_chat_chart_data, _session, self.record.id)
                                 _data['data'] = _data.get('data') + predict_data
 
-                                image_url, error = request_picture(self.record.chat_id, self.record.id, chart,
-                                                                   format_json_data(_data))
+                                image_url, error = await self.run_sync(request_picture, self.record.chat_id,
+                                                                       self.record.id, chart, format_json_data(_data))
                                 SQLBotLogUtil.info(image_url)
                                 if stream:
                                     yield f'![{chart.get("type")}]({image_url})'
@@ -1372,7 +1457,7 @@ class LLMService:
                 if in_chat:
                     yield 'data:' + orjson.dumps({'type': 'predict_finish'}).decode() + '\n\n'
 
-            self.finish(_session)
+            await self.run_sync(self.finish, _session)
 
             if not stream:
                 yield json_result
@@ -1384,7 +1469,7 @@ class LLMService:
             else:
                 error_msg = orjson.dumps({'message': str(e), 'traceback': traceback.format_exc(limit=1)}).decode()
             if _session:
-                self.save_error(session=_session, message=error_msg)
+                await self.run_sync(self.save_error, session=_session, message=error_msg)
             if in_chat:
                 yield 'data:' + orjson.dumps({'content': error_msg, 'type': 'error'}).decode() + '\n\n'
             else:
@@ -1397,7 +1482,8 @@ class LLMService:
                     yield json_result
         finally:
             # end
-            session_maker.remove()
+            if _session:
+                await self.run_sync(_session.close)
 
     def validate_history_ds(self, session: Session):
         _ds = self.ds
@@ -1498,19 +1584,29 @@ def get_token_usage(chunk: BaseMessageChunk, token_usage: dict = None):
         pass
 
 
-def process_stream(res: Iterator[BaseMessageChunk],
-                   token_usage: Dict[str, Any] = None,
-                   enable_tag_parsing: bool = settings.PARSE_REASONING_BLOCK_ENABLED,
-                   start_tag: str = settings.DEFAULT_REASONING_CONTENT_START,
-                   end_tag: str = settings.DEFAULT_REASONING_CONTENT_END
-                   ):
-    if token_usage is None:
-        token_usage = {}
-    in_thinking_block = False  # 标记是否在思考过程块中
-    current_thinking = ''  # 当前收集的思考过程内容
-    pending_start_tag = ''  # 用于缓存可能被截断的开始标签部分
+class StreamChunkParser:
+    """
+    解析 LLM 流式输出：分离 reasoning_content（additional_kwargs 或 <think> 标签块），并记录 token 用量
+    同步 process_stream 与异步 aprocess_stream 共用
+    """
+
+    def __init__(self, token_usage: Dict[str, Any],
+                 enable_tag_parsing: bool = settings.PARSE_REASONING_BLOCK_ENABLED,
+                 start_tag: str = settings.DEFAULT_REASONING_CONTENT_START,
+                 end_tag: str = settings.DEFAULT_REASONING_CONTENT_END):
+        self.token_usage = token_usage
+        self.enable_tag_parsing = enable_tag_parsing
+        self.start_tag = start_tag
+        self.end_tag = end_tag
+        self.in_thinking_block = False  # 标记是否在思考过程块中
+        self.current_thinking = ''  # 当前收集的思考过程内容
+        self.pending_start_tag = ''  # 用于缓存可能被截断的开始标签部分
+
+    def parse(self, chunk: BaseMessageChunk) -> Dict[str, Any]:
+        enable_tag_parsing = self.enable_tag_parsing
+        start_tag = self.start_tag
+        end_tag = self.end_tag
 
-    for chunk in res:
         SQLBotLogUtil.info(chunk)
         reasoning_content_chunk = ''
         content = chunk.content
@@ -1523,27 +1619,26 @@ def process_stream(res: Iterator[BaseMessageChunk],
                 reasoning_content = ''
 
             # 累积additional_kwargs中的思考内容到current_thinking
-            current_thinking += reasoning_content
+            self.current_thinking += reasoning_content
             reasoning_content_chunk = reasoning_content
 
         # 只有当current_thinking不是空字符串时才跳过标签解析
-        if not in_thinking_block and current_thinking.strip() != '':
+        if not self.in_thinking_block and self.current_thinking.strip() != '':
             output_content = content  # 正常输出content
-            yield {
+            get_token_usage(chunk, self.token_usage)
+            return {
                 'content': output_content,
                 'reasoning_content': reasoning_content_chunk
-            }
-            get_token_usage(chunk, token_usage)
-            continue  # 跳过后续的标签解析逻辑
+            }  # 跳过后续的标签解析逻辑
 
         # 如果没有有效的思考内容，并且启用了标签解析，才执行标签解析逻辑
         # 如果有缓存的开始标签部分，先拼接当前内容
-        if pending_start_tag:
-            content = pending_start_tag + content
-            pending_start_tag = ''
+        if self.pending_start_tag:
+            content = self.pending_start_tag + content
+            self.pending_start_tag = ''
 
         # 检查是否开始思考过程块（处理可能被截断的开始标签）
-        if enable_tag_parsing and not in_thinking_block and start_tag:
+        if enable_tag_parsing and not self.in_thinking_block and start_tag:
             if start_tag in content:
                 start_idx = content.index(start_tag)
                 # 只有当开始标签前面没有其他文本时才认为是真正的思考块开始
@@ -1551,7 +1646,7 @@ def process_stream(res: Iterator[BaseMessageChunk],
                     # 完整标签存在且前面没有其他文本
                     output_content += content[:start_idx]  # 输出开始标签之前的内容
                     content = content[start_idx + len(start_tag):]  # 移除开始标签
-                    in_thinking_block = True
+                    self.in_thinking_block = True
                 else:
                     # 开始标签前面有其他文本，不认为是思考块开始
                     output_content += content
@@ -1562,26 +1657,26 @@ def process_stream(res: Iterator[BaseMessageChunk],
                     if content.endswith(start_tag[:i]):
                         # 只有当当前内容全是空白时才缓存部分标签
                         if content[:-i].strip() == '':
-                            pending_start_tag = start_tag[:i]
+                            self.pending_start_tag = start_tag[:i]
                             content = content[:-i]  # 移除可能的部分标签
                             output_content += content
                             content = ''
                         break
 
         # 处理思考块内容
-        if enable_tag_parsing and in_thinking_block and end_tag:
+        if enable_tag_parsing and self.in_thinking_block and end_tag:
             if end_tag in content:
                 # 找到结束标签
                 end_idx = content.index(end_tag)
-                current_thinking += content[:end_idx]  # 收集思考内容
-                reasoning_content_chunk += current_thinking  # 添加到当前块的思考内容
+                self.current_thinking += content[:end_idx]  # 收集思考内容
+                reasoning_content_chunk += self.current_thinking  # 添加到当前块的思考内容
                 content = content[end_idx + len(end_tag):]  # 移除结束标签后的内容
-                current_thinking = ''  # 重置当前思考内容
-                in_thinking_block = False
+                self.current_thinking = ''  # 重置当前思考内容
+                self.in_thinking_block = False
                 output_content += content  # 输出结束标签之后的内容
             else:
                 # 在遇到结束标签前，持续收集思考内容
-                current_thinking += content
+                self.current_thinking += content
                 reasoning_content_chunk += content
                 content = ''
 
@@ -1589,11 +1684,33 @@ def process_stream(res: Iterator[BaseMessageChunk],
             # 不在思考块中或标签解析未启用，正常输出
             output_content += content
 
-        yield {
+        get_token_usage(chunk, self.token_usage)
+        return {
             'content': output_content,
             'reasoning_content': reasoning_content_chunk
         }
-        get_token_usage(chunk, token_usage)
+
+
+def process_stream(res: Iterator[BaseMessageChunk],
+                   token_usage: Dict[str, Any] = None,
+                   enable_tag_parsing: bool = settings.PARSE_REASONING_BLOCK_ENABLED,
+                   start_tag: str = settings.DEFAULT_REASONING_CONTENT_START,
+                   end_tag: str = settings.DEFAULT_REASONING_CONTENT_END
+                   ):
+    parser = StreamChunkParser({} if token_usage is None else token_usage, enable_tag_parsing, start_tag, end_tag)
+    for chunk in res:
+        yield parser.parse(chunk)
+
+
+async def aprocess_stream(res: AsyncIterator[BaseMessageChunk],
+                          token_usage: Dict[str, Any] = None,
+                          enable_tag_parsing: bool = settings.PARSE_REASONING_BLOCK_ENABLED,
+                          start_tag: str = settings.DEFAULT_REASONING_CONTENT_START,
+                          end_tag: str = settings.DEFAULT_REASONING_CONTENT_END
+                          ):
+    parser = StreamChunkParser({} if token_usage is None else token_usage, enable_tag_parsing, start_tag, end_tag)
+    async for chunk in res:
+        yield parser.parse(chunk)
 
 
 def get_lang_name(lang: str):
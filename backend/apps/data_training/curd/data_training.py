@@ -5,10 +5,11 @@ from typing import List, Optional
 from xml.dom.minidom import parseString
 
 import dicttoxml
+from pgvector.sqlalchemy import VECTOR
 from sqlalchemy import and_, select, func, delete, update, or_
-from sqlalchemy import text
+from sqlalchemy import text, bindparam
 
-from apps.ai_model.embedding import EmbeddingModelCache
+from apps.ai_model.embedding import EmbeddingQueryCache, run_batch_embedding
 from apps.data_training.models.data_training_model import DataTrainingInfo, DataTraining, DataTrainingInfoResult
 from apps.datasource.models.datasource import CoreDatasource
 from apps.system.models.system_model import AssistantModel
@@ -16,6 +17,8 @@ from apps.template.generate_chart.generator import get_base_data_training_templa
 from common.core.config import settings
 from common.core.deps import SessionDep, Trans
 from common.utils.embedding_threads import run_save_data_training_embeddings
+from common.utils.keyword_matcher import OrgKeywordMatcher
+from common.utils.vector_index import embedding_distance, embedding_dimension_filter, ensure_embedding_index
 
 
 def get_data_training_base_query(oid: int, name: Optional[str] = None):
@@ -204,6 +207,7 @@ def create_training(session: SessionDep, info: DataTrainingInfo, oid: int, trans
     session.flush()
     session.refresh(data_training)
     session.commit()
+    training_matcher.invalidate(oid)
 
     # 处理embedding（批量插入时跳过）
     if not skip_embedding:
@@ -258,6 +262,7 @@ def update_training(session: SessionDep, info: DataTrainingInfo, oid: int, trans
     )
     session.execute(stmt)
     session.commit()
+    training_matcher.invalidate(oid)
 
     # embedding
     run_save_data_training_embeddings([info.id])
@@ -409,9 +414,11 @@ def batch_create_training(session: SessionDep, info_list: List[DataTrainingInfo]
 
 
 def delete_training(session: SessionDep, ids: list[int]):
-    stmt = delete(DataTraining).where(and_(DataTraining.id.in_(ids)))
-    session.execute(stmt)
+    stmt = delete(DataTraining).where(and_(DataTraining.id.in_(ids))).returning(DataTraining.oid)
+    oids = {row[0] for row in session.execute(stmt)}
     session.commit()
+    # 只失效受影响组织的自动机
+    training_matcher.invalidate_many(oids)
 
 
 def enable_training(session: SessionDep, id: int, enabled: bool, trans: Trans):
@@ -423,9 +430,11 @@ def enable_training(session: SessionDep, id: int, enabled: bool, trans: Trans):
 
     stmt = update(DataTraining).where(and_(DataTraining.id == id)).values(
         enabled=enabled,
-    )
-    session.execute(stmt)
+    ).returning(DataTraining.oid)
+    oids = {row[0] for row in session.execute(stmt)}
     session.commit()
+    # 只失效受影响组织的自动机
+    training_matcher.invalidate_many(oids)
 
 
 # def run_save_embeddings(ids: List[int]):
@@ -460,50 +469,59 @@ def save_embeddings(session_maker, ids: List[int]):
         return
     try:
         session = session_maker()
-        _list = session.query(DataTraining).filter(and_(DataTraining.id.in_(ids))).all()
 
-        _question_list = [item.question for item in _list]
+        def load_texts(batch_ids: List[int]):
+            _list = session.query(DataTraining.id, DataTraining.question).filter(
+                and_(DataTraining.id.in_(batch_ids))).all()
+            return [(item.id, item.question) for item in _list]
 
-        model = EmbeddingModelCache.get_model()
-
-        results = model.embed_documents(_question_list)
-
-        for index in range(len(results)):
-            item = results[index]
-            stmt = update(DataTraining).where(and_(DataTraining.id == _list[index].id)).values(embedding=item)
-            session.execute(stmt)
+        def save_batch(values: List[dict]):
+            session.execute(update(DataTraining), values)
             session.commit()
 
+        dims = run_batch_embedding('data training', list(ids), load_texts, save_batch, session)
+        for dim in dims:
+            ensure_embedding_index(session, DataTraining.__tablename__, dim)
+
     except Exception:
         traceback.print_exc()
     finally:
         session_maker.remove()
 
 
-embedding_sql = f"""
-SELECT id, datasource, question, similarity
+def embedding_sql(dim: int, in_advanced_application: bool = False) -> str:
+    """
+    先按 oid / enabled / 数据源（或高级应用）过滤，再按向量距离取 top k（命中 data_training 上对应维度的 hnsw 索引），
+    最后在外层按相似度阈值过滤
+    """
+    owner_column = 'advanced_application' if in_advanced_application else 'datasource'
+    return f"""
+SELECT id, {owner_column}, question, similarity
 FROM
-(SELECT id, datasource, question, oid, enabled,
-( 1 - (embedding <=> :embedding_array) ) AS similarity
+(SELECT id, {owner_column}, question,
+( 1 - {embedding_distance(dim)} ) AS similarity
 FROM data_training AS child
-) TEMP
-WHERE similarity > {settings.EMBEDDING_DATA_TRAINING_SIMILARITY} and oid = :oid and datasource = :datasource and enabled = true
-ORDER BY similarity DESC
+WHERE oid = :oid and {owner_column} = :{owner_column} and enabled = true
+AND embedding IS NOT NULL AND {embedding_dimension_filter(dim)}
+ORDER BY {embedding_distance(dim)}
 LIMIT {settings.EMBEDDING_DATA_TRAINING_TOP_COUNT}
-"""
-embedding_sql_in_advanced_application = f"""
-SELECT id, advanced_application, question, similarity
-FROM
-(SELECT id, advanced_application, question, oid, enabled,
-( 1 - (embedding <=> :embedding_array) ) AS similarity
-FROM data_training AS child
 ) TEMP
-WHERE similarity > {settings.EMBEDDING_DATA_TRAINING_SIMILARITY} and oid = :oid and advanced_application = :advanced_application and enabled = true
+WHERE similarity > {settings.EMBEDDING_DATA_TRAINING_SIMILARITY}
 ORDER BY similarity DESC
-LIMIT {settings.EMBEDDING_DATA_TRAINING_TOP_COUNT}
 """
 
 
+def load_training_questions(session: SessionDep, oid: int):
+    stmt = select(DataTraining.id, DataTraining.question, DataTraining.datasource,
+                  DataTraining.advanced_application).where(
+        and_(DataTraining.oid == oid, DataTraining.enabled == True))
+    return [(row.question, row) for row in session.execute(stmt)]
+
+
+# 按组织缓存的示例问题自动机，用于找出问题中包含的所有示例问题
+training_matcher = OrgKeywordMatcher(load_training_questions)
+
+
 def select_training_by_question(session: SessionDep, question: str, oid: int, datasource: Optional[int] = None,
                                 advanced_application_id: Optional[int] = None):
     if question.strip() == "":
@@ -511,14 +529,24 @@ def select_training_by_question(session: SessionDep, question: str, oid: int, da
 
     _list: List[DataTraining] = []
 
+    # 问题中包含的示例问题（原 :sentence ILIKE '%' || question || '%'），使用按组织缓存的自动机
+    for row in training_matcher.get(session, oid).find(question):
+        if advanced_application_id is not None:
+            if row.advanced_application != advanced_application_id:
+                continue
+        elif row.datasource != datasource:
+            continue
+        _list.append(DataTraining(id=row.id, question=row.question))
+
     # maybe use label later?
+    # 包含问题的示例问题，可使用 question 上的 pg_trgm GIN 索引
     stmt = (
         select(
             DataTraining.id,
             DataTraining.question,
         )
         .where(
-            and_(or_(text(":sentence ILIKE '%' || question || '%'"), text("question ILIKE '%' || :sentence || '%'")),
+            and_(text("question ILIKE '%' || :sentence || '%'"),
                  DataTraining.oid == oid,
                  DataTraining.enabled == True)
         )
@@ -536,17 +564,17 @@ def select_training_by_question(session: SessionDep, question: str, oid: int, da
     if settings.EMBEDDING_ENABLED:
         with session.begin_nested():
             try:
-                model = EmbeddingModelCache.get_model()
-
-                embedding = model.embed_query(question)
+                embedding = EmbeddingQueryCache.embed_query(question)
+                dim = len(embedding)
 
+                stmt = text(embedding_sql(dim, advanced_application_id is not None)).bindparams(
+                    bindparam('embedding_array', type_=VECTOR(dim)))
                 if advanced_application_id is not None:
-                    results = session.execute(text(embedding_sql_in_advanced_application),
-                                              {'embedding_array': str(embedding), 'oid': oid,
-                                               'advanced_application': advanced_application_id})
+                    results = session.execute(stmt, {'embedding_array': embedding, 'oid': oid,
+                                                     'advanced_application': advanced_application_id})
                 else:
-                    results = session.execute(text(embedding_sql),
-                                              {'embedding_array': str(embedding), 'oid': oid, 'datasource': datasource})
+                    results = session.execute(stmt, {'embedding_array': embedding, 'oid': oid,
+                                                     'datasource': datasource})
 
                 for row in results:
                     _list.append(DataTraining(id=row.id, question=row.question))
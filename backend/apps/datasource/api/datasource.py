@@ -4,7 +4,7 @@ import io
 import os
 import traceback
 import uuid
-from io import StringIO
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 from urllib.parse import quote
 
@@ -14,8 +14,8 @@ from fastapi import APIRouter, File, UploadFile, HTTPException, Path
 from fastapi.responses import StreamingResponse
 from sqlalchemy import and_
 
-from apps.db.db import get_schema
-from apps.db.engine import get_engine_conn
+from apps.db.db import get_schema, get_engine_pool_status
+from apps.db.engine import get_engine_conn, copy_df_to_table
 from apps.swagger.i18n import PLACEHOLDER_PREFIX
 from apps.system.schemas.permission import SqlbotPermission, require_permissions
 from common.core.config import settings
@@ -25,6 +25,7 @@ from ..crud.datasource import get_datasource_list, check_status, create_ds, upda
     execSql, update_table_and_fields, getTablesByDs, chooseTables, preview, updateTable, updateField, get_ds, fieldEnum, \
     check_status_by_id, sync_single_fields
 from ..crud.field import get_fields_by_table_id
+from ..crud.sync_progress import get_sync_progress
 from ..crud.table import get_tables_by_ds_id
 from ..models.datasource import CoreDatasource, CreateDatasource, TableObj, CoreTable, CoreField, FieldObj, \
     TableSchemaResponse, ColumnSchemaResponse, PreviewResponse
@@ -42,6 +43,13 @@ async def query_by_oid(session: SessionDep, user: CurrentUser, oid: int) -> List
     return get_datasource_list(session=session, user=user, oid=oid)
 
 
+@router.get("/poolStatus", include_in_schema=False)
+async def pool_status(user: CurrentUser):
+    if not user.isAdmin:
+        raise Exception("no permission to execute")
+    return get_engine_pool_status()
+
+
 @router.get("/list", response_model=List[CoreDatasource], summary=f"{PLACEHOLDER_PREFIX}ds_list",
             description=f"{PLACEHOLDER_PREFIX}ds_list_description")
 async def datasource_list(session: SessionDep, user: CurrentUser):
@@ -163,6 +171,12 @@ async def sync_fields(session: SessionDep, trans: Trans,
     return sync_single_fields(session, trans, id)
 
 
+@router.get("/syncProgress/{id}", response_model=None, summary=f"{PLACEHOLDER_PREFIX}ds_sync_progress")
+@require_permissions(permission=SqlbotPermission(type='ds', keyExpression="id"))
+async def sync_progress(id: int = Path(..., description=f"{PLACEHOLDER_PREFIX}ds_id")):
+    return get_sync_progress(id)
+
+
 from pydantic import BaseModel
 
 
@@ -318,20 +332,35 @@ async def upload_excel(session: SessionDep, file: UploadFile = File(..., descrip
     def inner():
         sheets = []
         engine = get_engine_conn()
-        if filename.endswith(".csv"):
-            df = pd.read_csv(save_path, engine='c')
-            tableName = f"sheet1_{hashlib.sha256(uuid.uuid4().bytes).hexdigest()[:10]}"
-            sheets.append({"tableName": tableName, "tableComment": ""})
-            insert_pg(df, tableName, engine)
-        else:
-            sheet_names = pd.ExcelFile(save_path).sheet_names
-            for sheet_name in sheet_names:
-                tableName = f"{sheet_name}_{hashlib.sha256(uuid.uuid4().bytes).hexdigest()[:10]}"
+        try:
+            if filename.endswith(".csv"):
+                df = pd.read_csv(save_path, engine='c')
+                tableName = f"sheet1_{hashlib.sha256(uuid.uuid4().bytes).hexdigest()[:10]}"
                 sheets.append({"tableName": tableName, "tableComment": ""})
-                # df_temp = pd.read_excel(save_path, nrows=5)
-                # non_empty_cols = df_temp.columns[df_temp.notna().any()].tolist()
-                df = pd.read_excel(save_path, sheet_name=sheet_name, engine='calamine')
                 insert_pg(df, tableName, engine)
+            else:
+                sheet_names = pd.ExcelFile(save_path, engine='calamine').sheet_names
+                table_names = []
+                for sheet_name in sheet_names:
+                    tableName = f"{sheet_name}_{hashlib.sha256(uuid.uuid4().bytes).hexdigest()[:10]}"
+                    sheets.append({"tableName": tableName, "tableComment": ""})
+                    table_names.append(tableName)
+
+                def import_sheet(sheet_name, table_name):
+                    # df_temp = pd.read_excel(save_path, nrows=5)
+                    # non_empty_cols = df_temp.columns[df_temp.notna().any()].tolist()
+                    df = pd.read_excel(save_path, sheet_name=sheet_name, engine='calamine')
+                    insert_pg(df, table_name, engine)
+
+                # 多个 sheet 并行读取和导入，每个 sheet 使用独立的连接
+                workers = max(min(settings.EXCEL_IMPORT_WORKERS, len(sheet_names)), 1)
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    futures = [executor.submit(import_sheet, sheet_name, table_name)
+                               for sheet_name, table_name in zip(sheet_names, table_names)]
+                    for future in futures:
+                        future.result()
+        finally:
+            engine.dispose()
 
         # os.remove(save_path)
         return {"filename": filename, "sheets": sheets}
@@ -340,37 +369,11 @@ async def upload_excel(session: SessionDep, file: UploadFile = File(..., descrip
 
 
 def insert_pg(df, tableName, engine):
-    # fix field type
-    for i in range(len(df.dtypes)):
-        if str(df.dtypes[i]) == 'uint64':
-            df[str(df.columns[i])] = df[str(df.columns[i])].astype('string')
-
-    conn = engine.raw_connection()
-    cursor = conn.cursor()
     try:
-        df.to_sql(
-            tableName,
-            engine,
-            if_exists='replace',
-            index=False
-        )
-        # trans csv
-        output = StringIO()
-        df.to_csv(output, sep='\t', header=False, index=False)
-        # output.seek(0)
-
-        # pg copy
-        cursor.copy_expert(
-            sql=f"""COPY "{tableName}" FROM STDIN WITH CSV DELIMITER E'\t'""",
-            file=output
-        )
-        conn.commit()
+        copy_df_to_table(engine, tableName, df)
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(400, str(e))
-    finally:
-        cursor.close()
-        conn.close()
 
 
 t_sheet = "数据表列表"
@@ -4,6 +4,7 @@ from typing import List
 
 from fastapi import APIRouter, Path
 
+from apps.datasource.crud.schema_cache import invalidate_ds_schema
 from apps.datasource.models.datasource import CoreDatasource
 from apps.swagger.i18n import PLACEHOLDER_PREFIX
 from common.core.deps import SessionDep
@@ -18,6 +19,7 @@ async def save_relation(session: SessionDep, relation: List[dict],
     if ds:
         ds.table_relation = relation
         session.commit()
+        invalidate_ds_schema(ds_id)
     else:
         raise Exception("no datasource")
     return True
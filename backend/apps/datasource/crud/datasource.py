@@ -1,22 +1,25 @@
 import datetime
 import json
-from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, List, Optional
 
 from fastapi import HTTPException
-from sqlalchemy import and_, text
-from sqlbot_xpack.permissions.models.ds_rules import DsRules
+from sqlalchemy import and_, text, insert, update, delete
 from sqlmodel import select
 
 from apps.datasource.crud.permission import get_column_permission_fields, get_row_permission_filters, is_normal_user
 from apps.datasource.embedding.table_embedding import calc_table_embedding
 from apps.datasource.utils.utils import aes_decrypt
 from apps.db.constant import DB
-from apps.db.db import get_tables, get_fields, exec_sql, check_connection
+from apps.db.db import get_tables, get_fields, get_all_fields, exec_sql, check_connection, dispose_ds_engine
+from apps.db.ds_metadata import refresh_ds_metadata, refresh_ds_metadata_async, invalidate_ds_metadata
 from apps.db.engine import get_engine_config, get_engine_conn
 from common.core.config import settings
 from common.core.deps import SessionDep, CurrentUser, Trans
 from common.utils.embedding_threads import run_save_table_embeddings, run_save_ds_embeddings
-from common.utils.utils import deepcopy_ignore_extra
+from common.utils.utils import deepcopy_ignore_extra, SQLBotLogUtil
+from .schema_cache import get_ds_schema, invalidate_ds_schema
+from .sync_progress import SyncProgress, start_sync_progress
 from .table import get_tables_by_ds_id
 from ..crud.field import delete_field_by_ds_id, update_field
 from ..crud.table import delete_table_by_ds_id, update_table
@@ -48,7 +51,11 @@ def check_status_by_id(session: SessionDep, trans: Trans, ds_id: int, is_raise:
 
 
 def check_status(session: SessionDep, trans: Trans, ds: CoreDatasource, is_raise: bool = False):
-    return check_connection(trans, ds, is_raise)
+    status = check_connection(trans, ds, is_raise)
+    if status:
+        # 连接正常时顺带刷新版本等元信息
+        refresh_ds_metadata_async(ds)
+    return status
 
 
 def check_name(session: SessionDep, trans: Trans, user: CurrentUser, ds: CoreDatasource):
@@ -105,6 +112,9 @@ def update_ds(session: SessionDep, trans: Trans, user: CurrentUser, ds: CoreData
         setattr(record, field, value)
     session.add(record)
     session.commit()
+    dispose_ds_engine(ds.id)
+    invalidate_ds_schema(ds.id)
+    invalidate_ds_metadata(ds.id)
 
     run_save_ds_embeddings([ds.id])
     return ds
@@ -130,6 +140,9 @@ def delete_ds(session: SessionDep, id: int):
 
     session.delete(term)
     session.commit()
+    dispose_ds_engine(id)
+    invalidate_ds_schema(id)
+    invalidate_ds_metadata(id)
     delete_table_by_ds_id(session, id)
     delete_field_by_ds_id(session, id)
     return {
@@ -186,86 +199,208 @@ def sync_single_fields(session: SessionDep, trans: Trans, id: int):
     run_save_ds_embeddings([ds.id])
 
 
+# 批量写入表/字段时每批的行数
+SYNC_BATCH_SIZE = 1000
+
+
+def introspect_fields(ds: CoreDatasource, table_names: List[str], progress: Optional[SyncProgress] = None) -> dict[
+    str, List[ColumnSchema]]:
+    """
+    读取所选表的字段：支持的类型通过 catalog 查询按表名批量取回，
+    不支持或查询失败时按表并行查询
+    """
+    if not table_names:
+        return {}
+    fields_map = None
+    if len(table_names) > 1:
+        try:
+            fields_map = get_all_fields(ds, table_names)
+        except Exception as e:
+            SQLBotLogUtil.error(f"Datasource {ds.id} catalog query failed, fall back to per table query: {e}")
+    if fields_map is None:
+        return introspect_fields_parallel(ds, table_names, progress)
+    if progress is not None:
+        progress.update(done=len(table_names))
+    return fields_map
+
+
+def introspect_fields_parallel(ds: CoreDatasource, table_names: List[str],
+                               progress: Optional[SyncProgress] = None) -> dict[str, List[ColumnSchema]]:
+    """
+    按表并行查询字段，线程数不超过 DS_INTROSPECT_WORKERS 和数据源连接池大小，避免占满数据源连接
+    """
+    workers = max(min(settings.DS_INTROSPECT_WORKERS, settings.DS_POOL_SIZE, len(table_names)), 1)
+    # 工作线程不能访问 session 中的对象
+    ds = CoreDatasource(**ds.model_dump())
+    fields_map: dict[str, List[ColumnSchema]] = {}
+    if workers == 1:
+        for table_name in table_names:
+            fields_map[table_name] = get_fields(ds, table_name)
+            if progress is not None:
+                progress.advance()
+        return fields_map
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sqlbot-introspect') as executor:
+        futures = {executor.submit(get_fields, ds, table_name): table_name for table_name in table_names}
+        try:
+            for future in as_completed(futures):
+                fields_map[futures[future]] = future.result()
+                if progress is not None:
+                    progress.advance()
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+    return fields_map
+
+
 def sync_table(session: SessionDep, ds: CoreDatasource, tables: List[CoreTable]):
-    id_list = []
+    # 同名表只保留第一个
+    unique_tables = {}
+    for item in tables:
+        unique_tables.setdefault(item.table_name, item)
+    tables = list(unique_tables.values())
+    progress = start_sync_progress(ds.id, len(tables))
+    try:
+        fields_map = introspect_fields(ds, [item.table_name for item in tables], progress)
+        id_list = bulk_sync_tables(session, ds, tables, fields_map, progress)
+    except Exception as e:
+        session.rollback()
+        progress.finish(str(e))
+        raise
+    progress.finish()
+    invalidate_ds_schema(ds.id)
+    try:
+        refresh_ds_metadata(ds)
+    except Exception as e:
+        SQLBotLogUtil.error(f"Refresh datasource {ds.id} metadata failed: {e}")
+
+    # do table embedding
+    run_save_table_embeddings(id_list)
+    run_save_ds_embeddings([ds.id])
+
+
+def bulk_sync_tables(session: SessionDep, ds: CoreDatasource, tables: List[CoreTable],
+                     fields_map: dict[str, List[ColumnSchema]], progress: Optional[SyncProgress] = None) -> List[int]:
+    """
+    在内存中比对已保存的表，批量插入/更新/删除，字段同步与表在同一事务中提交
+    """
+    if progress is not None:
+        progress.update(stage='tables', done=0, total=len(tables))
+    existing = {row.table_name: row for row in
+                session.query(CoreTable.id, CoreTable.table_name, CoreTable.table_comment).filter(
+                    CoreTable.ds_id == ds.id).all()}
+
+    updates = []
+    inserts = []
     for item in tables:
-        statement = select(CoreTable).where(and_(CoreTable.ds_id == ds.id, CoreTable.table_name == item.table_name))
-        record = session.exec(statement).first()
-        # update exist table, only update table_comment
+        record = existing.get(item.table_name)
         if record is not None:
+            # update exist table, only update table_comment
             item.id = record.id
-            id_list.append(record.id)
-
-            record.table_comment = item.table_comment
-            session.add(record)
-            session.commit()
+            if record.table_comment != item.table_comment:
+                updates.append({'id': record.id, 'table_comment': item.table_comment})
         else:
-            # save new table
-            table = CoreTable(ds_id=ds.id, checked=True, table_name=item.table_name, table_comment=item.table_comment,
-                              custom_comment=item.table_comment)
-            session.add(table)
-            session.flush()
-            session.refresh(table)
-            item.id = table.id
-            id_list.append(table.id)
-            session.commit()
-
-        # sync field
-        fields = getFieldsByDs(session, ds, item.table_name)
-        sync_fields(session, ds, item, fields)
+            inserts.append({'ds_id': ds.id, 'checked': True, 'table_name': item.table_name,
+                            'table_comment': item.table_comment, 'custom_comment': item.table_comment})
+
+    for i in range(0, len(updates), SYNC_BATCH_SIZE):
+        session.execute(update(CoreTable), updates[i:i + SYNC_BATCH_SIZE])
+    new_ids: dict[str, int] = {}
+    for i in range(0, len(inserts), SYNC_BATCH_SIZE):
+        for row in session.execute(insert(CoreTable).returning(CoreTable.id, CoreTable.table_name),
+                                   inserts[i:i + SYNC_BATCH_SIZE]):
+            new_ids[row.table_name] = row.id
+    for item in tables:
+        if item.table_name in new_ids:
+            item.id = new_ids[item.table_name]
+    id_list = [item.id for item in tables]
+    if progress is not None:
+        progress.update(done=len(tables))
 
+    # 删除未选择的表及其字段
     if len(id_list) > 0:
         session.query(CoreTable).filter(and_(CoreTable.ds_id == ds.id, CoreTable.id.not_in(id_list))).delete(
             synchronize_session=False)
         session.query(CoreField).filter(and_(CoreField.ds_id == ds.id, CoreField.table_id.not_in(id_list))).delete(
             synchronize_session=False)
-        session.commit()
     else:  # delete all tables and fields in this ds
         session.query(CoreTable).filter(CoreTable.ds_id == ds.id).delete(synchronize_session=False)
         session.query(CoreField).filter(CoreField.ds_id == ds.id).delete(synchronize_session=False)
-        session.commit()
 
-    # do table embedding
-    run_save_table_embeddings(id_list)
-    run_save_ds_embeddings([ds.id])
+    bulk_sync_fields(session, ds, {item.id: fields_map.get(item.table_name) or [] for item in tables}, progress)
+    session.commit()
+    return id_list
+
+
+def bulk_sync_fields(session: SessionDep, ds: CoreDatasource, fields_map: dict[int, List[ColumnSchema]],
+                     progress: Optional[SyncProgress] = None):
+    """
+    按表 id 批量同步字段，不提交事务；字段查询结果为空的表保留原有字段
+    """
+    table_ids = [table_id for table_id, fields in fields_map.items() if fields]
+    total = sum(len(fields_map[table_id]) for table_id in table_ids)
+    if progress is not None:
+        progress.update(stage='save', done=0, total=total)
+    if not table_ids:
+        return
+
+    existing: dict[tuple, Any] = {}
+    for i in range(0, len(table_ids), SYNC_BATCH_SIZE):
+        for row in session.query(CoreField.id, CoreField.table_id, CoreField.field_name, CoreField.field_type,
+                                 CoreField.field_comment, CoreField.field_index).filter(
+            CoreField.table_id.in_(table_ids[i:i + SYNC_BATCH_SIZE])).all():
+            existing[(row.table_id, row.field_name)] = row
+
+    updates = []
+    inserts = []
+    keep_ids = set()
+    for table_id in table_ids:
+        for index, item in enumerate(fields_map[table_id]):
+            record = existing.get((table_id, item.fieldName))
+            if record is not None:
+                item.id = record.id
+                keep_ids.add(record.id)
+                if (record.field_comment != item.fieldComment or record.field_index != index
+                        or record.field_type != item.fieldType):
+                    updates.append({'id': record.id, 'field_comment': item.fieldComment, 'field_index': index,
+                                    'field_type': item.fieldType})
+            else:
+                inserts.append({'ds_id': ds.id, 'table_id': table_id, 'checked': True, 'field_name': item.fieldName,
+                                'field_type': item.fieldType, 'field_comment': item.fieldComment,
+                                'custom_comment': item.fieldComment, 'field_index': index})
+    delete_ids = [row.id for row in existing.values() if row.id not in keep_ids]
+
+    for i in range(0, len(delete_ids), SYNC_BATCH_SIZE):
+        session.execute(delete(CoreField).where(CoreField.id.in_(delete_ids[i:i + SYNC_BATCH_SIZE])))
+    done = total - len(updates) - len(inserts)
+    for i in range(0, len(updates), SYNC_BATCH_SIZE):
+        batch = updates[i:i + SYNC_BATCH_SIZE]
+        session.execute(update(CoreField), batch)
+        done += len(batch)
+        if progress is not None:
+            progress.update(done=done)
+    for i in range(0, len(inserts), SYNC_BATCH_SIZE):
+        batch = inserts[i:i + SYNC_BATCH_SIZE]
+        session.execute(insert(CoreField), batch)
+        done += len(batch)
+        if progress is not None:
+            progress.update(done=done)
+    SQLBotLogUtil.info(f"Datasource {ds.id} fields synced, tables: {len(table_ids)}, inserted: {len(inserts)}, "
+                       f"updated: {len(updates)}, deleted: {len(delete_ids)}")
 
 
 def sync_fields(session: SessionDep, ds: CoreDatasource, table: CoreTable, fields: List[ColumnSchema]):
-    id_list = []
-    for index, item in enumerate(fields):
-        statement = select(CoreField).where(
-            and_(CoreField.table_id == table.id, CoreField.field_name == item.fieldName))
-        record = session.exec(statement).first()
-        if record is not None:
-            item.id = record.id
-            id_list.append(record.id)
-
-            record.field_comment = item.fieldComment
-            record.field_index = index
-            record.field_type = item.fieldType
-            session.add(record)
-            session.commit()
-        else:
-            field = CoreField(ds_id=ds.id, table_id=table.id, checked=True, field_name=item.fieldName,
-                              field_type=item.fieldType, field_comment=item.fieldComment,
-                              custom_comment=item.fieldComment, field_index=index)
-            session.add(field)
-            session.flush()
-            session.refresh(field)
-            item.id = field.id
-            id_list.append(field.id)
-            session.commit()
-
-    if len(id_list) > 0:
-        session.query(CoreField).filter(and_(CoreField.table_id == table.id, CoreField.id.not_in(id_list))).delete(
-            synchronize_session=False)
-        session.commit()
+    bulk_sync_fields(session, ds, {table.id: fields})
+    session.commit()
+    invalidate_ds_schema(ds.id)
 
 
 def update_table_and_fields(session: SessionDep, data: TableObj):
     update_table(session, data.table)
     for field in data.fields:
         update_field(session, field)
+    invalidate_ds_schema(data.table.ds_id)
 
     # do table embedding
     run_save_table_embeddings([data.table.id])
@@ -274,6 +409,7 @@ def update_table_and_fields(session: SessionDep, data: TableObj):
 
 def updateTable(session: SessionDep, table: CoreTable):
     update_table(session, table)
+    invalidate_ds_schema(table.ds_id)
 
     # do table embedding
     run_save_table_embeddings([table.id])
@@ -282,6 +418,7 @@ def updateTable(session: SessionDep, table: CoreTable):
 
 def updateField(session: SessionDep, field: CoreField):
     update_field(session, field)
+    invalidate_ds_schema(field.ds_id)
 
     # do table embedding
     run_save_table_embeddings([field.table_id])
@@ -306,9 +443,8 @@ def preview(session: SessionDep, current_user: CurrentUser, id: int, data: Table
     f_list = [f for f in fields if f.checked]
     if is_normal_user(current_user):
         # column is checked, and, column permission for data.fields
-        contain_rules = session.query(DsRules).all()
         f_list = get_column_permission_fields(session=session, current_user=current_user, table=data.table,
-                                              fields=f_list, contain_rules=contain_rules)
+                                              fields=f_list)
 
         # row permission tree
         where_str = ''
@@ -396,125 +532,72 @@ def updateNum(session: SessionDep, ds: CoreDatasource):
 
 def get_table_obj_by_ds(session: SessionDep, current_user: CurrentUser, ds: CoreDatasource) -> List[TableAndFields]:
     _list: List = []
-    tables = session.query(CoreTable).filter(CoreTable.ds_id == ds.id).all()
-    conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration))) if ds.type != "excel" else get_engine_config()
-    schema = conf.dbSchema if conf.dbSchema is not None and conf.dbSchema != "" else conf.database
-
-    # get all field
-    table_ids = [table.id for table in tables]
-    all_fields = session.query(CoreField).filter(
-        and_(CoreField.table_id.in_(table_ids), CoreField.checked == True)).all()
-    # build dict
-    fields_dict = {}
-    for field in all_fields:
-        if fields_dict.get(field.table_id):
-            fields_dict.get(field.table_id).append(field)
-        else:
-            fields_dict[field.table_id] = [field]
-
-    contain_rules = session.query(DsRules).all()
-    for table in tables:
-        # fields = session.query(CoreField).filter(and_(CoreField.table_id == table.id, CoreField.checked == True)).all()
-        fields = fields_dict.get(table.id)
+    ds_schema = get_ds_schema(session, ds)
 
+    for table_schema in ds_schema.tables:
         # do column permissions, filter fields
-        fields = get_column_permission_fields(session=session, current_user=current_user, table=table, fields=fields,
-                                              contain_rules=contain_rules)
-        _list.append(TableAndFields(schema=schema, table=table, fields=fields))
+        fields = get_column_permission_fields(session=session, current_user=current_user, table=table_schema.table,
+                                              fields=table_schema.fields)
+        _list.append(TableAndFields(schema=ds_schema.db_name, table=table_schema.table, fields=fields))
     return _list
 
 
 def get_table_schema(session: SessionDep, current_user: CurrentUser, ds: CoreDatasource, question: str,
                      embedding: bool = True) -> str:
     schema_str = ""
-    table_objs = get_table_obj_by_ds(session=session, current_user=current_user, ds=ds)
-    if len(table_objs) == 0:
+    ds_schema = get_ds_schema(session, ds)
+    if len(ds_schema.tables) == 0:
         return schema_str
-    db_name = table_objs[0].schema
+    db_name = ds_schema.db_name
     schema_str += f"【DB_ID】 {db_name}\n【Schema】\n"
     tables = []
     all_tables = []  # temp save all tables
-    for obj in table_objs:
-        schema_table = ''
-        schema_table += f"# Table: {db_name}.{obj.table.table_name}" if ds.type != "mysql" and ds.type != "es" else f"# Table: {obj.table.table_name}"
-        table_comment = ''
-        if obj.table.custom_comment:
-            table_comment = obj.table.custom_comment.strip()
-        if table_comment == '':
-            schema_table += '\n[\n'
-        else:
-            schema_table += f", {table_comment}\n[\n"
-
-        if obj.fields:
-            field_list = []
-            for field in obj.fields:
-                field_comment = ''
-                if field.custom_comment:
-                    field_comment = field.custom_comment.strip()
-                if field_comment == '':
-                    field_list.append(f"({field.field_name}:{field.field_type})")
-                else:
-                    field_list.append(f"({field.field_name}:{field.field_type}, {field_comment})")
-            schema_table += ",\n".join(field_list)
-        schema_table += '\n]\n'
-
-        t_obj = {"id": obj.table.id, "schema_table": schema_table, "embedding": obj.table.embedding}
+    # 表结构文本已按数据源缓存，这里只做列权限过滤
+    for table_schema in ds_schema.tables:
+        fields = get_column_permission_fields(session=session, current_user=current_user, table=table_schema.table,
+                                              fields=table_schema.fields)
+        t_obj = {"id": table_schema.table.id, "schema_table": table_schema.render(fields)}
         tables.append(t_obj)
         all_tables.append(t_obj)
 
     # do table embedding
     if embedding and tables and settings.TABLE_EMBEDDING_ENABLED:
-        tables = calc_table_embedding(tables, question)
+        tables = calc_table_embedding(session, tables, question, ds.id)
     # splice schema
     if tables:
         for s in tables:
             schema_str += s.get('schema_table')
 
     # field relation
-    if tables and ds.table_relation:
-        relations = list(filter(lambda x: x.get('shape') == 'edge', ds.table_relation))
-        if relations:
-            # Complete the missing table
-            # get tables in relation, remove irrelevant relation
-            embedding_table_ids = [s.get('id') for s in tables]
-            all_relations = list(
-                filter(lambda x: x.get('source').get('cell') in embedding_table_ids or x.get('target').get(
-                    'cell') in embedding_table_ids, relations))
-
-            # get relation table ids, sub embedding table ids
-            relation_table_ids = []
-            for r in all_relations:
-                relation_table_ids.append(r.get('source').get('cell'))
-                relation_table_ids.append(r.get('target').get('cell'))
-            relation_table_ids = list(set(relation_table_ids))
-            # get table dict
-            table_records = session.query(CoreTable).filter(CoreTable.id.in_(list(map(int, relation_table_ids)))).all()
-            table_dict = {}
-            for ele in table_records:
-                table_dict[ele.id] = ele.table_name
-
-            # get lost table ids
-            lost_table_ids = list(set(relation_table_ids) - set(embedding_table_ids))
-            # get lost table schema and splice it
-            lost_tables = list(filter(lambda x: x.get('id') in lost_table_ids, all_tables))
-            if lost_tables:
-                for s in lost_tables:
-                    schema_str += s.get('schema_table')
-
-            # get field dict
-            relation_field_ids = []
-            for relation in all_relations:
-                relation_field_ids.append(relation.get('source').get('port'))
-                relation_field_ids.append(relation.get('target').get('port'))
-            relation_field_ids = list(set(relation_field_ids))
-            field_records = session.query(CoreField).filter(CoreField.id.in_(list(map(int, relation_field_ids)))).all()
-            field_dict = {}
-            for ele in field_records:
-                field_dict[ele.id] = ele.field_name
-
-            if all_relations:
-                schema_str += '【Foreign keys】\n'
-                for ele in all_relations:
-                    schema_str += f"{table_dict.get(int(ele.get('source').get('cell')))}.{field_dict.get(int(ele.get('source').get('port')))}={table_dict.get(int(ele.get('target').get('cell')))}.{field_dict.get(int(ele.get('target').get('port')))}\n"
+    if tables and ds_schema.relations:
+        relations = ds_schema.relations
+        # Complete the missing table
+        # get tables in relation, remove irrelevant relation
+        embedding_table_ids = [s.get('id') for s in tables]
+        all_relations = list(
+            filter(lambda x: x.get('source').get('cell') in embedding_table_ids or x.get('target').get(
+                'cell') in embedding_table_ids, relations))
+
+        # get relation table ids, sub embedding table ids
+        relation_table_ids = []
+        for r in all_relations:
+            relation_table_ids.append(r.get('source').get('cell'))
+            relation_table_ids.append(r.get('target').get('cell'))
+        relation_table_ids = list(set(relation_table_ids))
+
+        # get lost table ids
+        lost_table_ids = list(set(relation_table_ids) - set(embedding_table_ids))
+        # get lost table schema and splice it
+        lost_tables = list(filter(lambda x: x.get('id') in lost_table_ids, all_tables))
+        if lost_tables:
+            for s in lost_tables:
+                schema_str += s.get('schema_table')
+
+        if all_relations:
+            table_dict = ds_schema.table_names
+            field_dict = ds_schema.field_names
+            schema_str += '【Foreign keys】\n'
+            for ele in all_relations:
+                schema_str += f"{table_dict.get(int(ele.get('source').get('cell')))}.{field_dict.get(int(ele.get('source').get('port')))}={table_dict.get(int(ele.get('target').get('cell')))}.{field_dict.get(int(ele.get('target').get('port')))}\n"
 
     return schema_str
@@ -1,16 +1,157 @@
 import json
+import threading
+import time
+from collections import OrderedDict
+from itertools import chain
 from typing import List, Optional
 
-from sqlalchemy import and_
+from sqlalchemy import and_, event, inspect, or_
+from sqlalchemy.orm import Session
 from sqlbot_xpack.permissions.api.permission import transRecord2DTO
 from sqlbot_xpack.permissions.models.ds_permission import DsPermission, PermissionDTO
 from sqlbot_xpack.permissions.models.ds_rules import DsRules
 
 from apps.datasource.crud.row_permission import transFilterTree
+from apps.datasource.crud.schema_cache import get_ds_schema_version
 from apps.datasource.models.datasource import CoreDatasource, CoreField, CoreTable
+from common.core.config import settings
 from common.core.deps import CurrentUser, SessionDep
 
 
+class DsPermissionIndex:
+    """
+    某个用户在某个数据源下编译后的权限：
+    - column_masks: 表 id -> 被禁用的字段 id
+    - row_permissions: 表 id -> 生效的行权限
+    - row_filters: (表 id, 数据源类型) -> 编译后的 WHERE 条件
+    """
+
+    def __init__(self, version: tuple, schema_version: int):
+        self.version = version
+        self.schema_version = schema_version
+        self.column_masks: dict[int, set[int]] = {}
+        self.row_permissions: dict[int, List[PermissionDTO]] = {}
+        self.row_filters: dict[tuple[int, str], Optional[str]] = {}
+        self.create_time = time.monotonic()
+
+    def expired(self, version: tuple, schema_version: int) -> bool:
+        if self.version != version or self.schema_version != schema_version:
+            return True
+        return 0 < settings.DS_PERMISSION_CACHE_TTL <= time.monotonic() - self.create_time
+
+
+_permission_lock = threading.Lock()
+# 全局版本号，以及按组织（规则变更）、按数据源（权限变更）的版本号
+_permission_version = 0
+_org_versions: dict[int, int] = {}
+_ds_versions: dict[int, int] = {}
+# 组织 -> ((全局版本, 组织版本), create_time, 用户 -> 生效的权限 id)
+_rules_index: dict[int, tuple[tuple, float, dict[str, set[int]]]] = {}
+# (组织, 用户, 数据源) -> 编译后的权限
+_permission_cache: OrderedDict[tuple[int, int, int], DsPermissionIndex] = OrderedDict()
+
+
+def invalidate_permission_cache(oid: Optional[int] = None, ds_id: Optional[int] = None):
+    """
+    oid 不为空时只失效该组织的规则和权限，ds_id 不为空时只失效该数据源的权限，都为空时全部失效
+    """
+    global _permission_version
+    with _permission_lock:
+        if oid is None and ds_id is None:
+            _permission_version += 1
+            _rules_index.clear()
+            _permission_cache.clear()
+            return
+        if oid is not None:
+            _org_versions[oid] = _org_versions.get(oid, 0) + 1
+            _rules_index.pop(oid, None)
+        if ds_id is not None:
+            _ds_versions[ds_id] = _ds_versions.get(ds_id, 0) + 1
+        for key in [key for key in _permission_cache.keys() if key[0] == oid or key[2] == ds_id]:
+            _permission_cache.pop(key, None)
+
+
+def _get_version(oid: int, ds_id: int) -> tuple:
+    return _permission_version, _org_versions.get(oid, 0), _ds_versions.get(ds_id, 0)
+
+
+def _get_rules_index(session: SessionDep, oid: int, version: tuple) -> dict[str, set[int]]:
+    rules_version = version[:2]
+    cached = _rules_index.get(oid)
+    if cached is not None and cached[0] == rules_version and (
+            settings.DS_PERMISSION_CACHE_TTL <= 0 or time.monotonic() - cached[1] < settings.DS_PERMISSION_CACHE_TTL):
+        return cached[2]
+
+    # 每条规则的 permission_list/user_list 只解析一次；oid 为空的规则为旧数据，对所有组织生效
+    index: dict[str, set[int]] = {}
+    for r in session.query(DsRules).filter(or_(DsRules.oid == oid, DsRules.oid.is_(None))).all():
+        p_list = json.loads(r.permission_list) if r.permission_list else None
+        u_list = json.loads(r.user_list) if r.user_list else None
+        if not p_list or not u_list:
+            continue
+        permission_ids = set()
+        for p in p_list:
+            try:
+                permission_ids.add(int(p))
+            except (TypeError, ValueError):
+                continue
+        for u in u_list:
+            index.setdefault(f'{u}', set()).update(permission_ids)
+    with _permission_lock:
+        if (_permission_version, _org_versions.get(oid, 0)) == rules_version:
+            _rules_index[oid] = (rules_version, time.monotonic(), index)
+    return index
+
+
+def _build_permission_index(session: SessionDep, oid: int, user_id: int, ds_id: int, version: tuple,
+                            schema_version: int) -> DsPermissionIndex:
+    permission_index = DsPermissionIndex(version, schema_version)
+    permission_ids = _get_rules_index(session, oid, version).get(f'{user_id}')
+    if not permission_ids:
+        return permission_index
+
+    table_ids = session.query(CoreTable.id).filter(CoreTable.ds_id == ds_id)
+    permissions = session.query(DsPermission).filter(
+        and_(DsPermission.table_id.in_(table_ids), DsPermission.id.in_(list(permission_ids)))).all()
+    for permission in permissions:
+        if permission.type == 'column':
+            masks = permission_index.column_masks.setdefault(permission.table_id, set())
+            for item in json.loads(permission.permissions) or []:
+                if not item['enable']:
+                    masks.add(item['field_id'])
+        elif permission.type == 'row':
+            permission_index.row_permissions.setdefault(permission.table_id, []).append(
+                transRecord2DTO(session, permission))
+    return permission_index
+
+
+def get_permission_index(session: SessionDep, current_user: CurrentUser, ds_id: int) -> DsPermissionIndex:
+    """
+    按 (组织, 用户, 数据源) 缓存编译后的权限，规则/权限修改（invalidate_permission_cache）
+    或数据源表/字段变更（schema 版本）后重新构建
+    """
+    oid = current_user.oid
+    key = (oid, current_user.id, ds_id)
+    schema_version = get_ds_schema_version(ds_id)
+    with _permission_lock:
+        version = _get_version(oid, ds_id)
+        permission_index = _permission_cache.get(key)
+        if permission_index is not None:
+            _permission_cache.move_to_end(key)
+    if permission_index is not None and not permission_index.expired(version, schema_version):
+        return permission_index
+
+    permission_index = _build_permission_index(session, oid, current_user.id, ds_id, version, schema_version)
+    with _permission_lock:
+        # 构建期间被失效过，结果可能已过期，不写入缓存
+        if _get_version(oid, ds_id) == version:
+            _permission_cache[key] = permission_index
+            _permission_cache.move_to_end(key)
+            while len(_permission_cache) > settings.DS_PERMISSION_CACHE_SIZE:
+                _permission_cache.popitem(last=False)
+    return permission_index
+
+
 def get_row_permission_filters(session: SessionDep, current_user: CurrentUser, ds: CoreDatasource,
                                tables: Optional[list] = None, single_table: Optional[CoreTable] = None):
     if single_table:
@@ -22,53 +163,28 @@ def get_row_permission_filters(session: SessionDep, current_user: CurrentUser, d
 
     filters = []
     if is_normal_user(current_user):
-        contain_rules = session.query(DsRules).all()
+        permission_index = get_permission_index(session, current_user, ds.id)
         for table in table_list:
-            row_permissions = session.query(DsPermission).filter(
-                and_(DsPermission.table_id == table.id, DsPermission.type == 'row')).all()
-            res: List[PermissionDTO] = []
-            if row_permissions is not None:
-                for permission in row_permissions:
-                    # check permission and user in same rules
-                    flag = False
-                    for r in contain_rules:
-                        p_list = json.loads(r.permission_list)
-                        u_list = json.loads(r.user_list)
-                        if p_list is not None and u_list is not None and permission.id in p_list and (
-                                current_user.id in u_list or f'{current_user.id}' in u_list):
-                            flag = True
-                            break
-                    if flag:
-                        res.append(transRecord2DTO(session, permission))
-            where_str = transFilterTree(session, res, ds)
+            key = (table.id, ds.type)
+            if key in permission_index.row_filters:
+                where_str = permission_index.row_filters[key]
+            else:
+                res: List[PermissionDTO] = permission_index.row_permissions.get(table.id, [])
+                where_str = transFilterTree(session, res, ds)
+                permission_index.row_filters[key] = where_str
             filters.append({"table": table.table_name, "filter": where_str})
     return filters
 
 
 def get_column_permission_fields(session: SessionDep, current_user: CurrentUser, table: CoreTable,
-                                 fields: list[CoreField], contain_rules: list[DsRules]):
+                                 fields: list[CoreField]):
     if is_normal_user(current_user):
-        column_permissions = session.query(DsPermission).filter(
-            and_(DsPermission.table_id == table.id, DsPermission.type == 'column')).all()
-        if column_permissions is not None:
-            for permission in column_permissions:
-                # check permission and user in same rules
-                # obj = session.query(DsRules).filter(
-                #     and_(DsRules.permission_list.op('@>')(cast([permission.id], JSONB)),
-                #          or_(DsRules.user_list.op('@>')(cast([f'{current_user.id}'], JSONB)),
-                #              DsRules.user_list.op('@>')(cast([current_user.id], JSONB))))
-                # ).first()
-                flag = False
-                for r in contain_rules:
-                    p_list = json.loads(r.permission_list)
-                    u_list = json.loads(r.user_list)
-                    if p_list is not None and u_list is not None and permission.id in p_list and (
-                            current_user.id in u_list or f'{current_user.id}' in u_list):
-                        flag = True
-                        break
-                if flag:
-                    permission_list = json.loads(permission.permissions)
-                    fields = filter_list(fields, permission_list)
+        ds_id = table.ds_id
+        if ds_id is None:
+            ds_id = session.query(CoreTable.ds_id).filter(CoreTable.id == table.id).scalar()
+        masks = get_permission_index(session, current_user, ds_id).column_masks.get(table.id)
+        if masks:
+            fields = [f for f in fields if f.id not in masks]
     return fields
 
 
@@ -76,10 +192,60 @@ def is_normal_user(current_user: CurrentUser):
     return current_user.id != 1
 
 
-def filter_list(list_a, list_b):
-    id_to_invalid = {}
-    for b in list_b:
-        if not b['enable']:
-            id_to_invalid[b['field_id']] = True
+# 规则和权限由 xpack 接口维护，通过 session 事件在提交后使缓存失效：
+# 规则按所属组织失效，权限按所属数据源失效，无法确定范围时（批量语句、oid/ds_id 为空）全部失效
+_PERMISSION_CHANGED = 'ds_permission_changed'
+_INVALIDATE_ALL = ('all', None)
+
+
+def _get_changed_values(obj, attr: str) -> set:
+    # 当前值和修改前的值都需要失效
+    history = inspect(obj).attrs[attr].history
+    return {getattr(obj, attr), *history.deleted}
+
+
+def _get_invalidate_scopes(obj) -> set[tuple]:
+    if isinstance(obj, DsRules):
+        scope, values = 'oid', _get_changed_values(obj, 'oid')
+    else:
+        scope, values = 'ds', _get_changed_values(obj, 'ds_id')
+    if None in values:
+        return {_INVALIDATE_ALL}
+    return {(scope, value) for value in values}
+
+
+@event.listens_for(Session, 'after_flush')
+def _check_permission_flush(session, flush_context):
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, (DsRules, DsPermission)):
+            session.info.setdefault(_PERMISSION_CHANGED, set()).update(_get_invalidate_scopes(obj))
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _check_permission_execute(orm_execute_state):
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    for mapper in orm_execute_state.all_mappers:
+        if mapper.class_ in (DsRules, DsPermission):
+            orm_execute_state.session.info.setdefault(_PERMISSION_CHANGED, set()).add(_INVALIDATE_ALL)
+            return
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    scopes = session.info.pop(_PERMISSION_CHANGED, None)
+    if not scopes:
+        return
+    if _INVALIDATE_ALL in scopes:
+        invalidate_permission_cache()
+        return
+    for scope, value in scopes:
+        if scope == 'oid':
+            invalidate_permission_cache(oid=value)
+        else:
+            invalidate_permission_cache(ds_id=value)
+
 
-    return [a for a in list_a if not id_to_invalid.get(a.id, False)]
+@event.listens_for(Session, 'after_rollback')
+def _clear_after_rollback(session):
+    session.info.pop(_PERMISSION_CHANGED, None)
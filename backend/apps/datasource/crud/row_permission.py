@@ -1,7 +1,7 @@
 # Author: Junjun
 # Date: 2025/6/25
 
-from typing import List, Dict
+from typing import List, Dict, Optional
 from apps.datasource.models.datasource import CoreField, CoreDatasource
 from apps.db.constant import DB
 from common.core.deps import SessionDep
@@ -10,18 +10,40 @@ from common.core.deps import SessionDep
 def transFilterTree(session: SessionDep, tree_list: List[any], ds: CoreDatasource) -> str | None:
     if tree_list is None:
         return None
+    # 先收集所有条件引用的字段，一次查询
+    field_ids = set()
+    for dto in tree_list:
+        collectTreeFieldIds(dto.tree, field_ids)
+    field_map = getFieldMap(session, field_ids)
     res: List[str] = []
     for dto in tree_list:
         tree = dto.tree
         if tree is None:
             continue
-        tree_exp = transTreeToWhere(session, tree, ds)
+        tree_exp = transTreeToWhere(session, tree, ds, field_map)
         if tree_exp is not None:
             res.append(tree_exp)
     return " AND ".join(res)
 
 
-def transTreeToWhere(session: SessionDep, tree: any, ds: CoreDatasource) -> str | None:
+def collectTreeFieldIds(tree: any, field_ids: set):
+    if tree is None or tree.get('items') is None:
+        return
+    for item in tree['items']:
+        if item['type'] == 'item':
+            field_ids.add(int(item['field_id']))
+        elif item['type'] == 'tree':
+            collectTreeFieldIds(item['sub_tree'], field_ids)
+
+
+def getFieldMap(session: SessionDep, field_ids: set) -> Dict[int, CoreField]:
+    if not field_ids:
+        return {}
+    return {field.id: field for field in session.query(CoreField).filter(CoreField.id.in_(list(field_ids))).all()}
+
+
+def transTreeToWhere(session: SessionDep, tree: any, ds: CoreDatasource,
+                     field_map: Optional[Dict[int, CoreField]] = None) -> str | None:
     if tree is None:
         return None
     logic = tree['logic']
@@ -32,18 +54,22 @@ def transTreeToWhere(session: SessionDep, tree: any, ds: CoreDatasource) -> str
         for item in items:
             exp: str = None
             if item['type'] == 'item':
-                exp = transTreeItem(session, item, ds)
+                exp = transTreeItem(session, item, ds, field_map)
             elif item['type'] == 'tree':
-                exp = transTreeToWhere(session, item['sub_tree'], ds)
+                exp = transTreeToWhere(session, item['sub_tree'], ds, field_map)
 
             if exp is not None:
                 list.append(exp)
     return '(' + f' {logic} '.join(list) + ')' if len(list) > 0 else None
 
 
-def transTreeItem(session: SessionDep, item: Dict, ds: CoreDatasource) -> str | None:
+def transTreeItem(session: SessionDep, item: Dict, ds: CoreDatasource,
+                  field_map: Optional[Dict[int, CoreField]] = None) -> str | None:
     res: str = None
-    field = session.query(CoreField).filter(CoreField.id == int(item['field_id'])).first()
+    if field_map is not None:
+        field = field_map.get(int(item['field_id']))
+    else:
+        field = session.query(CoreField).filter(CoreField.id == int(item['field_id'])).first()
     if field is None:
         return None
 
@@ -51,7 +77,7 @@ def transTreeItem(session: SessionDep, item: Dict, ds: CoreDatasource) -> str |
     whereName = db.prefix + field.field_name + db.suffix
     if item['filter_type'] == 'enum':
         if len(item['enum_value']) > 0:
-            if ds['type'] == 'sqlServer' and (
+            if ds.type == 'sqlServer' and (
                     field.field_type == 'nchar' or field.field_type == 'NCHAR' or field.field_type == 'nvarchar' or field.field_type == 'NVARCHAR'):
                 res = "(" + whereName + " IN (N'" + "',N'".join(item['enum_value']) + "'))"
             else:
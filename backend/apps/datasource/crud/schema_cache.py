@@ -0,0 +1,156 @@
+import json
+import threading
+import time
+from typing import List, Optional
+
+from sqlalchemy import and_
+from sqlalchemy.orm import defer
+
+from apps.datasource.models.datasource import CoreDatasource, CoreTable, CoreField, DatasourceConf
+from apps.datasource.utils.utils import aes_decrypt
+from apps.db.engine import get_engine_config
+from common.core.config import settings
+from common.core.deps import SessionDep
+
+
+class TableSchema:
+    """
+    单张表预渲染的 schema 文本，按字段 id 保存每个字段的渲染结果，列权限过滤后只需重新拼接
+    """
+
+    def __init__(self, table: CoreTable, fields: List[CoreField], header: str):
+        self.table = table
+        self.fields = fields
+        self.header = header
+        self.field_lines: dict[int, str] = {field.id: render_field(field) for field in fields}
+        self.block = self._render(fields)
+
+    def _render(self, fields: List[CoreField]) -> str:
+        schema_table = self.header
+        if fields:
+            schema_table += ",\n".join(self.field_lines[field.id] for field in fields)
+        schema_table += '\n]\n'
+        return schema_table
+
+    def render(self, fields: List[CoreField]) -> str:
+        if fields is self.fields:
+            return self.block
+        return self._render(fields)
+
+
+class DatasourceSchema:
+    """
+    数据源编译后的 schema：各表的预渲染文本、表关系以及关系中用到的表名/字段名
+    """
+
+    def __init__(self, db_name: str, tables: List[TableSchema], relations: list[dict],
+                 table_names: dict[int, str], field_names: dict[int, str]):
+        self.db_name = db_name
+        self.tables = tables
+        self.relations = relations
+        self.table_names = table_names
+        self.field_names = field_names
+        self.create_time = time.monotonic()
+
+
+def render_field(field: CoreField) -> str:
+    field_comment = ''
+    if field.custom_comment:
+        field_comment = field.custom_comment.strip()
+    if field_comment == '':
+        return f"({field.field_name}:{field.field_type})"
+    return f"({field.field_name}:{field.field_type}, {field_comment})"
+
+
+def render_table_header(ds: CoreDatasource, db_name: str, table: CoreTable) -> str:
+    header = f"# Table: {db_name}.{table.table_name}" if ds.type != "mysql" and ds.type != "es" else f"# Table: {table.table_name}"
+    table_comment = ''
+    if table.custom_comment:
+        table_comment = table.custom_comment.strip()
+    if table_comment == '':
+        header += '\n[\n'
+    else:
+        header += f", {table_comment}\n[\n"
+    return header
+
+
+def build_ds_schema(session: SessionDep, ds: CoreDatasource) -> DatasourceSchema:
+    # 缓存中的对象会被多个请求共享，复制为不关联 session 的对象
+    tables = [CoreTable(**table.model_dump()) for table in
+              session.query(CoreTable).options(defer(CoreTable.embedding)).filter(CoreTable.ds_id == ds.id).all()]
+    conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration))) if ds.type != "excel" else get_engine_config()
+    db_name = conf.dbSchema if conf.dbSchema is not None and conf.dbSchema != "" else conf.database
+
+    fields_dict: dict[int, List[CoreField]] = {}
+    table_ids = [table.id for table in tables]
+    if table_ids:
+        for field in session.query(CoreField).filter(
+                and_(CoreField.table_id.in_(table_ids), CoreField.checked == True)).all():
+            fields_dict.setdefault(field.table_id, []).append(CoreField(**field.model_dump()))
+
+    table_schemas = [TableSchema(table, fields_dict.get(table.id, []), render_table_header(ds, db_name, table))
+                     for table in tables]
+
+    relations = list(filter(lambda x: x.get('shape') == 'edge', ds.table_relation)) if ds.table_relation else []
+    table_names: dict[int, str] = {}
+    field_names: dict[int, str] = {}
+    if relations:
+        relation_table_ids = set()
+        relation_field_ids = set()
+        for r in relations:
+            relation_table_ids.add(int(r.get('source').get('cell')))
+            relation_table_ids.add(int(r.get('target').get('cell')))
+            relation_field_ids.add(int(r.get('source').get('port')))
+            relation_field_ids.add(int(r.get('target').get('port')))
+        for _id, name in session.query(CoreTable.id, CoreTable.table_name).filter(
+                CoreTable.id.in_(list(relation_table_ids))).all():
+            table_names[_id] = name
+        for _id, name in session.query(CoreField.id, CoreField.field_name).filter(
+                CoreField.id.in_(list(relation_field_ids))).all():
+            field_names[_id] = name
+
+    return DatasourceSchema(db_name, table_schemas, relations, table_names, field_names)
+
+
+_schema_lock = threading.Lock()
+_schema_cache: dict[int, DatasourceSchema] = {}
+_schema_version: dict[int, int] = {}
+
+
+def get_ds_schema(session: SessionDep, ds: CoreDatasource) -> DatasourceSchema:
+    """
+    按数据源缓存编译后的 schema，表/字段/表关系/数据源修改时调用 invalidate_ds_schema 失效
+    多进程部署时其他进程的缓存依赖 DS_SCHEMA_CACHE_TTL 过期
+    """
+    if ds.id is None:
+        return build_ds_schema(session, ds)
+
+    with _schema_lock:
+        ds_schema = _schema_cache.get(ds.id)
+        version = _schema_version.get(ds.id, 0)
+    if ds_schema is not None and (settings.DS_SCHEMA_CACHE_TTL <= 0
+                                  or time.monotonic() - ds_schema.create_time < settings.DS_SCHEMA_CACHE_TTL):
+        return ds_schema
+
+    ds_schema = build_ds_schema(session, ds)
+    with _schema_lock:
+        # 构建期间被失效过，结果可能已过期，不写入缓存
+        if _schema_version.get(ds.id, 0) == version:
+            _schema_cache[ds.id] = ds_schema
+    return ds_schema
+
+
+def invalidate_ds_schema(ds_id: Optional[int]):
+    if ds_id is None:
+        return
+    with _schema_lock:
+        _schema_version[ds_id] = _schema_version.get(ds_id, 0) + 1
+        _schema_cache.pop(ds_id, None)
+
+
+def get_ds_schema_version(ds_id: Optional[int]) -> int:
+    """
+    数据源表/字段/表关系每次变更后递增，依赖 schema 的其他缓存以此判断是否过期
+    """
+    with _schema_lock:
+        return _schema_version.get(ds_id, 0)
@@ -0,0 +1,73 @@
+import threading
+import time
+from typing import Optional
+
+# 同步完成后进度保留的时间（秒），供前端轮询最终状态
+SYNC_PROGRESS_KEEP_SECONDS = 600
+
+
+class SyncProgress:
+    """
+    数据源表/字段同步进度：stage 依次为 fields（读取字段）、tables（写入表）、save（写入字段）、finished/failed
+    """
+
+    def __init__(self, ds_id: int, total: int):
+        self.ds_id = ds_id
+        self.stage = 'fields'
+        self.total = total
+        self.done = 0
+        self.error: Optional[str] = None
+        self.start_time = time.time()
+        self.end_time: Optional[float] = None
+
+    def update(self, stage: Optional[str] = None, done: Optional[int] = None, total: Optional[int] = None):
+        with _progress_lock:
+            if stage is not None:
+                self.stage = stage
+            if total is not None:
+                self.total = total
+            if done is not None:
+                self.done = done
+
+    def advance(self, count: int = 1):
+        with _progress_lock:
+            self.done += count
+
+    def finish(self, error: Optional[str] = None):
+        with _progress_lock:
+            self.stage = 'failed' if error else 'finished'
+            self.error = error
+            self.end_time = time.time()
+
+    def to_dict(self) -> dict:
+        with _progress_lock:
+            return {
+                'ds_id': self.ds_id,
+                'stage': self.stage,
+                'total': self.total,
+                'done': self.done,
+                'error': self.error,
+                'start_time': int(self.start_time * 1000),
+                'end_time': int(self.end_time * 1000) if self.end_time else None,
+            }
+
+
+_progress_lock = threading.Lock()
+_progress_cache: dict[int, SyncProgress] = {}
+
+
+def start_sync_progress(ds_id: int, total: int) -> SyncProgress:
+    progress = SyncProgress(ds_id, total)
+    now = time.time()
+    with _progress_lock:
+        for key in [key for key, item in _progress_cache.items() if
+                    item.end_time and now - item.end_time > SYNC_PROGRESS_KEEP_SECONDS]:
+            _progress_cache.pop(key, None)
+        _progress_cache[ds_id] = progress
+    return progress
+
+
+def get_sync_progress(ds_id: int) -> Optional[dict]:
+    with _progress_lock:
+        progress = _progress_cache.get(ds_id)
+    return progress.to_dict() if progress is not None else None
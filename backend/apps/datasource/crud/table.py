@@ -1,14 +1,14 @@
-import json
-import time
 import traceback
 from typing import List
 
 from sqlalchemy import and_, select, update
 
-from apps.ai_model.embedding import EmbeddingModelCache
+from apps.ai_model.embedding import run_batch_embedding
+from apps.datasource.embedding.utils import invalidate_embedding_matrix
 from common.core.config import settings
 from common.core.deps import SessionDep
 from common.utils.utils import SQLBotLogUtil
+from common.utils.vector_index import ensure_embedding_index
 from ..models.datasource import CoreTable, CoreField, CoreDatasource
 
 
@@ -54,6 +54,42 @@ def run_fill_empty_table_and_ds_embedding(session_maker):
         session_maker.remove()
 
 
+def get_table_embedding_text(table, fields) -> str:
+    schema_table = ''
+    schema_table += f"# Table: {table.table_name}"
+    table_comment = ''
+    if table.custom_comment:
+        table_comment = table.custom_comment.strip()
+    if table_comment == '':
+        schema_table += '\n[\n'
+    else:
+        schema_table += f", {table_comment}\n[\n"
+
+    if fields:
+        field_list = []
+        for field in fields:
+            field_comment = ''
+            if field.custom_comment:
+                field_comment = field.custom_comment.strip()
+            if field_comment == '':
+                field_list.append(f"({field.field_name}:{field.field_type})")
+            else:
+                field_list.append(f"({field.field_name}:{field.field_type}, {field_comment})")
+        schema_table += ",\n".join(field_list)
+    schema_table += '\n]\n'
+    return schema_table
+
+
+def get_fields_dict_by_table_ids(session, table_ids: List[int]) -> dict:
+    fields = session.query(CoreField.table_id, CoreField.field_name, CoreField.field_type,
+                           CoreField.custom_comment).filter(CoreField.table_id.in_(table_ids)).order_by(
+        CoreField.table_id.asc(), CoreField.id.asc()).all()
+    fields_dict = {}
+    for field in fields:
+        fields_dict.setdefault(field.table_id, []).append(field)
+    return fields_dict
+
+
 def save_table_embedding(session_maker, ids: List[int]):
     if not settings.TABLE_EMBEDDING_ENABLED:
         return
@@ -61,45 +97,21 @@ def save_table_embedding(session_maker, ids: List[int]):
     if not ids or len(ids) == 0:
         return
     try:
-        SQLBotLogUtil.info('start table embedding')
-        start_time = time.time()
-        model = EmbeddingModelCache.get_model()
         session = session_maker()
-        for _id in ids:
-            table = session.query(CoreTable).filter(CoreTable.id == _id).first()
-            fields = session.query(CoreField).filter(CoreField.table_id == table.id).all()
-
-            schema_table = ''
-            schema_table += f"# Table: {table.table_name}"
-            table_comment = ''
-            if table.custom_comment:
-                table_comment = table.custom_comment.strip()
-            if table_comment == '':
-                schema_table += '\n[\n'
-            else:
-                schema_table += f", {table_comment}\n[\n"
-
-            if fields:
-                field_list = []
-                for field in fields:
-                    field_comment = ''
-                    if field.custom_comment:
-                        field_comment = field.custom_comment.strip()
-                    if field_comment == '':
-                        field_list.append(f"({field.field_name}:{field.field_type})")
-                    else:
-                        field_list.append(f"({field.field_name}:{field.field_type}, {field_comment})")
-                schema_table += ",\n".join(field_list)
-            schema_table += '\n]\n'
-            # table_schema.append(schema_table)
-            emb = json.dumps(model.embed_query(schema_table))
-
-            stmt = update(CoreTable).where(and_(CoreTable.id == _id)).values(embedding=emb)
-            session.execute(stmt)
+
+        def load_texts(batch_ids: List[int]):
+            tables = session.query(CoreTable.id, CoreTable.table_name, CoreTable.custom_comment).filter(
+                CoreTable.id.in_(batch_ids)).all()
+            fields_dict = get_fields_dict_by_table_ids(session, [table.id for table in tables])
+            return [(table.id, get_table_embedding_text(table, fields_dict.get(table.id))) for table in tables]
+
+        def save_embeddings(values: List[dict]):
+            session.execute(update(CoreTable), values)
             session.commit()
 
-        end_time = time.time()
-        SQLBotLogUtil.info('table embedding finished in: ' + str(end_time - start_time) + ' seconds')
+        dims = run_batch_embedding('table', list(ids), load_texts, save_embeddings, session)
+        for dim in dims:
+            ensure_embedding_index(session, CoreTable.__tablename__, dim)
     except Exception:
         traceback.print_exc()
     finally:
@@ -113,48 +125,33 @@ def save_ds_embedding(session_maker, ids: List[int]):
     if not ids or len(ids) == 0:
         return
     try:
-        SQLBotLogUtil.info('start datasource embedding')
-        start_time = time.time()
-        model = EmbeddingModelCache.get_model()
         session = session_maker()
-        for _id in ids:
-            schema_table = ''
-            ds = session.query(CoreDatasource).filter(CoreDatasource.id == _id).first()
-            schema_table += f"{ds.name}, {ds.description}\n"
-            tables = session.query(CoreTable).filter(CoreTable.ds_id == ds.id).all()
+
+        def load_texts(batch_ids: List[int]):
+            ds_list = session.query(CoreDatasource.id, CoreDatasource.name, CoreDatasource.description).filter(
+                CoreDatasource.id.in_(batch_ids)).all()
+            tables = session.query(CoreTable.id, CoreTable.ds_id, CoreTable.table_name,
+                                   CoreTable.custom_comment).filter(CoreTable.ds_id.in_(batch_ids)).order_by(
+                CoreTable.id.asc()).all()
+            fields_dict = get_fields_dict_by_table_ids(session, [table.id for table in tables])
+            tables_dict = {}
             for table in tables:
-                fields = session.query(CoreField).filter(CoreField.table_id == table.id).all()
-
-                schema_table += f"# Table: {table.table_name}"
-                table_comment = ''
-                if table.custom_comment:
-                    table_comment = table.custom_comment.strip()
-                if table_comment == '':
-                    schema_table += '\n[\n'
-                else:
-                    schema_table += f", {table_comment}\n[\n"
-
-                if fields:
-                    field_list = []
-                    for field in fields:
-                        field_comment = ''
-                        if field.custom_comment:
-                            field_comment = field.custom_comment.strip()
-                        if field_comment == '':
-                            field_list.append(f"({field.field_name}:{field.field_type})")
-                        else:
-                            field_list.append(f"({field.field_name}:{field.field_type}, {field_comment})")
-                    schema_table += ",\n".join(field_list)
-                schema_table += '\n]\n'
-            # table_schema.append(schema_table)
-            emb = json.dumps(model.embed_query(schema_table))
-
-            stmt = update(CoreDatasource).where(and_(CoreDatasource.id == _id)).values(embedding=emb)
-            session.execute(stmt)
+                tables_dict.setdefault(table.ds_id, []).append(table)
+
+            items = []
+            for ds in ds_list:
+                schema_table = f"{ds.name}, {ds.description}\n"
+                for table in tables_dict.get(ds.id, []):
+                    schema_table += get_table_embedding_text(table, fields_dict.get(table.id))
+                items.append((ds.id, schema_table))
+            return items
+
+        def save_embeddings(values: List[dict]):
+            session.execute(update(CoreDatasource), values)
             session.commit()
 
-        end_time = time.time()
-        SQLBotLogUtil.info('datasource embedding finished in: ' + str(end_time - start_time) + ' seconds')
+        run_batch_embedding('datasource', list(ids), load_texts, save_embeddings, session)
+        invalidate_embedding_matrix('ds')
     except Exception:
         traceback.print_exc()
     finally:
@@ -5,8 +5,10 @@ import time
 import traceback
 from typing import Optional
 
-from apps.ai_model.embedding import EmbeddingModelCache
-from apps.datasource.embedding.utils import cosine_similarity
+from sqlmodel import select
+
+from apps.ai_model.embedding import EmbeddingModelCache, EmbeddingQueryCache
+from apps.datasource.embedding.utils import cosine_similarity, get_embedding_matrix
 from apps.datasource.models.datasource import CoreDatasource
 from apps.system.crud.assistant import AssistantOutDs
 from common.core.config import settings
@@ -35,7 +37,7 @@ def get_ds_embedding(session: SessionDep, current_user: CurrentUser, _ds_list, o
                 model = EmbeddingModelCache.get_model()
                 results = model.embed_documents(text)
 
-                q_embedding = model.embed_query(question)
+                q_embedding = EmbeddingQueryCache.embed_query(question)
                 for index in range(len(results)):
                     item = results[index]
                     _list[index]['cosine_similarity'] = cosine_similarity(q_embedding, item)
@@ -52,40 +54,29 @@ def get_ds_embedding(session: SessionDep, current_user: CurrentUser, _ds_list, o
             except Exception:
                 traceback.print_exc()
     else:
-        for _ds in _ds_list:
-            if _ds.get('id'):
-                ds = session.get(CoreDatasource, _ds.get('id'))
-                # table_schema = get_table_schema(session, current_user, ds, question, embedding=False)
-                # ds_info = f"{ds.name}, {ds.description}\n"
-                # ds_schema = ds_info + table_schema
-                _list.append({"id": ds.id, "cosine_similarity": 0.0, "ds": ds, "embedding": ds.embedding})
+        _list = [_ds for _ds in _ds_list if _ds.get('id')]
 
         if _list:
             try:
-                # text = [s.get('ds_schema') for s in _list]
-
-                model = EmbeddingModelCache.get_model()
                 start_time = time.time()
-                # results = model.embed_documents(text)
-                results = [item.get('embedding') for item in _list]
 
-                q_embedding = model.embed_query(question)
-                for index in range(len(results)):
-                    item = results[index]
-                    if item:
-                        _list[index]['cosine_similarity'] = cosine_similarity(q_embedding, json.loads(item))
+                ids = [_ds.get('id') for _ds in _list]
 
-                _list.sort(key=lambda x: x['cosine_similarity'], reverse=True)
-                # print(len(_list))
+                def load_embeddings():
+                    stmt = select(CoreDatasource.id, CoreDatasource.embedding).where(CoreDatasource.id.in_(ids))
+                    return [(row.id, row.embedding) for row in session.exec(stmt)]
+
+                matrix = get_embedding_matrix(('ds', current_user.oid), ids, load_embeddings)
+                q_embedding = EmbeddingQueryCache.embed_query(question)
+                ds_dict = {_ds.get('id'): _ds for _ds in _list}
+                top_list = matrix.top_k(q_embedding, ids, settings.DS_EMBEDDING_COUNT)
                 end_time = time.time()
                 SQLBotLogUtil.info(str(end_time - start_time))
-                _list = _list[:settings.DS_EMBEDDING_COUNT]
                 SQLBotLogUtil.info(json.dumps(
-                    [{"id": ele.get("id"), "name": ele.get("ds").name,
-                      "cosine_similarity": ele.get("cosine_similarity")}
-                     for ele in _list]))
-                return [{"id": obj.get('ds').id, "name": obj.get('ds').name, "description": obj.get('ds').description}
-                        for obj in _list]
+                    [{"id": _id, "name": ds_dict[_id].get("name"), "cosine_similarity": score}
+                     for _id, score in top_list]))
+                return [{"id": _id, "name": ds_dict[_id].get("name"), "description": ds_dict[_id].get("description")}
+                        for _id, _ in top_list]
             except Exception:
                 traceback.print_exc()
     return _list
@@ -4,9 +4,14 @@ import json
 import time
 import traceback
 
-from apps.ai_model.embedding import EmbeddingModelCache
+from pgvector.sqlalchemy import VECTOR
+from sqlalchemy import text, bindparam
+from sqlalchemy.orm import Session
+
+from apps.ai_model.embedding import EmbeddingModelCache, EmbeddingQueryCache
 from apps.datasource.embedding.utils import cosine_similarity
 from common.core.config import settings
+from common.utils.vector_index import embedding_distance, embedding_dimension_filter
 from common.utils.utils import SQLBotLogUtil
 
 
@@ -25,7 +30,7 @@ def get_table_embedding(tables: list[dict], question: str):
             end_time = time.time()
             SQLBotLogUtil.info(str(end_time - start_time))
 
-            q_embedding = model.embed_query(question)
+            q_embedding = EmbeddingQueryCache.embed_query(question)
             for index in range(len(results)):
                 item = results[index]
                 _list[index]['cosine_similarity'] = cosine_similarity(q_embedding, item)
@@ -40,38 +45,46 @@ def get_table_embedding(tables: list[dict], question: str):
     return _list
 
 
-def calc_table_embedding(tables: list[dict], question: str):
+def calc_table_embedding(session: Session, tables: list[dict], question: str, ds_id: int):
     _list = []
     for table in tables:
-        _list.append(
-            {"id": table.get('id'), "schema_table": table.get('schema_table'), "embedding": table.get('embedding'),
-             "cosine_similarity": 0.0})
+        _list.append({"id": table.get('id'), "schema_table": table.get('schema_table'), "cosine_similarity": 0.0})
 
     if _list:
         try:
-            # text = [s.get('schema_table') for s in _list]
-            #
-            model = EmbeddingModelCache.get_model()
             start_time = time.time()
-            # results = model.embed_documents(text)
-            # end_time = time.time()
-            # SQLBotLogUtil.info(str(end_time - start_time))
-            results = [item.get('embedding') for item in _list]
 
-            q_embedding = model.embed_query(question)
-            for index in range(len(results)):
-                item = results[index]
-                if item:
-                    _list[index]['cosine_similarity'] = cosine_similarity(q_embedding, json.loads(item))
+            q_embedding = EmbeddingQueryCache.embed_query(question)
+            dim = len(q_embedding)
+            # 在数据库中按向量距离取 top k，命中 core_table 上对应维度的 hnsw 索引
+            stmt = text(f"""
+                SELECT id, 1 - {embedding_distance(dim)} AS similarity
+                FROM core_table
+                WHERE ds_id = :ds_id AND id IN :ids
+                  AND embedding IS NOT NULL AND {embedding_dimension_filter(dim)}
+                ORDER BY {embedding_distance(dim)}
+                LIMIT :limit
+            """).bindparams(bindparam('ids', expanding=True), bindparam('embedding_array', type_=VECTOR(dim)))
+            with session.begin_nested():
+                results = session.execute(stmt, {'ds_id': ds_id, 'ids': [item.get('id') for item in _list],
+                                                 'embedding_array': q_embedding,
+                                                 'limit': settings.TABLE_EMBEDDING_COUNT}).fetchall()
 
-            _list.sort(key=lambda x: x['cosine_similarity'], reverse=True)
-            _list = _list[:settings.TABLE_EMBEDDING_COUNT]
-            # print(len(_list))
+            item_dict = {item.get('id'): item for item in _list}
+            top_list = []
+            for row in results:
+                item = item_dict[row.id]
+                item['cosine_similarity'] = float(row.similarity)
+                top_list.append(item)
+            # 没有 embedding 的表相似度按 0 处理，按原顺序补足
+            if len(top_list) < settings.TABLE_EMBEDDING_COUNT:
+                top_ids = set(item.get('id') for item in top_list)
+                top_list.extend([item for item in _list if item.get('id') not in top_ids][
+                                :settings.TABLE_EMBEDDING_COUNT - len(top_list)])
+            _list = top_list
             end_time = time.time()
             SQLBotLogUtil.info(str(end_time - start_time))
-            SQLBotLogUtil.info(json.dumps([{"id": ele.get('id'), "schema_table": ele.get('schema_table'),
-                                            "cosine_similarity": ele.get('cosine_similarity')}
-                                           for ele in _list]))
+            SQLBotLogUtil.info(json.dumps(_list))
             return _list
         except Exception:
             traceback.print_exc()
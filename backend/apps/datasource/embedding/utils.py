@@ -1,6 +1,14 @@
 # Author: Junjun
 # Date: 2025/9/23
+import json
 import math
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+
+from common.core.config import settings
 
 
 def cosine_similarity(vec_a, vec_b):
@@ -16,3 +24,109 @@ def cosine_similarity(vec_a, vec_b):
         return 0.0
 
     return dot_product / (norm_a * norm_b)
+
+
+class EmbeddingMatrix:
+    """
+    一组 embedding 归一化后组成的 float32 矩阵，行号与 id 一一对应
+    没有 embedding 或维度不一致的行置为 0 向量，相似度为 0
+    """
+
+    def __init__(self, items: Iterable[tuple[int, object]]):
+        ids = []
+        vectors = []
+        dim = 0
+        for _id, embedding in items:
+            vector = to_vector(embedding)
+            if vector is not None and dim == 0:
+                dim = vector.shape[0]
+            ids.append(_id)
+            vectors.append(vector)
+
+        self.index: dict[int, int] = {_id: i for i, _id in enumerate(ids)}
+        self.matrix = np.zeros((len(ids), dim), dtype=np.float32)
+        for i, vector in enumerate(vectors):
+            if vector is not None and vector.shape[0] == dim:
+                self.matrix[i] = vector
+        norms = np.linalg.norm(self.matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self.matrix /= norms
+        self.create_time = time.monotonic()
+
+    def covers(self, ids: Iterable[int]) -> bool:
+        return all(_id in self.index for _id in ids)
+
+    def top_k(self, q_embedding, ids: list[int], k: int) -> list[tuple[int, float]]:
+        if not ids:
+            return []
+        q = to_vector(q_embedding)
+        if q is None or self.matrix.shape[1] == 0 or q.shape[0] != self.matrix.shape[1]:
+            scores = np.zeros(len(ids), dtype=np.float32)
+        else:
+            q_norm = np.linalg.norm(q)
+            if q_norm != 0:
+                q = q / q_norm
+            rows = np.fromiter((self.index[_id] for _id in ids), dtype=np.int64, count=len(ids))
+            scores = (self.matrix @ q)[rows]
+
+        k = min(k, len(ids))
+        if k <= 0:
+            return []
+        if k < len(ids):
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(ids))
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(ids[i], float(scores[i])) for i in top]
+
+
+def to_vector(embedding) -> Optional[np.ndarray]:
+    if embedding is None:
+        return None
+    if isinstance(embedding, str):
+        if embedding == '':
+            return None
+        embedding = json.loads(embedding)
+    vector = np.asarray(embedding, dtype=np.float32)
+    if vector.ndim != 1 or vector.shape[0] == 0:
+        return None
+    return vector
+
+
+_matrix_lock = threading.Lock()
+_matrix_cache: dict[tuple, EmbeddingMatrix] = {}
+
+
+def get_embedding_matrix(key: Optional[tuple], ids: list[int],
+                         loader: Callable[[], Iterable[tuple[int, object]]]) -> EmbeddingMatrix:
+    """
+    按 key 缓存 embedding 矩阵，缓存中缺少请求的 id 或超过 TTL 时调用 loader 重建
+    key 为空时不缓存
+    """
+    if key is None:
+        return EmbeddingMatrix(loader())
+
+    with _matrix_lock:
+        matrix = _matrix_cache.get(key)
+    if matrix is not None and matrix.covers(ids) and (
+            settings.EMBEDDING_MATRIX_CACHE_TTL <= 0
+            or time.monotonic() - matrix.create_time < settings.EMBEDDING_MATRIX_CACHE_TTL):
+        return matrix
+
+    matrix = EmbeddingMatrix(loader())
+    with _matrix_lock:
+        _matrix_cache[key] = matrix
+    return matrix
+
+
+def invalidate_embedding_matrix(kind: str, ids: Optional[Iterable[int]] = None):
+    """
+    key 形如 (kind, id)，如 ('ds', oid)；ids 为空时失效该类全部缓存
+    """
+    with _matrix_lock:
+        if ids is None:
+            keys = [key for key in _matrix_cache.keys() if key[0] == kind]
+        else:
+            keys = [(kind, _id) for _id in ids]
+        for key in keys:
+            _matrix_cache.pop(key, None)
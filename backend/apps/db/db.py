@@ -1,23 +1,32 @@
 import base64
+import hashlib
+import itertools
 import json
 import os
 import platform
+import threading
 import urllib.parse
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
 from decimal import Decimal
-from typing import Optional
+from typing import Callable, Iterator, Optional
 
 import oracledb
 import psycopg2
 import pymssql
 
-from apps.db.db_sql import get_table_sql, get_field_sql, get_version_sql
-from common.error import ParseSQLResultError
+from apps.db.db_sql import get_table_sql, get_field_sql, get_version_sql, get_all_fields_sql
+from apps.db.driver_pool import DriverConnectionPool, default_ping, close_quietly
+from common.error import ParseSQLResultError, SQLBotDBConnectionError
 
 if platform.system() != "Darwin":
     import dmPython
 import pymysql
 import redshift_connector
-from sqlalchemy import create_engine, text, Engine
+from elasticsearch import Elasticsearch
+from sqlalchemy import create_engine, text, Engine, event
 from sqlalchemy.orm import sessionmaker
 
 from apps.datasource.models.datasource import DatasourceConf, CoreDatasource, TableSchema, ColumnSchema
@@ -110,41 +119,265 @@ def get_origin_connect(type: str, conf: DatasourceConf):
             user=conf.username,
             password=conf.password,
             database=conf.database,
-            timeout=conf.timeout,
+            timeout=get_connect_timeout(conf),
             tds_version='7.0',  # options: '4.2', '7.0', '8.0' ...,
             **extra_config_dict
         )
 
 
+# 单次连接的超时时间（如连接测试），不影响共享 engine/连接池的配置
+_connect_timeout: ContextVar[int] = ContextVar('ds_connect_timeout', default=0)
+
+
+@contextmanager
+def ds_connect_timeout(timeout: int):
+    token = _connect_timeout.set(timeout)
+    try:
+        yield
+    finally:
+        _connect_timeout.reset(token)
+
+
+def get_connect_timeout(conf: DatasourceConf) -> int:
+    return _connect_timeout.get() or conf.timeout
+
+
+def _apply_connect_timeout(dialect, conn_rec, cargs, cparams):
+    timeout = _connect_timeout.get()
+    if timeout and 'connect_timeout' in cparams:
+        cparams['connect_timeout'] = timeout
+
+
+# catalog 查询中 TABLE_NAME IN (...) 每批的表名个数，避免超出数据库的参数个数上限
+CATALOG_TABLE_BATCH_SIZE = 500
+
+# 所有 Excel 数据源共用的连接池 key
+EXCEL_ENGINE_KEY = 'excel'
+
 # use sqlalchemy
-def get_engine(ds: CoreDatasource, timeout: int = 0) -> Engine:
+_engine_lock = threading.Lock()
+_engine_cache: OrderedDict[tuple, Engine] = OrderedDict()
+_driver_pool_cache: OrderedDict[tuple, DriverConnectionPool] = OrderedDict()
+_es_client_cache: OrderedDict[tuple, Elasticsearch] = OrderedDict()
+
+
+def get_ds_conf(ds: CoreDatasource | AssistantOutDsSchema, timeout: int = 0) -> DatasourceConf:
     conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration))) if not equals_ignore_case(ds.type,
                                                                                                  "excel") else get_engine_config()
     if conf.timeout is None:
         conf.timeout = timeout
     if timeout > 0:
         conf.timeout = timeout
+    return conf
+
+
+def get_engine_key(ds: CoreDatasource | AssistantOutDsSchema, conf: DatasourceConf) -> tuple:
+    # timeout 不参与 key，不同超时的调用共用同一个连接池，单次连接的超时通过 ds_connect_timeout 指定
+    conf_dict = conf.to_dict()
+    conf_dict.pop('timeout', None)
+    conf_str = json.dumps(conf_dict, sort_keys=True, ensure_ascii=False, default=str)
+    digest = hashlib.sha256(f'{ds.type}:{conf_str}'.encode('utf-8')).hexdigest()
+    if equals_ignore_case(ds.type, "excel"):
+        # Excel 数据源都连接 SQLBot 自身的数据库，按配置共用一个连接池，删除单个 Excel 数据源时不释放
+        return EXCEL_ENGINE_KEY, digest
+    return ds.id, digest
+
+
+def create_ds_engine(ds: CoreDatasource | AssistantOutDsSchema, conf: DatasourceConf) -> Engine:
+    pool_args = {"pool_timeout": settings.DS_POOL_TIMEOUT,
+                 "pool_size": settings.DS_POOL_SIZE,
+                 "max_overflow": settings.DS_MAX_OVERFLOW,
+                 "pool_recycle": settings.DS_POOL_RECYCLE,
+                 "pool_pre_ping": settings.DS_POOL_PRE_PING}
     if equals_ignore_case(ds.type, "pg"):
         if conf.dbSchema is not None and conf.dbSchema != "":
-            engine = create_engine(get_uri(ds),
+            engine = create_engine(get_uri_from_config(ds.type, conf),
                                    connect_args={"options": f"-c search_path={urllib.parse.quote(conf.dbSchema)}",
                                                  "connect_timeout": conf.timeout},
-                                   pool_timeout=conf.timeout)
+                                   **pool_args)
         else:
-            engine = create_engine(get_uri(ds),
+            engine = create_engine(get_uri_from_config(ds.type, conf),
                                    connect_args={"connect_timeout": conf.timeout},
-                                   pool_timeout=conf.timeout)
+                                   **pool_args)
     elif equals_ignore_case(ds.type, 'sqlServer'):
         engine = create_engine('mssql+pymssql://', creator=lambda: get_origin_connect(ds.type, conf),
-                               pool_timeout=conf.timeout)
+                               **pool_args)
     elif equals_ignore_case(ds.type, 'oracle'):
-        engine = create_engine(get_uri(ds),
-                               pool_timeout=conf.timeout)
+        engine = create_engine(get_uri_from_config(ds.type, conf),
+                               **pool_args)
     else:  # mysql, ck
-        engine = create_engine(get_uri(ds), connect_args={"connect_timeout": conf.timeout}, pool_timeout=conf.timeout)
+        engine = create_engine(get_uri_from_config(ds.type, conf), connect_args={"connect_timeout": conf.timeout},
+                               **pool_args)
+    event.listen(engine, 'do_connect', _apply_connect_timeout)
+    return engine
+
+
+def get_engine(ds: CoreDatasource | AssistantOutDsSchema, timeout: int = 0) -> Engine:
+    # 未保存的数据源（如新建时的连接测试）不缓存，由调用方负责释放
+    if ds.id is None or settings.DS_ENGINE_CACHE_SIZE <= 0:
+        return create_ds_engine(ds, get_ds_conf(ds, timeout))
+
+    # 共享的 engine 使用数据源保存的超时配置，timeout 需由调用方通过 ds_connect_timeout 作用于单次连接
+    conf = get_ds_conf(ds)
+
+    key = get_engine_key(ds, conf)
+    with _engine_lock:
+        engine = _engine_cache.get(key)
+        if engine is not None:
+            _engine_cache.move_to_end(key)
+            return engine
+
+    engine = create_ds_engine(ds, conf)
+    evicted: list[Engine] = []
+    with _engine_lock:
+        cached = _engine_cache.get(key)
+        if cached is not None:
+            # another thread created it first
+            evicted.append(engine)
+            engine = cached
+            _engine_cache.move_to_end(key)
+        else:
+            _engine_cache[key] = engine
+            while len(_engine_cache) > settings.DS_ENGINE_CACHE_SIZE:
+                _, old_engine = _engine_cache.popitem(last=False)
+                evicted.append(old_engine)
+    for old_engine in evicted:
+        old_engine.dispose()
     return engine
 
 
+def dispose_ds_engine(ds_id: int):
+    with _engine_lock:
+        keys = [key for key in _engine_cache.keys() if key[0] == ds_id]
+        engines = [_engine_cache.pop(key) for key in keys]
+        keys = [key for key in _driver_pool_cache.keys() if key[0] == ds_id]
+        pools = [_driver_pool_cache.pop(key) for key in keys]
+        keys = [key for key in _es_client_cache.keys() if key[0] == ds_id]
+        es_clients = [_es_client_cache.pop(key) for key in keys]
+    for engine in engines:
+        engine.dispose()
+    for pool in pools:
+        pool.close()
+    for es_client in es_clients:
+        close_quietly(es_client)
+    if engines or pools or es_clients:
+        SQLBotLogUtil.info(
+            f"Datasource {ds_id} engine disposed, count: {len(engines) + len(pools) + len(es_clients)}")
+
+
+def get_engine_pool_status() -> list[dict]:
+    with _engine_lock:
+        items = list(_engine_cache.items())
+        driver_items = list(_driver_pool_cache.items())
+    status_list = []
+    for (ds_id, _), engine in items:
+        pool = engine.pool
+        status_list.append({
+            "ds_id": ds_id,
+            "dialect": engine.dialect.name,
+            "size": pool.size() if hasattr(pool, 'size') else None,
+            "checked_in": pool.checkedin() if hasattr(pool, 'checkedin') else None,
+            "checked_out": pool.checkedout() if hasattr(pool, 'checkedout') else None,
+            "overflow": pool.overflow() if hasattr(pool, 'overflow') else None,
+            "status": pool.status(),
+        })
+    for (ds_id, _), pool in driver_items:
+        status_list.append({"ds_id": ds_id, "dialect": "py_driver", **pool.status()})
+    return status_list
+
+
+# use py_driver
+def create_driver_connect(ds_type: str, conf: DatasourceConf):
+    extra_config_dict = get_extra_config(conf)
+    if equals_ignore_case(ds_type, 'dm'):
+        return dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
+                                port=conf.port, **extra_config_dict)
+    elif equals_ignore_case(ds_type, 'doris', 'starrocks'):
+        return pymysql.connect(user=conf.username, passwd=conf.password, host=conf.host,
+                               port=conf.port, db=conf.database, connect_timeout=get_connect_timeout(conf),
+                               read_timeout=conf.timeout, **extra_config_dict)
+    elif equals_ignore_case(ds_type, 'redshift'):
+        return redshift_connector.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
+                                          password=conf.password,
+                                          timeout=get_connect_timeout(conf), **extra_config_dict)
+    elif equals_ignore_case(ds_type, 'kingbase'):
+        return psycopg2.connect(**{"host": conf.host, "port": conf.port, "database": conf.database,
+                                   "user": conf.username, "password": conf.password,
+                                   "connect_timeout": get_connect_timeout(conf),
+                                   "options": f"-c statement_timeout={conf.timeout * 1000}",
+                                   **extra_config_dict})
+    raise SQLBotDBConnectionError(f'The datasource type {ds_type} does not support driver connection.')
+
+
+def get_driver_pool(ds: CoreDatasource | AssistantOutDsSchema, conf: DatasourceConf) -> DriverConnectionPool:
+    key = get_engine_key(ds, conf)
+    with _engine_lock:
+        pool = _driver_pool_cache.get(key)
+        if pool is not None:
+            _driver_pool_cache.move_to_end(key)
+            return pool
+        ds_type = ds.type
+        # 连接池可能由连接测试等临时指定了超时的调用创建，池中的连接使用数据源保存的超时配置
+        pool_conf = get_ds_conf(ds)
+        pool = DriverConnectionPool(lambda: create_driver_connect(ds_type, pool_conf),
+                                    max_size=settings.DS_POOL_SIZE + settings.DS_MAX_OVERFLOW,
+                                    max_idle=settings.DS_DRIVER_POOL_MAX_IDLE,
+                                    max_lifetime=settings.DS_POOL_RECYCLE,
+                                    timeout=settings.DS_POOL_TIMEOUT,
+                                    ping=default_ping if settings.DS_POOL_PRE_PING else None)
+        _driver_pool_cache[key] = pool
+        evicted = []
+        while len(_driver_pool_cache) > settings.DS_ENGINE_CACHE_SIZE:
+            _, old_pool = _driver_pool_cache.popitem(last=False)
+            evicted.append(old_pool)
+    for old_pool in evicted:
+        old_pool.close()
+    return pool
+
+
+@contextmanager
+def driver_connection(ds: CoreDatasource | AssistantOutDsSchema, conf: DatasourceConf):
+    if ds.id is None or settings.DS_ENGINE_CACHE_SIZE <= 0:
+        conn = create_driver_connect(ds.type, conf)
+        try:
+            yield conn
+        finally:
+            close_quietly(conn)
+    else:
+        with get_driver_pool(ds, conf).connection() as conn:
+            yield conn
+
+
+def get_es_client(ds: CoreDatasource | AssistantOutDsSchema, conf: DatasourceConf) -> Elasticsearch:
+    key = get_engine_key(ds, conf)
+    with _engine_lock:
+        es_client = _es_client_cache.get(key)
+        if es_client is not None:
+            _es_client_cache.move_to_end(key)
+            return es_client
+        es_client = get_es_connect(conf)
+        _es_client_cache[key] = es_client
+        evicted = []
+        while len(_es_client_cache) > settings.DS_ENGINE_CACHE_SIZE:
+            _, old_client = _es_client_cache.popitem(last=False)
+            evicted.append(old_client)
+    for old_client in evicted:
+        close_quietly(old_client)
+    return es_client
+
+
+@contextmanager
+def es_connection(ds: CoreDatasource | AssistantOutDsSchema, conf: DatasourceConf):
+    if ds.id is None or settings.DS_ENGINE_CACHE_SIZE <= 0:
+        es_client = get_es_connect(conf)
+        try:
+            yield es_client
+        finally:
+            close_quietly(es_client)
+    else:
+        yield get_es_client(ds, conf)
+
+
 def get_session(ds: CoreDatasource | AssistantOutDsSchema):
     # engine = get_engine(ds) if isinstance(ds, CoreDatasource) else get_ds_engine(ds)
     if isinstance(ds, AssistantOutDsSchema):
@@ -158,6 +391,12 @@ def get_session(ds: CoreDatasource | AssistantOutDsSchema):
 
 
 def check_connection(trans: Optional[Trans], ds: CoreDatasource | AssistantOutDsSchema, is_raise: bool = False):
+    # 连接测试只等待 10 秒，不修改共享连接池的配置
+    with ds_connect_timeout(10):
+        return _check_connection(trans, ds, is_raise)
+
+
+def _check_connection(trans: Optional[Trans], ds: CoreDatasource | AssistantOutDsSchema, is_raise: bool = False):
     if isinstance(ds, AssistantOutDsSchema):
         out_conf = get_out_ds_conf(ds, 10)
         ds.configuration = out_conf
@@ -174,12 +413,13 @@ def check_connection(trans: Optional[Trans], ds: CoreDatasource | AssistantOutDs
             if is_raise:
                 raise HTTPException(status_code=500, detail=trans('i18n_ds_invalid') + f': {e.args}')
             return False
+        finally:
+            if ds.id is None:
+                conn.dispose()
     else:
-        conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration)))
-        extra_config_dict = get_extra_config(conf)
+        conf = get_ds_conf(ds, 10)
         if equals_ignore_case(ds.type, 'dm'):
-            with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                  port=conf.port, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with driver_connection(ds, conf) as conn, conn.cursor() as cursor:
                 try:
                     cursor.execute('select 1', timeout=10).fetchall()
                     SQLBotLogUtil.info("success")
@@ -190,9 +430,7 @@ def check_connection(trans: Optional[Trans], ds: CoreDatasource | AssistantOutDs
                         raise HTTPException(status_code=500, detail=trans('i18n_ds_invalid') + f': {e.args}')
                     return False
         elif equals_ignore_case(ds.type, 'doris', 'starrocks'):
-            with pymysql.connect(user=conf.username, passwd=conf.password, host=conf.host,
-                                 port=conf.port, db=conf.database, connect_timeout=10,
-                                 read_timeout=10, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with driver_connection(ds, conf) as conn, conn.cursor() as cursor:
                 try:
                     cursor.execute('select 1')
                     SQLBotLogUtil.info("success")
@@ -203,10 +441,7 @@ def check_connection(trans: Optional[Trans], ds: CoreDatasource | AssistantOutDs
                         raise HTTPException(status_code=500, detail=trans('i18n_ds_invalid') + f': {e.args}')
                     return False
         elif equals_ignore_case(ds.type, 'redshift'):
-            with redshift_connector.connect(host=conf.host, port=conf.port, database=conf.database,
-                                            user=conf.username,
-                                            password=conf.password,
-                                            timeout=10, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with driver_connection(ds, conf) as conn, conn.cursor() as cursor:
                 try:
                     cursor.execute('select 1')
                     SQLBotLogUtil.info("success")
@@ -217,10 +452,7 @@ def check_connection(trans: Optional[Trans], ds: CoreDatasource | AssistantOutDs
                         raise HTTPException(status_code=500, detail=trans('i18n_ds_invalid') + f': {e.args}')
                     return False
         elif equals_ignore_case(ds.type, 'kingbase'):
-            with psycopg2.connect(host=conf.host, port=conf.port, database=conf.database,
-                                  user=conf.username,
-                                  password=conf.password,
-                                  connect_timeout=10, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with driver_connection(ds, conf) as conn, conn.cursor() as cursor:
                 try:
                     cursor.execute('select 1')
                     SQLBotLogUtil.info("success")
@@ -231,13 +463,13 @@ def check_connection(trans: Optional[Trans], ds: CoreDatasource | AssistantOutDs
                         raise HTTPException(status_code=500, detail=trans('i18n_ds_invalid') + f': {e.args}')
                     return False
         elif equals_ignore_case(ds.type, 'es'):
-            es_conn = get_es_connect(conf)
-            if es_conn.ping():
-                SQLBotLogUtil.info("success")
-                return True
-            else:
-                SQLBotLogUtil.info("failed")
-                return False
+            with es_connection(ds, conf) as es_conn:
+                if es_conn.ping():
+                    SQLBotLogUtil.info("success")
+                    return True
+                else:
+                    SQLBotLogUtil.info("failed")
+                    return False
     # else:
     #     conn = get_ds_engine(ds)
     #     try:
@@ -253,7 +485,7 @@ def check_connection(trans: Optional[Trans], ds: CoreDatasource | AssistantOutDs
     return False
 
 
-def get_version(ds: CoreDatasource | AssistantOutDsSchema):
+def get_version(ds: CoreDatasource | AssistantOutDsSchema, raise_error: bool = False):
     version = ''
     if isinstance(ds, CoreDatasource):
         conf = DatasourceConf(
@@ -279,23 +511,21 @@ def get_version(ds: CoreDatasource | AssistantOutDsSchema):
                     res = result.fetchall()
                     version = res[0][0]
         else:
-            extra_config_dict = get_extra_config(conf)
             if equals_ignore_case(ds.type, 'dm'):
-                with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                      port=conf.port) as conn, conn.cursor() as cursor:
-                    cursor.execute(sql, timeout=10, **extra_config_dict)
+                with driver_connection(ds, conf) as conn, conn.cursor() as cursor:
+                    cursor.execute(sql, timeout=10)
                     res = cursor.fetchall()
                     version = res[0][0]
             elif equals_ignore_case(ds.type, 'doris', 'starrocks'):
-                with pymysql.connect(user=conf.username, passwd=conf.password, host=conf.host,
-                                     port=conf.port, db=conf.database, connect_timeout=10,
-                                     read_timeout=10, **extra_config_dict) as conn, conn.cursor() as cursor:
+                with driver_connection(ds, conf) as conn, conn.cursor() as cursor:
                     cursor.execute(sql)
                     res = cursor.fetchall()
                     version = res[0][0]
             elif equals_ignore_case(ds.type, 'redshift', 'es'):
                 version = ''
     except Exception as e:
+        if raise_error:
+            raise
         print(e)
         version = ''
     return version.decode() if isinstance(version, bytes) else version
@@ -318,27 +548,20 @@ def get_schema(ds: CoreDatasource):
                 res_list = [item[0] for item in res]
                 return res_list
     else:
-        extra_config_dict = get_extra_config(conf)
         if equals_ignore_case(ds.type, 'dm'):
-            with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                  port=conf.port, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with driver_connection(ds, conf) as conn, conn.cursor() as cursor:
                 cursor.execute("""select OBJECT_NAME from dba_objects where object_type='SCH'""", timeout=conf.timeout)
                 res = cursor.fetchall()
                 res_list = [item[0] for item in res]
                 return res_list
         elif equals_ignore_case(ds.type, 'redshift'):
-            with redshift_connector.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                            password=conf.password,
-                                            timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with driver_connection(ds, conf) as conn, conn.cursor() as cursor:
                 cursor.execute("""SELECT nspname FROM pg_namespace""")
                 res = cursor.fetchall()
                 res_list = [item[0] for item in res]
                 return res_list
         elif equals_ignore_case(ds.type, 'kingbase'):
-            with psycopg2.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                  password=conf.password,
-                                  options=f"-c statement_timeout={conf.timeout * 1000}",
-                                  **extra_config_dict) as conn, conn.cursor() as cursor:
+            with driver_connection(ds, conf) as conn, conn.cursor() as cursor:
                 cursor.execute("""SELECT nspname FROM pg_namespace""")
                 res = cursor.fetchall()
                 res_list = [item[0] for item in res]
@@ -357,42 +580,34 @@ def get_tables(ds: CoreDatasource):
                 res_list = [TableSchema(*item) for item in res]
                 return res_list
     else:
-        extra_config_dict = get_extra_config(conf)
         if equals_ignore_case(ds.type, 'dm'):
-            with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                  port=conf.port, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with driver_connection(ds, conf) as conn, conn.cursor() as cursor:
                 cursor.execute(sql, {"param": sql_param}, timeout=conf.timeout)
                 res = cursor.fetchall()
                 res_list = [TableSchema(*item) for item in res]
                 return res_list
         elif equals_ignore_case(ds.type, 'doris', 'starrocks'):
-            with pymysql.connect(user=conf.username, passwd=conf.password, host=conf.host,
-                                 port=conf.port, db=conf.database, connect_timeout=conf.timeout,
-                                 read_timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with driver_connection(ds, conf) as conn, conn.cursor() as cursor:
                 cursor.execute(sql, (sql_param,))
                 res = cursor.fetchall()
                 res_list = [TableSchema(*item) for item in res]
                 return res_list
         elif equals_ignore_case(ds.type, 'redshift'):
-            with redshift_connector.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                            password=conf.password,
-                                            timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with driver_connection(ds, conf) as conn, conn.cursor() as cursor:
                 cursor.execute(sql, (sql_param,))
                 res = cursor.fetchall()
                 res_list = [TableSchema(*item) for item in res]
                 return res_list
         elif equals_ignore_case(ds.type, 'kingbase'):
-            with psycopg2.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                  password=conf.password,
-                                  options=f"-c statement_timeout={conf.timeout * 1000}",
-                                  **extra_config_dict) as conn, conn.cursor() as cursor:
+            with driver_connection(ds, conf) as conn, conn.cursor() as cursor:
                 # Use parameterized query for security
                 cursor.execute(sql, (sql_param,))
                 res = cursor.fetchall()
                 res_list = [TableSchema(*item) for item in res]
                 return res_list
         elif equals_ignore_case(ds.type, 'es'):
-            res = get_es_index(conf)
+            with es_connection(ds, conf) as es_client:
+                res = get_es_index(es_client)
             res_list = [TableSchema(*item) for item in res]
             return res_list
 
@@ -409,157 +624,256 @@ def get_fields(ds: CoreDatasource, table_name: str = None):
                 res_list = [ColumnSchema(*item) for item in res]
                 return res_list
     else:
-        extra_config_dict = get_extra_config(conf)
         if equals_ignore_case(ds.type, 'dm'):
-            with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                  port=conf.port, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with driver_connection(ds, conf) as conn, conn.cursor() as cursor:
                 cursor.execute(sql, {"param1": p1, "param2": p2}, timeout=conf.timeout)
                 res = cursor.fetchall()
                 res_list = [ColumnSchema(*item) for item in res]
                 return res_list
         elif equals_ignore_case(ds.type, 'doris', 'starrocks'):
-            with pymysql.connect(user=conf.username, passwd=conf.password, host=conf.host,
-                                 port=conf.port, db=conf.database, connect_timeout=conf.timeout,
-                                 read_timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with driver_connection(ds, conf) as conn, conn.cursor() as cursor:
                 cursor.execute(sql, (p1, p2))
                 res = cursor.fetchall()
                 res_list = [ColumnSchema(*item) for item in res]
                 return res_list
         elif equals_ignore_case(ds.type, 'redshift'):
-            with redshift_connector.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                            password=conf.password,
-                                            timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with driver_connection(ds, conf) as conn, conn.cursor() as cursor:
                 cursor.execute(sql, (p1, p2))
                 res = cursor.fetchall()
                 res_list = [ColumnSchema(*item) for item in res]
                 return res_list
         elif equals_ignore_case(ds.type, 'kingbase'):
-            with psycopg2.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                  password=conf.password,
-                                  options=f"-c statement_timeout={conf.timeout * 1000}",
-                                  **extra_config_dict) as conn, conn.cursor() as cursor:
+            with driver_connection(ds, conf) as conn, conn.cursor() as cursor:
                 # Use parameterized query for security
                 cursor.execute(sql, (p1, p2))
                 res = cursor.fetchall()
                 res_list = [ColumnSchema(*item) for item in res]
                 return res_list
         elif equals_ignore_case(ds.type, 'es'):
-            res = get_es_fields(conf, table_name)
+            with es_connection(ds, conf) as es_client:
+                res = get_es_fields(es_client, table_name)
             res_list = [ColumnSchema(*item) for item in res]
             return res_list
 
 
-def exec_sql(ds: CoreDatasource | AssistantOutDsSchema, sql: str, origin_column=False):
+def get_all_fields(ds: CoreDatasource, table_names: Optional[list[str]] = None) -> Optional[dict[str, list[ColumnSchema]]]:
+    """
+    catalog 查询获取字段，按表名分组；table_names 不为空时只查询这些表，表名过多时按 CATALOG_TABLE_BATCH_SIZE 分批查询
+    不支持单次查询的类型返回 None
+    """
+    conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration))) if not equals_ignore_case(ds.type,
+                                                                                                 "excel") else get_engine_config()
+    db = DB.get_db(ds.type)
+    batches = [table_names[i:i + CATALOG_TABLE_BATCH_SIZE] for i in
+               range(0, len(table_names), CATALOG_TABLE_BATCH_SIZE)] if table_names else [[]]
+    fields_map: dict[str, list[ColumnSchema]] = {}
+    for batch in batches:
+        sql, param = get_all_fields_sql(ds, conf, len(batch))
+        if not sql:
+            return None
+        named_params = {"param": param, **{f"t{i}": name for i, name in enumerate(batch)}}
+        res = []
+        if db.connect_type == ConnectType.sqlalchemy:
+            with get_session(ds) as session:
+                with session.execute(text(sql), named_params) as result:
+                    res = result.fetchall()
+        elif equals_ignore_case(ds.type, 'dm'):
+            with driver_connection(ds, conf) as conn, conn.cursor() as cursor:
+                cursor.execute(sql, named_params, timeout=conf.timeout)
+                res = cursor.fetchall()
+        else:
+            with driver_connection(ds, conf) as conn, conn.cursor() as cursor:
+                cursor.execute(sql, (param, *batch))
+                res = cursor.fetchall()
+
+        for item in res:
+            table_name = item[0].decode() if isinstance(item[0], bytes) else item[0]
+            fields_map.setdefault(table_name, []).append(ColumnSchema(*item[1:4]))
+    return fields_map
+
+
+def build_sql_result(columns: list, rows, sql: str, columnar: bool = False) -> dict:
+    """
+    columnar 为 True 时返回列式结果 {"fields", "columns": [每列的值], "columnar": True}，
+    避免每行重复保存列名，需要行格式时由 DataFormat.columnar_to_rows 转换
+    """
+    if columnar:
+        column_values = [list(values) for values in zip(*rows)] if rows else [[] for _ in columns]
+        for i, values in enumerate(column_values):
+            if any(isinstance(value, Decimal) for value in values):
+                column_values[i] = [float(value) if isinstance(value, Decimal) else value for value in values]
+        return {"fields": columns, "columns": column_values, "columnar": True,
+                "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
+    result_list = [
+        {str(columns[i]): float(value) if isinstance(value, Decimal) else value for i, value in
+         enumerate(tuple_item)}
+        for tuple_item in rows
+    ]
+    return {"fields": columns, "data": result_list,
+            "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
+
+
+class SqlRowStream:
+    """
+    流式读取查询结果：按 batch_size 分批 fetchmany，累计行数达到 max_rows 或估算字节数达到 max_bytes 时
+    停止读取并标记 truncated，避免一次性把整个结果集加载到内存
+    """
+
+    def __init__(self, fetchmany: Callable[[int], list], get_columns: Callable[[], list], origin_column: bool = False,
+                 max_rows: Optional[int] = None, max_bytes: Optional[int] = None, batch_size: Optional[int] = None):
+        self._fetchmany = fetchmany
+        self._get_columns = get_columns
+        self.origin_column = origin_column
+        self.max_rows = max_rows if max_rows and max_rows > 0 else None
+        self.max_bytes = max_bytes if max_bytes and max_bytes > 0 else None
+        self.batch_size = batch_size if batch_size and batch_size > 0 else settings.SQL_FETCH_BATCH_SIZE
+        self.row_count = 0
+        self.byte_count = 0
+        self.truncated = False
+        # 结果集是否已读完，未读完时部分驱动（非缓冲游标）需要废弃连接
+        self.exhausted = False
+        self._first_batch = None
+        self._columns = None
+
+    @property
+    def columns(self) -> list:
+        if self._columns is None:
+            # psycopg2 服务端游标在第一次 fetch 之后才有 description
+            if self._first_batch is None:
+                self._first_batch = self._fetch()
+            columns = list(self._get_columns())
+            self._columns = columns if self.origin_column else [str(column).lower() for column in columns]
+        return self._columns
+
+    def _fetch(self) -> list:
+        size = self.batch_size
+        if self.max_rows is not None:
+            # 多取一行用于判断是否被截断
+            size = max(min(size, self.max_rows - self.row_count + 1), 1)
+        batch = self._fetchmany(size)
+        if not batch:
+            self.exhausted = True
+            return []
+        return list(batch)
+
+    def batches(self) -> Iterator[list]:
+        while not self.exhausted and not self.truncated:
+            if self._first_batch is not None:
+                batch, self._first_batch = self._first_batch, None
+            else:
+                batch = self._fetch()
+            if not batch:
+                break
+            if self.max_rows is not None and self.row_count + len(batch) > self.max_rows:
+                batch = batch[:self.max_rows - self.row_count]
+                self.truncated = True
+            if self.max_bytes is not None:
+                for i, row in enumerate(batch):
+                    self.byte_count += estimate_row_size(row)
+                    if self.byte_count > self.max_bytes:
+                        batch = batch[:i]
+                        self.truncated = True
+                        break
+            self.row_count += len(batch)
+            if batch:
+                yield batch
+
+
+def estimate_row_size(row) -> int:
+    size = 0
+    for value in row:
+        if isinstance(value, (str, bytes)):
+            size += len(value)
+        else:
+            size += 8
+    return size
+
+
+@contextmanager
+def stream_sql(ds: CoreDatasource | AssistantOutDsSchema, sql: str, origin_column=False,
+               max_rows: Optional[int] = None, max_bytes: Optional[int] = None,
+               batch_size: Optional[int] = None) -> Iterator[SqlRowStream]:
+    """
+    以服务端游标执行查询并返回 SqlRowStream，结果可以直接写入导出文件或存储，不需要先构建完整的列表：
+    - sqlalchemy 类型使用 stream_results（postgresql 命名游标、mysql SSCursor 等，方言不支持时为普通游标）
+    - doris/starrocks 使用 pymysql SSCursor，kingbase 使用 psycopg2 命名游标，其他驱动使用 fetchmany
+    """
     while sql.endswith(';'):
         sql = sql[:-1]
 
     db = DB.get_db(ds.type)
     if db.connect_type == ConnectType.sqlalchemy:
         with get_session(ds) as session:
-            with session.execute(text(sql)) as result:
-                try:
-                    columns = result.keys()._keys if origin_column else [item.lower() for item in result.keys()._keys]
-                    res = result.fetchall()
-                    result_list = [
-                        {str(columns[i]): float(value) if isinstance(value, Decimal) else value for i, value in
-                         enumerate(tuple_item)}
-                        for tuple_item in res
-                    ]
-                    return {"fields": columns, "data": result_list,
-                            "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
-                except Exception as ex:
-                    raise ParseSQLResultError(str(ex))
+            connection = session.connection(execution_options={"stream_results": True})
+            result = connection.execute(text(sql))
+            stream = SqlRowStream(result.fetchmany, lambda: result.keys()._keys, origin_column, max_rows, max_bytes,
+                                  batch_size)
+            try:
+                yield stream
+            finally:
+                if not stream.exhausted and connection.dialect.name in ('mysql', 'mariadb'):
+                    # mysql 非缓冲游标关闭时会读完剩余结果，提前结束时直接废弃连接
+                    connection.invalidate()
+                result.close()
+    elif equals_ignore_case(ds.type, 'es'):
+        conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration)))
+        try:
+            res, columns = get_es_data_by_http(conf, sql)
+        except Exception as ex:
+            raise Exception(str(ex))
+        rows = iter(res)
+        yield SqlRowStream(lambda size: list(itertools.islice(rows, size)),
+                           lambda: [field.get('name') for field in columns], origin_column, max_rows, max_bytes,
+                           batch_size)
     else:
         conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration)))
-        extra_config_dict = get_extra_config(conf)
-        if equals_ignore_case(ds.type, 'dm'):
-            with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                  port=conf.port, **extra_config_dict) as conn, conn.cursor() as cursor:
-                try:
-                    cursor.execute(sql, timeout=conf.timeout)
-                    res = cursor.fetchall()
-                    columns = [field[0] for field in cursor.description] if origin_column else [field[0].lower() for
-                                                                                                field in
-                                                                                                cursor.description]
-                    result_list = [
-                        {str(columns[i]): float(value) if isinstance(value, Decimal) else value for i, value in
-                         enumerate(tuple_item)}
-                        for tuple_item in res
-                    ]
-                    return {"fields": columns, "data": result_list,
-                            "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
-                except Exception as ex:
-                    raise ParseSQLResultError(str(ex))
-        elif equals_ignore_case(ds.type, 'doris', 'starrocks'):
-            with pymysql.connect(user=conf.username, passwd=conf.password, host=conf.host,
-                                 port=conf.port, db=conf.database, connect_timeout=conf.timeout,
-                                 read_timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
-                try:
-                    cursor.execute(sql)
-                    res = cursor.fetchall()
-                    columns = [field[0] for field in cursor.description] if origin_column else [field[0].lower() for
-                                                                                                field in
-                                                                                                cursor.description]
-                    result_list = [
-                        {str(columns[i]): float(value) if isinstance(value, Decimal) else value for i, value in
-                         enumerate(tuple_item)}
-                        for tuple_item in res
-                    ]
-                    return {"fields": columns, "data": result_list,
-                            "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
-                except Exception as ex:
-                    raise ParseSQLResultError(str(ex))
-        elif equals_ignore_case(ds.type, 'redshift'):
-            with redshift_connector.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                            password=conf.password,
-                                            timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
-                try:
-                    cursor.execute(sql)
-                    res = cursor.fetchall()
-                    columns = [field[0] for field in cursor.description] if origin_column else [field[0].lower() for
-                                                                                                field in
-                                                                                                cursor.description]
-                    result_list = [
-                        {str(columns[i]): float(value) if isinstance(value, Decimal) else value for i, value in
-                         enumerate(tuple_item)}
-                        for tuple_item in res
-                    ]
-                    return {"fields": columns, "data": result_list,
-                            "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
-                except Exception as ex:
-                    raise ParseSQLResultError(str(ex))
-        elif equals_ignore_case(ds.type, 'kingbase'):
-            with psycopg2.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                  password=conf.password,
-                                  options=f"-c statement_timeout={conf.timeout * 1000}",
-                                  **extra_config_dict) as conn, conn.cursor() as cursor:
+        with driver_connection(ds, conf) as conn:
+            unbuffered = equals_ignore_case(ds.type, 'doris', 'starrocks')
+            if unbuffered:
+                cursor = conn.cursor(pymysql.cursors.SSCursor)
+            elif equals_ignore_case(ds.type, 'kingbase'):
+                cursor = conn.cursor(name=f'sqlbot_stream_{uuid.uuid4().hex}')
+                cursor.itersize = batch_size or settings.SQL_FETCH_BATCH_SIZE
+            else:
+                cursor = conn.cursor()
+            stream = SqlRowStream(cursor.fetchmany, lambda: [field[0] for field in cursor.description],
+                                  origin_column, max_rows, max_bytes, batch_size)
+            try:
                 try:
-                    cursor.execute(sql)
-                    res = cursor.fetchall()
-                    columns = [field[0] for field in cursor.description] if origin_column else [field[0].lower() for
-                                                                                                field in
-                                                                                                cursor.description]
-                    result_list = [
-                        {str(columns[i]): float(value) if isinstance(value, Decimal) else value for i, value in
-                         enumerate(tuple_item)}
-                        for tuple_item in res
-                    ]
-                    return {"fields": columns, "data": result_list,
-                            "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
+                    if equals_ignore_case(ds.type, 'dm'):
+                        cursor.execute(sql, timeout=conf.timeout)
+                    else:
+                        cursor.execute(sql)
                 except Exception as ex:
                     raise ParseSQLResultError(str(ex))
-        elif equals_ignore_case(ds.type, 'es'):
-            try:
-                res, columns = get_es_data_by_http(conf, sql)
-                columns = [field.get('name') for field in columns] if origin_column else [field.get('name').lower() for
-                                                                                          field in
-                                                                                          columns]
-                result_list = [
-                    {str(columns[i]): float(value) if isinstance(value, Decimal) else value for i, value in
-                     enumerate(tuple(tuple_item))}
-                    for tuple_item in res
-                ]
-                return {"fields": columns, "data": result_list,
-                        "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
-            except Exception as ex:
-                raise Exception(str(ex))
+                yield stream
+            finally:
+                if unbuffered and not stream.exhausted:
+                    # SSCursor 关闭时会读完剩余结果，直接关闭连接，归还连接池时回滚失败会被丢弃
+                    close_quietly(conn)
+                else:
+                    cursor.close()
+
+
+def exec_sql(ds: CoreDatasource | AssistantOutDsSchema, sql: str, origin_column=False, columnar: bool = False,
+             max_rows: Optional[int] = None, max_bytes: Optional[int] = None):
+    """
+    max_rows/max_bytes 限制读取的行数和估算字节数，超出时结果中 truncated 为 True
+    """
+    while sql.endswith(';'):
+        sql = sql[:-1]
+
+    with stream_sql(ds, sql, origin_column, max_rows, max_bytes) as stream:
+        try:
+            columns = stream.columns
+            res = [row for batch in stream.batches() for row in batch]
+            result = build_sql_result(columns, res, sql, columnar)
+        except ParseSQLResultError:
+            raise
+        except Exception as ex:
+            raise ParseSQLResultError(str(ex))
+        if stream.truncated:
+            SQLBotLogUtil.info(f"SQL result truncated on ds_id {ds.id}: {stream.row_count} rows, "
+                               f"about {stream.byte_count} bytes")
+            result['truncated'] = True
+        return result
@@ -313,3 +313,142 @@ def get_field_sql(ds: CoreDatasource, conf: DatasourceConf, table_name: str = No
         return sql1 + sql2, conf.dbSchema, table_name
     elif equals_ignore_case(ds.type, "es"):
         return "", None, None
+
+
+def get_all_fields_sql(ds: CoreDatasource, conf: DatasourceConf, table_count: int = 0):
+    """
+    一次查询 schema 的字段，返回 (TABLE_NAME, COLUMN_NAME, DATA_TYPE, COLUMN_COMMENT)，按表和字段顺序排序
+    table_count > 0 时追加 TABLE_NAME IN (...) 条件，表名参数为 :t0、:t1...（sqlalchemy/dm）或依次的 %s（其他驱动）
+    不支持的类型（es）返回空 sql，由调用方逐表查询
+    """
+    if equals_ignore_case(ds.type, "mysql"):
+        sql1 = """
+                SELECT 
+                    TABLE_NAME,
+                    COLUMN_NAME,
+                    DATA_TYPE,
+                    COLUMN_COMMENT
+                FROM 
+                    INFORMATION_SCHEMA.COLUMNS
+                WHERE 
+                    TABLE_SCHEMA = :param
+                """
+        return sql1 + get_table_filter_sql("TABLE_NAME", table_count) + \
+            " ORDER BY TABLE_NAME, ORDINAL_POSITION", conf.database
+    elif equals_ignore_case(ds.type, "sqlServer"):
+        sql1 = """
+                SELECT 
+                    C.TABLE_NAME AS [TABLE_NAME],
+                    C.COLUMN_NAME AS [COLUMN_NAME],
+                    C.DATA_TYPE AS [DATA_TYPE],
+                    ISNULL(EP.value, '') AS [COLUMN_COMMENT]
+                FROM 
+                    INFORMATION_SCHEMA.COLUMNS C
+                LEFT JOIN 
+                    sys.extended_properties EP 
+                    ON EP.major_id = OBJECT_ID(C.TABLE_SCHEMA + '.' + C.TABLE_NAME)
+                    AND EP.minor_id = C.ORDINAL_POSITION
+                    AND EP.name = 'MS_Description'
+                WHERE 
+                    C.TABLE_SCHEMA = :param
+                """
+        return sql1 + get_table_filter_sql("C.TABLE_NAME", table_count) + \
+            " ORDER BY C.TABLE_NAME, C.ORDINAL_POSITION", conf.dbSchema
+    elif equals_ignore_case(ds.type, "pg", "excel", "redshift", "kingbase"):
+        named = equals_ignore_case(ds.type, "pg", "excel")
+        sql1 = f"""
+               SELECT c.relname                                       AS TABLE_NAME,
+                      a.attname                                       AS COLUMN_NAME,
+                      pg_catalog.format_type(a.atttypid, a.atttypmod) AS DATA_TYPE,
+                      col_description(c.oid, a.attnum)                AS COLUMN_COMMENT
+               FROM pg_catalog.pg_attribute a
+                        JOIN
+                    pg_catalog.pg_class c ON a.attrelid = c.oid
+                        JOIN
+                    pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+               WHERE n.nspname = {':param' if named else '%s'}
+                 AND c.relkind IN ('r', 'v', 'm', 'p', 'f')
+                 AND a.attnum > 0
+                 AND NOT a.attisdropped
+               """
+        return sql1 + get_table_filter_sql("c.relname", table_count, named) + \
+            " ORDER BY c.relname, a.attnum", conf.dbSchema
+    elif equals_ignore_case(ds.type, "oracle"):
+        sql1 = """
+                SELECT 
+                    col.TABLE_NAME AS "TABLE_NAME",
+                    col.COLUMN_NAME AS "COLUMN_NAME",
+                    (CASE 
+                        WHEN col.DATA_TYPE IN ('VARCHAR2', 'CHAR', 'NVARCHAR2', 'NCHAR') 
+                            THEN col.DATA_TYPE || '(' || col.DATA_LENGTH || ')' 
+                        WHEN col.DATA_TYPE = 'NUMBER' AND col.DATA_PRECISION IS NOT NULL 
+                            THEN col.DATA_TYPE || '(' || col.DATA_PRECISION || 
+                                 CASE WHEN col.DATA_SCALE > 0 THEN ',' || col.DATA_SCALE END || ')' 
+                        ELSE col.DATA_TYPE 
+                    END) AS "DATA_TYPE",
+                    NVL(com.COMMENTS, '') AS "COLUMN_COMMENT"
+                FROM 
+                    ALL_TAB_COLUMNS col
+                LEFT JOIN 
+                    ALL_COL_COMMENTS com 
+                    ON col.OWNER = com.OWNER 
+                    AND col.TABLE_NAME = com.TABLE_NAME 
+                    AND col.COLUMN_NAME = com.COLUMN_NAME
+                WHERE 
+                    col.OWNER = :param
+                """
+        return sql1 + get_table_filter_sql("col.TABLE_NAME", table_count) + \
+            " ORDER BY col.TABLE_NAME, col.COLUMN_ID", conf.dbSchema
+    elif equals_ignore_case(ds.type, "ck"):
+        sql1 = """
+                SELECT 
+                    table AS TABLE_NAME,
+                    name AS COLUMN_NAME,
+                    type AS DATA_TYPE,
+                    comment AS COLUMN_COMMENT
+                FROM system.columns
+                WHERE database = :param
+                """
+        return sql1 + get_table_filter_sql("table", table_count) + \
+            " ORDER BY table, position", conf.database
+    elif equals_ignore_case(ds.type, "dm"):
+        sql1 = """
+                SELECT 
+                    c.TABLE_NAME     AS "TABLE_NAME",
+                    c.COLUMN_NAME    AS "COLUMN_NAME",
+                    c.DATA_TYPE      AS "DATA_TYPE",
+                    COALESCE(com.COMMENTS, '') AS "COMMENTS"
+                FROM 
+                    ALL_TAB_COLS c
+                LEFT JOIN 
+                    ALL_COL_COMMENTS com 
+                    ON c.OWNER = com.OWNER 
+                   AND c.TABLE_NAME = com.TABLE_NAME 
+                   AND c.COLUMN_NAME = com.COLUMN_NAME
+                WHERE 
+                    c.OWNER = :param
+                """
+        return sql1 + get_table_filter_sql("c.TABLE_NAME", table_count) + \
+            " ORDER BY c.TABLE_NAME, c.COLUMN_ID", conf.dbSchema
+    elif equals_ignore_case(ds.type, "doris", "starrocks"):
+        sql1 = """
+                SELECT 
+                    TABLE_NAME,
+                    COLUMN_NAME,
+                    DATA_TYPE,
+                    COLUMN_COMMENT
+                FROM 
+                    INFORMATION_SCHEMA.COLUMNS
+                WHERE 
+                    TABLE_SCHEMA = %s
+                """
+        return sql1 + get_table_filter_sql("TABLE_NAME", table_count, False) + \
+            " ORDER BY TABLE_NAME, ORDINAL_POSITION", conf.database
+    return "", None
+
+
+def get_table_filter_sql(column: str, table_count: int, named: bool = True) -> str:
+    if table_count <= 0:
+        return ""
+    placeholders = [f":t{i}" if named else "%s" for i in range(table_count)]
+    return f" AND {column} IN ({', '.join(placeholders)})"
@@ -0,0 +1,140 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Optional
+
+from common.error import SQLBotDBConnectionError
+from common.utils.utils import SQLBotLogUtil
+
+
+class _PooledConnection:
+    __slots__ = ('conn', 'created_at', 'last_used')
+
+    def __init__(self, conn: Any):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+def close_quietly(conn: Any):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def default_ping(conn: Any):
+    cursor = conn.cursor()
+    try:
+        cursor.execute('select 1')
+        cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+class DriverConnectionPool:
+    """
+    通用的 DB-API 连接池，用于 py_driver 类型的数据源（dm、doris/starrocks、redshift、kingbase）
+    - max_size: 同时借出的最大连接数，超过时等待 timeout 秒
+    - max_idle: 空闲超过该秒数的连接在借出时丢弃
+    - max_lifetime: 创建超过该秒数的连接在借出/归还时丢弃
+    - 借出前执行 ping 做健康检查，失败则丢弃并重建
+    """
+
+    def __init__(self, creator: Callable[[], Any], max_size: int = 5, max_idle: int = 300,
+                 max_lifetime: int = 3600, timeout: int = 30, ping: Optional[Callable[[Any], None]] = default_ping):
+        self._creator = creator
+        self._max_size = max(max_size, 1)
+        self._max_idle = max_idle
+        self._max_lifetime = max_lifetime
+        self._timeout = timeout
+        self._ping = ping
+        self._idle: deque[_PooledConnection] = deque()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self._max_size)
+        self._checked_out = 0
+        self._closed = False
+
+    def _expired(self, item: _PooledConnection, now: float) -> bool:
+        if self._max_lifetime > 0 and now - item.created_at > self._max_lifetime:
+            return True
+        if self._max_idle > 0 and now - item.last_used > self._max_idle:
+            return True
+        return False
+
+    def _acquire(self) -> _PooledConnection:
+        if not self._slots.acquire(timeout=self._timeout if self._timeout and self._timeout > 0 else None):
+            raise SQLBotDBConnectionError(f'Timeout waiting for a free connection, pool size: {self._max_size}')
+        try:
+            while True:
+                with self._lock:
+                    item = self._idle.pop() if self._idle else None
+                if item is None:
+                    item = _PooledConnection(self._creator())
+                    break
+                if self._expired(item, time.monotonic()):
+                    close_quietly(item.conn)
+                    continue
+                if self._ping is not None:
+                    try:
+                        self._ping(item.conn)
+                    except Exception as e:
+                        SQLBotLogUtil.info(f"Discard broken pooled connection: {e}")
+                        close_quietly(item.conn)
+                        continue
+                break
+            with self._lock:
+                self._checked_out += 1
+            return item
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _release(self, item: _PooledConnection, discard: bool = False):
+        try:
+            if not discard:
+                try:
+                    item.conn.rollback()
+                except Exception:
+                    discard = True
+            now = time.monotonic()
+            if discard or self._closed or (0 < self._max_lifetime < now - item.created_at):
+                close_quietly(item.conn)
+            else:
+                item.last_used = now
+                with self._lock:
+                    self._idle.append(item)
+        finally:
+            with self._lock:
+                self._checked_out -= 1
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        item = self._acquire()
+        discard = False
+        try:
+            yield item.conn
+        except BaseException:
+            # 出错的连接状态不确定，直接丢弃
+            discard = True
+            raise
+        finally:
+            self._release(item, discard)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            items = list(self._idle)
+            self._idle.clear()
+        for item in items:
+            close_quietly(item.conn)
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "size": self._max_size,
+                "checked_in": len(self._idle),
+                "checked_out": self._checked_out,
+            }
@@ -0,0 +1,144 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from apps.datasource.models.datasource import CoreDatasource
+from apps.db.db import get_version
+from apps.system.schemas.system_schema import AssistantOutDsSchema
+from common.core.config import settings
+from common.utils.utils import SQLBotLogUtil
+
+
+class DsMetadata:
+    """
+    数据源元信息（目前为版本号），问题链路上直接读取，不再访问目标库
+    """
+
+    def __init__(self, version: str, ttl: int = 0):
+        self.version = version or ''
+        self.create_time = time.monotonic()
+        self.ttl = ttl
+
+    def expired(self) -> bool:
+        return 0 < self.ttl <= time.monotonic() - self.create_time
+
+
+_metadata_lock = threading.Lock()
+_metadata_cache: OrderedDict[tuple, DsMetadata] = OrderedDict()
+_metadata_version: dict[tuple, int] = {}
+_refreshing: set[tuple] = set()
+_refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='sqlbot-ds-metadata')
+
+
+def get_metadata_key(ds: CoreDatasource | AssistantOutDsSchema) -> Optional[tuple]:
+    if ds.id is None:
+        return None
+    if isinstance(ds, AssistantOutDsSchema):
+        # 外部数据源的连接信息由第三方提供，连接信息变化视为不同的数据源
+        return 'out', ds.id, ds.type, ds.host, ds.port, ds.dataBase, ds.db_schema
+    return 'ds', ds.id
+
+
+def _copy_ds(ds: CoreDatasource | AssistantOutDsSchema) -> CoreDatasource | AssistantOutDsSchema:
+    # 后台刷新不能使用请求 session 中的对象
+    if isinstance(ds, CoreDatasource):
+        return CoreDatasource(**ds.model_dump())
+    return ds.model_copy()
+
+
+def _put_metadata(key: Optional[tuple], version: int, metadata: DsMetadata):
+    if key is None or metadata.ttl <= 0 or settings.DS_METADATA_CACHE_SIZE <= 0:
+        return
+    with _metadata_lock:
+        # 探测期间被失效过（如修改了连接信息），结果可能已过期，不写入缓存
+        if _metadata_version.get(key, 0) == version:
+            _metadata_cache[key] = metadata
+            _metadata_cache.move_to_end(key)
+            while len(_metadata_cache) > settings.DS_METADATA_CACHE_SIZE:
+                _metadata_cache.popitem(last=False)
+
+
+def refresh_ds_metadata(ds: CoreDatasource | AssistantOutDsSchema) -> DsMetadata:
+    """
+    访问目标库获取版本号并写入缓存，未获取到版本号时只缓存 DS_METADATA_EMPTY_CACHE_TTL 秒
+    探测失败时抛出异常，并缓存 DS_METADATA_FAILED_CACHE_TTL 秒（保留之前的版本号），避免数据源不可用期间每次提问都等待连接超时
+    """
+    key = get_metadata_key(ds)
+    with _metadata_lock:
+        version = _metadata_version.get(key, 0)
+        previous = _metadata_cache.get(key) if key is not None else None
+    try:
+        ds_version = get_version(ds, raise_error=True)
+    except Exception:
+        _put_metadata(key, version,
+                      DsMetadata(previous.version if previous else '', settings.DS_METADATA_FAILED_CACHE_TTL))
+        raise
+    ttl = settings.DS_METADATA_CACHE_TTL if ds_version else settings.DS_METADATA_EMPTY_CACHE_TTL
+    metadata = DsMetadata(ds_version, ttl)
+    _put_metadata(key, version, metadata)
+    return metadata
+
+
+def _refresh_in_background(key: tuple, ds: CoreDatasource | AssistantOutDsSchema):
+    try:
+        refresh_ds_metadata(ds)
+    except Exception as e:
+        SQLBotLogUtil.error(f"Refresh datasource {ds.id} metadata failed: {e}")
+    finally:
+        with _metadata_lock:
+            _refreshing.discard(key)
+
+
+def refresh_ds_metadata_async(ds: CoreDatasource | AssistantOutDsSchema):
+    key = get_metadata_key(ds)
+    if key is None:
+        return
+    with _metadata_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+    try:
+        _refresh_executor.submit(_refresh_in_background, key, _copy_ds(ds))
+    except Exception:
+        with _metadata_lock:
+            _refreshing.discard(key)
+        raise
+
+
+def get_ds_metadata(ds: CoreDatasource | AssistantOutDsSchema) -> DsMetadata:
+    """
+    按数据源缓存元信息，首次访问时同步探测；过期后仍返回缓存值，并在后台刷新
+    探测失败时返回空版本号，失败结果短时间缓存；修改或删除数据源时调用 invalidate_ds_metadata 失效
+    """
+    key = get_metadata_key(ds)
+    if key is None:
+        return DsMetadata(get_version(ds))
+
+    with _metadata_lock:
+        metadata = _metadata_cache.get(key)
+        if metadata is not None:
+            _metadata_cache.move_to_end(key)
+    if metadata is None:
+        try:
+            return refresh_ds_metadata(ds)
+        except Exception as e:
+            SQLBotLogUtil.error(f"Get datasource {ds.id} version failed: {e}")
+            return DsMetadata('')
+    if metadata.expired():
+        refresh_ds_metadata_async(ds)
+    return metadata
+
+
+def get_ds_version(ds: CoreDatasource | AssistantOutDsSchema) -> str:
+    return get_ds_metadata(ds).version
+
+
+def invalidate_ds_metadata(ds_id: Optional[int]):
+    if ds_id is None:
+        return
+    key = ('ds', ds_id)
+    with _metadata_lock:
+        _metadata_version[key] = _metadata_version.get(key, 0) + 1
+        _metadata_cache.pop(key, None)
@@ -1,13 +1,17 @@
 # Author: Junjun
 # Date: 2025/5/19
+import time
 import urllib.parse
+from io import StringIO
 from typing import List
 
+import pandas as pd
 from sqlalchemy import create_engine, text, MetaData, Table
 from sqlalchemy.orm import sessionmaker
 
 from apps.datasource.models.datasource import DatasourceConf
 from common.core.config import settings
+from common.utils.utils import SQLBotLogUtil
 
 
 def get_engine_config():
@@ -69,3 +73,56 @@ def insert_data(session, table_name: str, fields: List[any], data: List[any]):
         stmt = table.insert().values(data)
         conn.execute(stmt)
         conn.commit()
+
+
+def quote_identifier(name) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def get_df_column_type(dtype) -> str:
+    # 与 DataFrame.to_sql 生成的字段类型保持一致
+    dtype_name = str(dtype)
+    if dtype_name == 'uint64':
+        return 'text'
+    if pd.api.types.is_bool_dtype(dtype):
+        return 'boolean'
+    if pd.api.types.is_integer_dtype(dtype):
+        return 'bigint'
+    if pd.api.types.is_float_dtype(dtype):
+        return 'double precision'
+    if isinstance(dtype, pd.DatetimeTZDtype):
+        return 'timestamp with time zone'
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return 'timestamp without time zone'
+    if pd.api.types.is_timedelta64_dtype(dtype):
+        return 'interval'
+    return 'text'
+
+
+def copy_df_to_table(engine, table_name: str, df: pd.DataFrame, chunk_size: int = None) -> int:
+    """
+    按 DataFrame 的列类型建表，再分批通过 COPY FROM STDIN (CSV) 写入，整张表在同一个事务中提交
+    """
+    chunk_size = chunk_size if chunk_size and chunk_size > 0 else settings.EXCEL_COPY_CHUNK_SIZE
+    columns = [f'{quote_identifier(column)} {get_df_column_type(dtype)}' for column, dtype in df.dtypes.items()]
+    start_time = time.monotonic()
+    conn = engine.raw_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f'CREATE TABLE {quote_identifier(table_name)} ({", ".join(columns)})')
+            copy_sql = f'COPY {quote_identifier(table_name)} FROM STDIN WITH (FORMAT csv)'
+            for start in range(0, len(df), chunk_size):
+                output = StringIO()
+                df.iloc[start:start + chunk_size].to_csv(output, header=False, index=False)
+                output.seek(0)
+                cursor.copy_expert(sql=copy_sql, file=output)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    cost = time.monotonic() - start_time
+    SQLBotLogUtil.info(f"Import {len(df)} rows into {table_name} in {cost:.2f}s "
+                       f"({len(df) / cost if cost > 0 else len(df):.0f} rows/s)")
+    return len(df)
@@ -24,7 +24,11 @@ def get_es_auth(conf: DatasourceConf):
     }
 
 
+_es_http_session = requests.Session()
+
+
 def get_es_connect(conf: DatasourceConf):
+    # Elasticsearch client 自带连接池且线程安全，由 db.es_connection 按数据源缓存复用
     es_client = Elasticsearch(
         [conf.host],  # ES address
         basic_auth=(conf.username, conf.password),
@@ -36,8 +40,7 @@ def get_es_connect(conf: DatasourceConf):
 
 
 # get tables
-def get_es_index(conf: DatasourceConf):
-    es_client = get_es_connect(conf)
+def get_es_index(es_client: Elasticsearch):
     indices = es_client.cat.indices(format="json")
     res = []
     if indices is not None:
@@ -54,8 +57,7 @@ def get_es_index(conf: DatasourceConf):
 
 
 # get fields
-def get_es_fields(conf: DatasourceConf, table_name: str):
-    es_client = get_es_connect(conf)
+def get_es_fields(es_client: Elasticsearch, table_name: str):
     index_name = table_name
     mapping = es_client.indices.get_mapping(index=index_name)
     properties = mapping.get(index_name).get("mappings").get("properties")
@@ -115,7 +117,7 @@ def get_es_data_by_http(conf: DatasourceConf, sql: str):
     # If using self-signed certificates, provide the cert path: verify='/path/to/cert.pem'
     verify_ssl = True if not url.startswith('https://localhost') else False
     
-    response = requests.post(
+    response = _es_http_session.post(
         host, 
         data=json.dumps({"query": sql}), 
         headers=get_es_auth(conf), 
@@ -2,7 +2,7 @@ import json
 from typing import List, Union
 
 from fastapi.responses import StreamingResponse
-from apps.ai_model.model_factory import LLMConfig, LLMFactory
+from apps.ai_model.model_factory import LLMConfig, LLMFactory, invalidate_llm_config
 from apps.swagger.i18n import PLACEHOLDER_PREFIX
 from apps.system.schemas.ai_model_schema import AiModelConfigItem, AiModelCreator, AiModelEditor, AiModelGridItem
 from fastapi import APIRouter, Path, Query
@@ -72,6 +72,7 @@ async def set_default(session: SessionDep, id: int = Path(description="ID")):
         db_model.default_model = True
         session.add(db_model)
         session.commit()
+        invalidate_llm_config()
     except Exception as e:
         session.rollback()
         raise e
@@ -141,6 +142,8 @@ async def add_model(
         detail.default_model = True
     session.add(detail)
     session.commit()
+    if detail.default_model:
+        invalidate_llm_config()
     return detail
 
 @router.put("", summary=f"{PLACEHOLDER_PREFIX}system_model_update", description=f"{PLACEHOLDER_PREFIX}system_model_update")
@@ -159,6 +162,7 @@ async def update_model(
     db_model.sqlmodel_update(data)
     session.add(db_model)
     session.commit()
+    invalidate_llm_config(id)
 
 @router.delete("/{id}", summary=f"{PLACEHOLDER_PREFIX}system_model_del", description=f"{PLACEHOLDER_PREFIX}system_model_del")
 @require_permissions(permission=SqlbotPermission(role=['admin']))
@@ -173,6 +177,7 @@ async def delete_model(
         raise Exception(trans('i18n_llm.delete_default_error', key = item.name))
     session.delete(item)
     session.commit()
+    invalidate_llm_config(id)
     
 
     
\ No newline at end of file
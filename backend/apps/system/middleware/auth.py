@@ -6,8 +6,10 @@ from fastapi import Request
 from fastapi.responses import JSONResponse
 import jwt
 from sqlmodel import Session
-from starlette.middleware.base import BaseHTTPMiddleware
+from pydantic import BaseModel
+from starlette.types import ASGIApp, Receive, Scope, Send
 from apps.system.crud.apikey_manage import get_api_key
+from apps.system.middleware.auth_cache import principal_cache, get_token_exp
 from apps.system.models.system_model import ApiKeyModel, AssistantModel
 from common.core.db import engine 
 from apps.system.crud.assistant import get_assistant_info, get_assistant_user
@@ -21,31 +23,48 @@ from common.utils.utils import SQLBotLogUtil, get_origin_from_referer
 from common.utils.whitelist import whiteUtils
 from fastapi.security.utils import get_authorization_scheme_param
 from common.core.deps import get_i18n
-class TokenMiddleware(BaseHTTPMiddleware):
-    
-    
-    
-    def __init__(self, app):
-        super().__init__(app)
+class TokenMiddleware:
+    """
+    纯 ASGI 中间件，不会像 BaseHTTPMiddleware 那样缓冲流式响应
+    认证结果按 token 缓存在进程内（principal_cache），命中时不访问 Redis/数据库
+    """
 
-    async def dispatch(self, request, call_next):
-        
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request = Request(scope)
         if self.is_options(request) or whiteUtils.is_whitelisted(request.url.path):
-            return await call_next(request)
+            await self.app(scope, receive, send)
+            return
+        response = await self.dispatch(request)
+        if response is not None:
+            await response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+    async def dispatch(self, request: Request) -> Optional[JSONResponse]:
+        """
+        认证通过时写入 request.state 并返回 None，否则返回 401 响应
+        """
         assistantTokenKey = settings.ASSISTANT_TOKEN_KEY
         assistantToken = request.headers.get(assistantTokenKey)
         askToken = request.headers.get("X-SQLBOT-ASK-TOKEN")
         trans = await get_i18n(request)
         if askToken:
-            validate_pass, data = await self.validateAskToken(askToken, trans)
+            validate_pass, data = await self.cached_validate('ask', askToken, self.validateAskToken, trans)
             if validate_pass:
                 request.state.current_user = data
-                return await call_next(request)
+                return None
             message = trans('i18n_permission.authenticate_invalid', msg = data)
             return JSONResponse(message, status_code=401, headers={"Access-Control-Allow-Origin": "*"})
         #if assistantToken and assistantToken.lower().startswith("assistant "):
         if assistantToken:
-            validator: tuple[any] = await self.validateAssistant(assistantToken, trans)
+            validator: tuple[any] = await self.cached_validate('assistant', assistantToken, self.validateAssistant,
+                                                               trans)
             if validator[0]:
                 request.state.current_user = validator[1]
                 if request.state.current_user and trans.lang:
@@ -54,19 +73,41 @@ class TokenMiddleware(BaseHTTPMiddleware):
                 origin = request.headers.get("X-SQLBOT-HOST-ORIGIN") or get_origin_from_referer(request)
                 if origin and validator[2]:
                     request.state.assistant.request_origin = origin
-                return await call_next(request)
+                return None
             message = trans('i18n_permission.authenticate_invalid', msg = validator[1])
             return JSONResponse(message, status_code=401, headers={"Access-Control-Allow-Origin": "*"})
         #validate pass
         tokenkey = settings.TOKEN_KEY
         token = request.headers.get(tokenkey)
-        validate_pass, data = await self.validateToken(token, trans)
+        validate_pass, data = await self.cached_validate('token', token, self.validateToken, trans)
         if validate_pass:
             request.state.current_user = data
-            return await call_next(request)
+            return None
         
         message = trans('i18n_permission.authenticate_invalid', msg = data)
         return JSONResponse(message, status_code=401, headers={"Access-Control-Allow-Origin": "*"})
+
+    async def cached_validate(self, kind: str, token: Optional[str], validator, trans: I18n) -> tuple:
+        if not token:
+            return await validator(token, trans)
+        key = principal_cache.make_key(kind, token)
+        cached = principal_cache.get(key)
+        if cached is not None:
+            valid, value = cached
+            if valid:
+                # 后续处理会修改用户/小助手信息（如 language、request_origin），每个请求使用独立的副本
+                return (True, *[copy_principal(item) for item in value])
+            return False, value
+
+        version = principal_cache.version
+        result = await validator(token, trans)
+        if result[0]:
+            _, param = get_authorization_scheme_param(token)
+            principal_cache.put(key, True, tuple(copy_principal(item) for item in result[1:]), version,
+                                get_token_exp(param))
+        elif is_auth_failure(result[1]):
+            principal_cache.put(key, False, result[1], version)
+        return result
     
     def is_options(self, request: Request):
         return request.method == "OPTIONS"
@@ -233,6 +274,17 @@ class TokenMiddleware(BaseHTTPMiddleware):
             # Return False and the exception message
             return False, e
     
+def copy_principal(value):
+    return value.model_copy(deep=True) if isinstance(value, BaseModel) else value
+
+
+def is_auth_failure(error) -> bool:
+    """
+    只缓存确定的认证失败（token 无效/过期、用户禁用等），数据库等异常不缓存
+    """
+    return isinstance(error, (str, jwt.PyJWTError)) or type(error) is Exception
+
+
 def xor_decrypt(encrypted_str: str, key: int = 0xABCD1234) -> int:
     encrypted_bytes = base64.urlsafe_b64decode(encrypted_str)
     hex_str = encrypted_bytes.hex()
@@ -0,0 +1,88 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+import jwt
+
+from apps.system.schemas.auth import CacheNamespace
+from common.core.config import settings
+from common.core.sqlbot_cache import add_clear_cache_listener
+
+
+class PrincipalCache:
+    """
+    进程内的 token -> 认证结果缓存，key 为 token 的 sha256
+    - 认证通过的结果缓存 AUTH_TOKEN_CACHE_TTL 秒，且不超过 token 本身的过期时间
+    - 认证失败的 token 缓存 AUTH_INVALID_TOKEN_CACHE_TTL 秒，避免无效 token 反复查库
+    用户/API Key/小助手修改时（clear_cache）整体失效，多进程部署时依赖 TTL 过期
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> (过期时间, 是否有效, 认证结果)
+        self._cache: OrderedDict[str, tuple[float, bool, Any]] = OrderedDict()
+        self._version = 0
+
+    @staticmethod
+    def make_key(kind: str, token: str) -> str:
+        return hashlib.sha256(f'{kind}:{token}'.encode('utf-8')).hexdigest()
+
+    @property
+    def version(self) -> int:
+        with self._lock:
+            return self._version
+
+    def get(self, key: str) -> Optional[tuple[bool, Any]]:
+        with self._lock:
+            item = self._cache.get(key)
+            if item is None:
+                return None
+            if item[0] <= time.monotonic():
+                self._cache.pop(key, None)
+                return None
+            self._cache.move_to_end(key)
+            return item[1], item[2]
+
+    def put(self, key: str, valid: bool, value: Any, version: int, token_exp: Optional[float] = None):
+        ttl = settings.AUTH_TOKEN_CACHE_TTL if valid else settings.AUTH_INVALID_TOKEN_CACHE_TTL
+        if ttl <= 0 or settings.AUTH_TOKEN_CACHE_SIZE <= 0:
+            return
+        if token_exp is not None:
+            ttl = min(ttl, token_exp - time.time())
+            if ttl <= 0:
+                return
+        with self._lock:
+            # 认证期间缓存被清空过，结果可能已过期，不写入缓存
+            if version != self._version:
+                return
+            self._cache[key] = (time.monotonic() + ttl, valid, value)
+            self._cache.move_to_end(key)
+            while len(self._cache) > settings.AUTH_TOKEN_CACHE_SIZE:
+                self._cache.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._version += 1
+            self._cache.clear()
+
+
+def get_token_exp(token: str) -> Optional[float]:
+    try:
+        payload = jwt.decode(token, options={"verify_signature": False, "verify_exp": False})
+        exp = payload.get('exp')
+        return float(exp) if exp else None
+    except Exception:
+        return None
+
+
+principal_cache = PrincipalCache()
+
+
+def _on_clear_cache(namespace: str):
+    if namespace in (str(CacheNamespace.AUTH_INFO), str(CacheNamespace.EMBEDDED_INFO)):
+        principal_cache.clear()
+
+
+add_clear_cache_listener(_on_clear_cache)
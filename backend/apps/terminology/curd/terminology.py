@@ -1,20 +1,23 @@
 import datetime
 import logging
 import traceback
-from typing import List, Optional, Any
+from typing import List, Optional
 from xml.dom.minidom import parseString
 
 import dicttoxml
-from sqlalchemy import and_, or_, select, func, delete, update, union, text, BigInteger
+from pgvector.sqlalchemy import VECTOR
+from sqlalchemy import and_, or_, select, func, delete, update, union, text, BigInteger, bindparam
 from sqlalchemy.orm import aliased
 
-from apps.ai_model.embedding import EmbeddingModelCache
+from apps.ai_model.embedding import EmbeddingQueryCache, run_batch_embedding
 from apps.datasource.models.datasource import CoreDatasource
 from apps.template.generate_chart.generator import get_base_terminology_template
 from apps.terminology.models.terminology_model import Terminology, TerminologyInfo
 from common.core.config import settings
 from common.core.deps import SessionDep, Trans
 from common.utils.embedding_threads import run_save_terminology_embeddings
+from common.utils.keyword_matcher import OrgKeywordMatcher
+from common.utils.vector_index import embedding_distance, embedding_dimension_filter, ensure_embedding_index
 
 
 def get_terminology_base_query(oid: int, name: Optional[str] = None):
@@ -325,6 +328,7 @@ def create_terminology(session: SessionDep, info: TerminologyInfo, oid: int, tra
         session.flush()
 
     session.commit()
+    terminology_matcher.invalidate(oid)
 
     # 处理embedding（批量插入时跳过）
     if not skip_embedding:
@@ -598,6 +602,7 @@ def update_terminology(session: SessionDep, info: TerminologyInfo, oid: int, tra
         session.bulk_save_objects(child_list)
         session.flush()
     session.commit()
+    terminology_matcher.invalidate(oid)
 
     # embedding
     run_save_terminology_embeddings([info.id])
@@ -606,9 +611,12 @@ def update_terminology(session: SessionDep, info: TerminologyInfo, oid: int, tra
 
 
 def delete_terminology(session: SessionDep, ids: list[int]):
-    stmt = delete(Terminology).where(or_(Terminology.id.in_(ids), Terminology.pid.in_(ids)))
-    session.execute(stmt)
+    stmt = delete(Terminology).where(or_(Terminology.id.in_(ids), Terminology.pid.in_(ids))).returning(
+        Terminology.oid)
+    oids = {row[0] for row in session.execute(stmt)}
     session.commit()
+    # 只失效受影响组织的自动机
+    terminology_matcher.invalidate_many(oids)
 
 
 def enable_terminology(session: SessionDep, id: int, enabled: bool, trans: Trans):
@@ -620,9 +628,11 @@ def enable_terminology(session: SessionDep, id: int, enabled: bool, trans: Trans
 
     stmt = update(Terminology).where(or_(Terminology.id == id, Terminology.pid == id)).values(
         enabled=enabled,
-    )
-    session.execute(stmt)
+    ).returning(Terminology.oid)
+    oids = {row[0] for row in session.execute(stmt)}
     session.commit()
+    # 只失效受影响组织的自动机
+    terminology_matcher.invalidate_many(oids)
 
 
 # def run_save_embeddings(ids: List[int]):
@@ -661,112 +671,96 @@ def save_embeddings(session_maker, ids: List[int]):
         return
     try:
         session = session_maker()
-        _list = session.query(Terminology).filter(or_(Terminology.id.in_(ids), Terminology.pid.in_(ids))).all()
-
-        _words_list = [item.word for item in _list]
 
-        model = EmbeddingModelCache.get_model()
+        def load_texts(batch_ids: List[int]):
+            _list = session.query(Terminology.id, Terminology.word).filter(
+                or_(Terminology.id.in_(batch_ids), Terminology.pid.in_(batch_ids))).all()
+            return [(item.id, item.word) for item in _list]
 
-        results = model.embed_documents(_words_list)
-
-        for index in range(len(results)):
-            item = results[index]
-            stmt = update(Terminology).where(and_(Terminology.id == _list[index].id)).values(embedding=item)
-            session.execute(stmt)
+        def save_batch(values: List[dict]):
+            session.execute(update(Terminology), values)
             session.commit()
 
+        dims = run_batch_embedding('terminology', list(ids), load_texts, save_batch, session)
+        for dim in dims:
+            ensure_embedding_index(session, Terminology.__tablename__, dim)
+
     except Exception:
         traceback.print_exc()
     finally:
         session_maker.remove()
 
 
-embedding_sql = f"""
+def embedding_sql(dim: int, with_datasource: bool = False) -> str:
+    """
+    先按 oid / enabled / 数据源过滤，再按向量距离取 top k（命中 terminology 上对应维度的 hnsw 索引），
+    最后在外层按相似度阈值过滤
+    """
+    ds_filter = """(specific_ds = false OR specific_ds IS NULL)"""
+    if with_datasource:
+        ds_filter = """(
+    (specific_ds = false OR specific_ds IS NULL)
+     OR
+    (specific_ds = true AND datasource_ids IS NOT NULL AND datasource_ids @> jsonb_build_array(:datasource))
+)"""
+    return f"""
 SELECT id, pid, word, similarity
 FROM
-(SELECT id, pid, word, oid, specific_ds, datasource_ids, enabled,
-( 1 - (embedding <=> :embedding_array) ) AS similarity
+(SELECT id, pid, word,
+( 1 - {embedding_distance(dim)} ) AS similarity
 FROM terminology AS child
-) TEMP
-WHERE similarity > {settings.EMBEDDING_TERMINOLOGY_SIMILARITY} AND oid = :oid AND enabled = true
-AND (specific_ds = false OR specific_ds IS NULL)
-ORDER BY similarity DESC
+WHERE oid = :oid AND enabled = true
+AND embedding IS NOT NULL AND {embedding_dimension_filter(dim)}
+AND {ds_filter}
+ORDER BY {embedding_distance(dim)}
 LIMIT {settings.EMBEDDING_TERMINOLOGY_TOP_COUNT}
-"""
-
-embedding_sql_with_datasource = f"""
-SELECT id, pid, word, similarity
-FROM
-(SELECT id, pid, word, oid, specific_ds, datasource_ids, enabled,
-( 1 - (embedding <=> :embedding_array) ) AS similarity
-FROM terminology AS child
 ) TEMP
-WHERE similarity > {settings.EMBEDDING_TERMINOLOGY_SIMILARITY} AND oid = :oid AND enabled = true
-AND (
-    (specific_ds = false OR specific_ds IS NULL)
-     OR
-    (specific_ds = true AND datasource_ids IS NOT NULL AND datasource_ids @> jsonb_build_array(:datasource))
-)
+WHERE similarity > {settings.EMBEDDING_TERMINOLOGY_SIMILARITY}
 ORDER BY similarity DESC
-LIMIT {settings.EMBEDDING_TERMINOLOGY_TOP_COUNT}
 """
 
 
-def select_terminology_by_word(session: SessionDep, word: str, oid: int, datasource: int = None):
-    if word.strip() == "":
-        return []
+def load_terminology_words(session: SessionDep, oid: int):
+    stmt = select(Terminology.id, Terminology.pid, Terminology.word, Terminology.specific_ds,
+                  Terminology.datasource_ids).where(and_(Terminology.oid == oid, Terminology.enabled == True))
+    return [(row.word, row) for row in session.execute(stmt)]
 
-    _list: List[Terminology] = []
 
-    stmt = (
-        select(
-            Terminology.id,
-            Terminology.pid,
-            Terminology.word,
-        )
-        .where(
-            and_(text(":sentence ILIKE '%' || word || '%'"), Terminology.oid == oid, Terminology.enabled == True)
-        )
-    )
+# 按组织缓存的术语自动机，用于找出问题中包含的所有术语
+terminology_matcher = OrgKeywordMatcher(load_terminology_words)
+
+
+def terminology_in_datasource(row, datasource: Optional[int]) -> bool:
+    if not row.specific_ds:
+        return True
+    if datasource is None or not row.datasource_ids:
+        return False
+    return f'{datasource}' in [f'{ds_id}' for ds_id in row.datasource_ids]
 
-    if datasource is not None:
-        stmt = stmt.where(
-            or_(
-                or_(Terminology.specific_ds == False, Terminology.specific_ds.is_(None)),
-                and_(
-                    Terminology.specific_ds == True,
-                    Terminology.datasource_ids.isnot(None),
-                    text("datasource_ids @> jsonb_build_array(:datasource)")
-                )
-            )
-        )
-    else:
-        stmt = stmt.where(or_(Terminology.specific_ds == False, Terminology.specific_ds.is_(None)))
 
-    # 执行查询
-    params: dict[str, Any] = {'sentence': word}
-    if datasource is not None:
-        params['datasource'] = datasource
+def select_terminology_by_word(session: SessionDep, word: str, oid: int, datasource: int = None):
+    if word.strip() == "":
+        return []
 
-    results = session.execute(stmt, params).fetchall()
+    _list: List[Terminology] = []
 
-    for row in results:
-        _list.append(Terminology(id=row.id, word=row.word, pid=row.pid))
+    # 问题中包含的术语（原 :sentence ILIKE '%' || word || '%'）
+    for row in terminology_matcher.get(session, oid).find(word):
+        if terminology_in_datasource(row, datasource):
+            _list.append(Terminology(id=row.id, word=row.word, pid=row.pid))
 
     if settings.EMBEDDING_ENABLED:
         with session.begin_nested():
             try:
-                model = EmbeddingModelCache.get_model()
-
-                embedding = model.embed_query(word)
+                embedding = EmbeddingQueryCache.embed_query(word)
+                dim = len(embedding)
 
+                stmt = text(embedding_sql(dim, datasource is not None)).bindparams(
+                    bindparam('embedding_array', type_=VECTOR(dim)))
+                params = {'embedding_array': embedding, 'oid': oid}
                 if datasource is not None:
-                    results = session.execute(text(embedding_sql_with_datasource),
-                                              {'embedding_array': str(embedding), 'oid': oid,
-                                               'datasource': datasource}).fetchall()
-                else:
-                    results = session.execute(text(embedding_sql),
-                                              {'embedding_array': str(embedding), 'oid': oid}).fetchall()
+                    params['datasource'] = datasource
+                results = session.execute(stmt, params).fetchall()
 
                 for row in results:
                     _list.append(Terminology(id=row.id, word=row.word, pid=row.pid))
@@ -85,6 +85,9 @@ class Settings(BaseSettings):
 
     MCP_IMAGE_PATH: str = '/opt/sqlbot/images'
     EXCEL_PATH: str = '/opt/sqlbot/data/excel'
+    # Excel/CSV 导入：COPY 每批行数、多 sheet 并行导入的线程数
+    EXCEL_COPY_CHUNK_SIZE: int = 50000
+    EXCEL_IMPORT_WORKERS: int = 4
     MCP_IMAGE_HOST: str = 'http://localhost:3000'
     SERVER_IMAGE_HOST: str = 'http://YOUR_SERVE_IP:MCP_PORT/images/'
     SERVER_IMAGE_TIMEOUT: int = 15
@@ -98,6 +101,12 @@ class Settings(BaseSettings):
     EMBEDDING_DEFAULT_TOP_COUNT: int = 5
     EMBEDDING_TERMINOLOGY_TOP_COUNT: int = EMBEDDING_DEFAULT_TOP_COUNT
     EMBEDDING_DATA_TRAINING_TOP_COUNT: int = EMBEDDING_DEFAULT_TOP_COUNT
+    # 问题 embedding 缓存，EMBEDDING_QUERY_CACHE_REDIS 需配合 CACHE_TYPE=redis 使用
+    EMBEDDING_QUERY_CACHE_SIZE: int = 1024
+    EMBEDDING_QUERY_CACHE_TTL: int = 3600
+    EMBEDDING_QUERY_CACHE_REDIS: bool = False
+    # 批量计算 embedding 时每批条数，注意模型接口的单次条数上限
+    EMBEDDING_BATCH_SIZE: int = 10
 
     # 是否启用SQL查询行数限制，默认值，可被参数配置覆盖
     GENERATE_SQL_QUERY_LIMIT_ENABLED: bool = True
@@ -111,18 +120,89 @@ class Settings(BaseSettings):
     PG_POOL_RECYCLE: int = 3600
     PG_POOL_PRE_PING: bool = True
 
+    # 数据源连接池配置，每个数据源一个 engine，超过 DS_ENGINE_CACHE_SIZE 时淘汰最久未使用的
+    DS_POOL_SIZE: int = 5
+    DS_MAX_OVERFLOW: int = 10
+    DS_POOL_RECYCLE: int = 3600
+    DS_POOL_PRE_PING: bool = True
+    DS_ENGINE_CACHE_SIZE: int = 100
+    # 从数据源连接池获取连接的等待时间（秒），连接池耗尽时超过该时间报错
+    DS_POOL_TIMEOUT: int = 30
+    # py_driver 类型数据源（dm、doris、redshift、kingbase）连接空闲超时（秒），生命周期沿用 DS_POOL_RECYCLE
+    DS_DRIVER_POOL_MAX_IDLE: int = 300
+    # 选择数据表时逐表读取字段的并发数，不超过 DS_POOL_SIZE
+    DS_INTROSPECT_WORKERS: int = 4
+
     TABLE_EMBEDDING_ENABLED: bool = True
     TABLE_EMBEDDING_COUNT: int = 10
     DS_EMBEDDING_COUNT: int = 10
+    # 表/数据源 embedding 矩阵缓存有效期（秒），写入新 embedding 时会主动失效
+    EMBEDDING_MATRIX_CACHE_TTL: int = 600
+    # 数据源 schema 缓存有效期（秒），修改表/字段/表关系时会主动失效，多进程部署时依赖该值过期
+    DS_SCHEMA_CACHE_TTL: int = 300
+    # 用户行/列权限缓存：修改规则或权限时主动失效，多进程部署时依赖 TTL（秒）过期
+    DS_PERMISSION_CACHE_TTL: int = 60
+    DS_PERMISSION_CACHE_SIZE: int = 1000
+    # 数据源版本等元信息缓存有效期（秒），过期后先返回旧值并在后台刷新，修改数据源时会主动失效
+    DS_METADATA_CACHE_TTL: int = 3600
+    # 未获取到版本号（类型不支持或查询结果为空）时的缓存有效期（秒）
+    DS_METADATA_EMPTY_CACHE_TTL: int = 60
+    # 探测失败（数据源不可用）时的缓存有效期（秒），期间不再同步探测，过期后在后台重试
+    DS_METADATA_FAILED_CACHE_TTL: int = 30
+    # 元信息缓存的数据源个数上限（含小助手外部数据源），超出时淘汰最久未使用的
+    DS_METADATA_CACHE_SIZE: int = 1000
+    # 术语/示例问题关键词自动机缓存有效期（秒），修改时会主动失效
+    KEYWORD_MATCHER_CACHE_TTL: int = 300
+
+    # 认证结果进程内缓存：有效 token 的缓存时间（秒）、无效 token 的缓存时间（秒）、最大条数
+    AUTH_TOKEN_CACHE_TTL: int = 30
+    AUTH_INVALID_TOKEN_CACHE_TTL: int = 10
+    AUTH_TOKEN_CACHE_SIZE: int = 10000
+    # 解密后的模型配置缓存有效期（秒）、复用的模型客户端数量，修改模型时会主动失效
+    LLM_CONFIG_CACHE_TTL: int = 300
+    LLM_CLIENT_CACHE_SIZE: int = 32
+
+    # 后台任务线程池：并发数、排队上限（超出返回 429）
+    TASK_CHAT_WORKERS: int = 50
+    TASK_CHAT_QUEUE_SIZE: int = 100
+    TASK_ANALYSIS_WORKERS: int = 20
+    TASK_ANALYSIS_QUEUE_SIZE: int = 50
+    TASK_RECOMMEND_WORKERS: int = 20
+    TASK_RECOMMEND_QUEUE_SIZE: int = 50
+    TASK_EMBEDDING_WORKERS: int = 4
+    TASK_EMBEDDING_QUEUE_SIZE: int = 1000
+    TASK_QUEUE_WAIT_WARNING: float = 5
+    # 后台批处理任务（embedding）每批之间为高优先级排队任务让出的最长时间（秒）
+    TASK_PRIORITY_MAX_DELAY: float = 30
+    # 问数/分析/推荐问题在事件循环中异步执行（astream），不再占用后台线程
+    TASK_ASYNC_ENABLED: bool = False
+    # 异步模式下同步调用的线程数：SQLBot 自身数据库读写、目标数据源查询分开限制
+    TASK_ASYNC_DB_WORKERS: int = 32
+    TASK_ASYNC_DATASOURCE_WORKERS: int = 32
+    # 问数的 SQL 查询结果按列式保存（fields + 每列的值），接口返回时再转为行格式
+    SQL_RESULT_COLUMNAR_ENABLED: bool = False
+    # 问数执行 SQL 时流式读取结果，最多读取的行数和估算字节数，超出部分截断（<=0 不限制）
+    SQL_RESULT_MAX_ROWS: int = 100000
+    SQL_RESULT_MAX_BYTES: int = 64 * 1024 * 1024
+    SQL_FETCH_BATCH_SIZE: int = 1000
+    # 查询结果 JSON 超过该字节数时压缩后保存到 chat_record_blob，chat_record 只保留引用和预览（<=0 不拆分）
+    CHAT_RESULT_BLOB_THRESHOLD: int = 256 * 1024
+    CHAT_RESULT_PREVIEW_ROWS: int = 20
+    # 导出时保存的数据被截断，重新执行 SQL 最多导出的行数
+    EXPORT_MAX_ROWS: int = 1000000
 
     ORACLE_CLIENT_PATH: str = '/opt/sqlbot/db_client/oracle_instant_client'
 
     @field_validator('SQL_DEBUG',
                      'EMBEDDING_ENABLED',
+                     'EMBEDDING_QUERY_CACHE_REDIS',
                      'GENERATE_SQL_QUERY_LIMIT_ENABLED',
                      'PARSE_REASONING_BLOCK_ENABLED',
                      'PG_POOL_PRE_PING',
+                     'DS_POOL_PRE_PING',
                      'TABLE_EMBEDDING_ENABLED',
+                     'TASK_ASYNC_ENABLED',
+                     'SQL_RESULT_COLUMNAR_ENABLED',
                      mode='before')
     @classmethod
     def lowercase_bool(cls, v: Any) -> Any:
@@ -89,6 +89,22 @@ def cache(
         return wrapper
     return decorator
 
+# 清除缓存时的回调，参数为 namespace，用于同步失效依赖这些缓存的进程内缓存
+_clear_listeners: list = []
+
+
+def add_clear_cache_listener(listener):
+    _clear_listeners.append(listener)
+
+
+def notify_clear_cache(namespace: str):
+    for listener in _clear_listeners:
+        try:
+            listener(namespace)
+        except Exception as e:
+            SQLBotLogUtil.error(f"Clear cache listener failed: {e}")
+
+
 def clear_cache(
     namespace: str = "",
     *,
@@ -99,7 +115,9 @@ def clear_cache(
         @wraps(func)
         async def wrapper(*args, **kwargs):
             if not settings.CACHE_TYPE or settings.CACHE_TYPE.lower() == "none" or not is_cache_initialized():
-                return await func(*args, **kwargs)
+                result = await func(*args, **kwargs)
+                notify_clear_cache(str(namespace) if namespace else "")
+                return result
             cache_key = custom_key_builder(
                 func=func,
                 namespace=str(namespace) if namespace else "",
@@ -118,12 +136,31 @@ def clear_cache(
                     else:
                         await backend.clear(key=temp_cache_key)
                     SQLBotLogUtil.debug(f"Cache cleared: {temp_cache_key}")
-            return await func(*args, **kwargs)
+            result = await func(*args, **kwargs)
+            # 数据修改完成后再通知，避免并发请求用旧数据重新填充进程内缓存
+            notify_clear_cache(str(namespace) if namespace else "")
+            return result
         
         return wrapper
     return decorator
 
 
+_sync_redis_client = None
+
+
+def get_sync_redis_client():
+    """
+    线程池中的同步代码无法使用 fastapi-cache 的异步 redis 客户端，这里提供同一地址的同步客户端
+    """
+    global _sync_redis_client
+    if not settings.CACHE_TYPE or settings.CACHE_TYPE.lower() != "redis":
+        return None
+    if _sync_redis_client is None:
+        import redis
+        _sync_redis_client = redis.Redis.from_url(settings.CACHE_REDIS_URL or "redis://localhost:6379/0")
+    return _sync_redis_client
+
+
 def init_sqlbot_cache():
     cache_type: str = settings.CACHE_TYPE
     if cache_type == "memory":
@@ -17,3 +17,7 @@ class SQLBotDBError(Exception):
 
 class ParseSQLResultError(Exception):
     pass
+
+
+class TaskRejectedError(Exception):
+    pass
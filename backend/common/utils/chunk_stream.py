@@ -0,0 +1,82 @@
+import asyncio
+import queue
+from typing import Any, AsyncIterator, Iterator, Optional
+
+_END = object()
+
+
+class ChunkStream:
+    """
+    后台线程（生产者）与响应（消费者）之间的数据通道：
+    - 在事件循环中创建时，使用 asyncio.Queue，生产者通过 loop.call_soon_threadsafe 投递，
+      消费者以异步生成器读取，不占用额外线程，数据产生后立即送达
+    - 没有事件循环时退化为阻塞的 queue.Queue
+    """
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        if loop is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = None
+        self._loop = loop
+        if loop is not None:
+            self._queue = asyncio.Queue()
+        else:
+            self._queue = queue.Queue()
+        self._closed = False
+
+    def _put(self, item: Any):
+        if self._loop is None:
+            self._queue.put(item)
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, item)
+        except RuntimeError:
+            # 事件循环已关闭，消费者已不存在
+            pass
+
+    def put(self, chunk: Any):
+        if not self._closed:
+            self._put(chunk)
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._put(_END)
+
+    async def aiter(self) -> AsyncIterator[Any]:
+        if self._loop is None:
+            raise RuntimeError('ChunkStream is not bound to an event loop')
+        while True:
+            chunk = await self._queue.get()
+            if chunk is _END:
+                break
+            yield chunk
+
+    def iter(self) -> Iterator[Any]:
+        if self._loop is not None:
+            raise RuntimeError('ChunkStream is bound to an event loop, use aiter() instead')
+        while True:
+            chunk = self._queue.get()
+            if chunk is _END:
+                break
+            yield chunk
+
+
+def iterate_async_generator(agen: AsyncIterator[Any]) -> Iterator[Any]:
+    """
+    在当前线程新建事件循环，逐个取出异步生成器的结果，供线程池中的同步调用方使用
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(agen.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        try:
+            loop.run_until_complete(agen.aclose())
+        finally:
+            loop.close()
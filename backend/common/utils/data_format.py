@@ -63,6 +63,68 @@ class DataFormat:
 
         return [process_item(obj) for obj in obj_array]
 
+    @staticmethod
+    def convert_large_numbers_in_columns(columns: list, int_threshold=1e15, float_threshold=1e10):
+        """处理列式数据，规则同 convert_large_numbers_in_object_array"""
+
+        def need_convert(value):
+            if isinstance(value, bool):
+                return False
+            if isinstance(value, int):
+                return abs(value) >= int_threshold
+            if isinstance(value, float):
+                return abs(value) >= float_threshold or abs(value) < 1e-6
+            return isinstance(value, (dict, list))
+
+        def convert_value(value):
+            # 借用行格式的处理逻辑
+            return DataFormat.convert_large_numbers_in_object_array([{'v': value}], int_threshold,
+                                                                    float_threshold)[0]['v']
+
+        result = []
+        for values in columns if columns else []:
+            if any(need_convert(value) for value in values):
+                values = [convert_value(value) if need_convert(value) else value for value in values]
+            result.append(values)
+        return result
+
+    @staticmethod
+    def is_columnar(result) -> bool:
+        return isinstance(result, dict) and result.get('columnar') is True
+
+    @staticmethod
+    def columnar_to_rows(result):
+        """列式结果转为行格式 {"fields", "data": [dict]}，行格式原样返回"""
+        if not DataFormat.is_columnar(result):
+            return result
+        fields = result.get('column_keys') or [str(field) for field in result.get('fields') or []]
+        columns = result.get('columns') or []
+        converted = {key: value for key, value in result.items() if key not in ('columns', 'columnar', 'column_keys')}
+        converted['data'] = [dict(zip(fields, values)) for values in zip(*columns)]
+        return converted
+
+    @staticmethod
+    def rows_to_columnar(result: dict):
+        """行格式 {"fields", "data": [dict]} 转为列式结果，fields 中没有的 key 追加在后面"""
+        if DataFormat.is_columnar(result):
+            return result
+        rows = result.get('data') or []
+        fields = [str(field) for field in result.get('fields') or []]
+        keys = list(fields)
+        known = set(keys)
+        for row in rows:
+            for key in row.keys():
+                if key not in known:
+                    known.add(key)
+                    keys.append(key)
+        converted = {key: value for key, value in result.items() if key != 'data'}
+        converted['fields'] = result.get('fields') if result.get('fields') is not None else keys
+        converted['columns'] = [[row.get(key) for row in rows] for key in keys]
+        converted['columnar'] = True
+        if len(keys) != len(fields):
+            converted['column_keys'] = keys
+        return converted
+
     @staticmethod
     def convert_object_array_for_pandas(column_list: list, data_list: list):
         _fields_list = []
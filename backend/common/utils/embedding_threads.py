@@ -1,11 +1,11 @@
-from concurrent.futures import ThreadPoolExecutor
 from typing import List
 
 from sqlalchemy.orm import sessionmaker, scoped_session
 
-executor = ThreadPoolExecutor(max_workers=200)
-
 from common.core.db import engine
+from common.error import TaskRejectedError
+from common.utils.task_scheduler import scheduler, EMBEDDING_POOL
+from common.utils.utils import SQLBotLogUtil
 
 session_maker = scoped_session(sessionmaker(bind=engine))
 
@@ -13,36 +13,44 @@ session_maker = scoped_session(sessionmaker(bind=engine))
 # session = session_maker()
 
 
+def submit(fn, *args):
+    try:
+        scheduler.submit(EMBEDDING_POOL, fn, *args)
+    except TaskRejectedError as e:
+        # 未计算的 embedding 为空，会在下次补全任务中处理
+        SQLBotLogUtil.error(f'Skip embedding task {fn.__name__}: {e}')
+
+
 def run_save_terminology_embeddings(ids: List[int]):
     from apps.terminology.curd.terminology import save_embeddings
-    executor.submit(save_embeddings, session_maker, ids)
+    submit(save_embeddings, session_maker, ids)
 
 
 def fill_empty_terminology_embeddings():
     from apps.terminology.curd.terminology import run_fill_empty_embeddings
-    executor.submit(run_fill_empty_embeddings, session_maker)
+    submit(run_fill_empty_embeddings, session_maker)
 
 
 def run_save_data_training_embeddings(ids: List[int]):
     from apps.data_training.curd.data_training import save_embeddings
-    executor.submit(save_embeddings, session_maker, ids)
+    submit(save_embeddings, session_maker, ids)
 
 
 def fill_empty_data_training_embeddings():
     from apps.data_training.curd.data_training import run_fill_empty_embeddings
-    executor.submit(run_fill_empty_embeddings, session_maker)
+    submit(run_fill_empty_embeddings, session_maker)
 
 
 def run_save_table_embeddings(ids: List[int]):
     from apps.datasource.crud.table import save_table_embedding
-    executor.submit(save_table_embedding, session_maker, ids)
+    submit(save_table_embedding, session_maker, ids)
 
 
 def run_save_ds_embeddings(ids: List[int]):
     from apps.datasource.crud.table import save_ds_embedding
-    executor.submit(save_ds_embedding, session_maker, ids)
+    submit(save_ds_embedding, session_maker, ids)
 
 
 def fill_empty_table_and_ds_embeddings():
     from apps.datasource.crud.table import run_fill_empty_table_and_ds_embedding
-    executor.submit(run_fill_empty_table_and_ds_embedding, session_maker)
+    submit(run_fill_empty_table_and_ds_embedding, session_maker)
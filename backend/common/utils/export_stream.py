@@ -0,0 +1,122 @@
+import codecs
+import csv
+import datetime
+import io
+import os
+import tempfile
+from decimal import Decimal
+from typing import Any, Iterable, Iterator
+
+import xlsxwriter
+
+from common.utils.utils import SQLBotLogUtil
+
+# xlsx 单个 sheet 的最大行数（含表头）
+XLSX_MAX_ROWS = 1048576
+# 响应头：导出的数据是否不完整（true/false）
+EXPORT_TRUNCATED_HEADER = 'X-SQLBot-Export-Truncated'
+
+
+def normalize_export_value(value: Any) -> Any:
+    """
+    将数据库驱动返回的值转换为与已保存结果（orjson 序列化）一致的基础类型
+    """
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).decode('utf-8', errors='replace')
+    return str(value)
+
+
+def write_xlsx_file(path: str, header: list[str], rows: Iterable[list], sheet_name: str = 'Sheet1') -> int:
+    """
+    使用 xlsxwriter constant_memory 模式逐行写入 xlsx，内存占用与行数无关，返回写入的数据行数
+    """
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'strings_to_numbers': False,
+                                          'remove_timezone': True})
+    try:
+        worksheet = workbook.add_worksheet(sheet_name)
+        header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+        worksheet.write_row(0, 0, header, header_format)
+        count = 0
+        for row in rows:
+            if count + 1 >= XLSX_MAX_ROWS:
+                SQLBotLogUtil.info(f"Excel export reached the sheet row limit {XLSX_MAX_ROWS}, remaining rows skipped")
+                break
+            count += 1
+            worksheet.write_row(count, 0, [normalize_export_value(value) for value in row])
+        return count
+    finally:
+        workbook.close()
+
+
+def build_xlsx_file(header: list[str], rows: Iterable[list], sheet_name: str = 'Sheet1') -> str:
+    """
+    写入临时文件并返回路径，调用方负责删除（如 StreamingResponse 的 BackgroundTask）
+    """
+    fd, path = tempfile.mkstemp(prefix='sqlbot_export_', suffix='.xlsx')
+    os.close(fd)
+    try:
+        write_xlsx_file(path, header, rows, sheet_name)
+    except Exception:
+        remove_quietly(path)
+        raise
+    return path
+
+
+def build_csv_file(header: list[str], rows: Iterable[list], batch_size: int = 1000) -> str:
+    """
+    写入临时文件并返回路径，调用方负责删除；用于需要在响应头中返回导出结果（如是否截断）的场景
+    """
+    fd, path = tempfile.mkstemp(prefix='sqlbot_export_', suffix='.csv')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in iter_csv_chunks(header, rows, batch_size):
+                f.write(chunk)
+    except Exception:
+        remove_quietly(path)
+        raise
+    return path
+
+
+def iter_file_chunks(path: str, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def remove_quietly(path: str):
+    try:
+        if path and os.path.exists(path):
+            os.remove(path)
+    except Exception as e:
+        SQLBotLogUtil.error(f"Remove temp file {path} failed: {e}")
+
+
+def iter_csv_chunks(header: list[str], rows: Iterable[list], batch_size: int = 1000) -> Iterator[bytes]:
+    """
+    逐批生成 CSV 内容（带 UTF-8 BOM，Excel 可直接打开），直接写入 StreamingResponse
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    yield codecs.BOM_UTF8 + buffer.getvalue().encode('utf-8')
+    buffer.seek(0)
+    buffer.truncate(0)
+    count = 0
+    for row in rows:
+        writer.writerow([normalize_export_value(value) for value in row])
+        count += 1
+        if count % batch_size == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate(0)
+    if buffer.tell() > 0:
+        yield buffer.getvalue().encode('utf-8')
@@ -0,0 +1,117 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Iterable, Optional
+
+from common.core.config import settings
+from common.core.deps import SessionDep
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick 自动机：一次扫描文本找出其中包含的所有关键词（忽略大小写），
+    耗时与文本长度和命中数相关，与关键词数量无关
+    """
+
+    def __init__(self, words: Iterable[tuple[str, Any]]):
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[list[int]] = [[]]
+        self.payloads: list[Any] = []
+        for word, payload in words:
+            key = word.lower() if word else ''
+            if key == '':
+                continue
+            node = 0
+            for ch in key:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                node = nxt
+            self._out[node].append(len(self.payloads))
+            self.payloads.append(payload)
+
+        # 输出链接：沿失败指针最近的、有关键词结束的节点
+        self._link: list[int] = [-1] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                fail = self._goto[f].get(ch, 0)
+                self._fail[child] = fail
+                self._link[child] = fail if self._out[fail] else self._link[fail]
+
+    def __len__(self):
+        return len(self.payloads)
+
+    def find(self, text: str) -> list[Any]:
+        if not text or not self.payloads:
+            return []
+        goto = self._goto
+        fail = self._fail
+        found = set()
+        node = 0
+        for ch in text.lower():
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            n = node if self._out[node] else self._link[node]
+            while n > 0:
+                found.update(self._out[n])
+                n = self._link[n]
+        return [self.payloads[i] for i in sorted(found)]
+
+
+class OrgKeywordMatcher:
+    """
+    按组织缓存的关键词自动机，loader 返回 (关键词, payload) 列表；
+    数据新增/修改/删除后调用 invalidate 失效，多进程部署时依赖 KEYWORD_MATCHER_CACHE_TTL 过期
+    """
+
+    def __init__(self, loader: Callable[[SessionDep, int], Iterable[tuple[str, Any]]]):
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._cache: dict[int, tuple[float, AhoCorasick]] = {}
+        self._version: dict[int, int] = {}
+        self._global_version = 0
+
+    def get(self, session: SessionDep, oid: int) -> AhoCorasick:
+        with self._lock:
+            cached = self._cache.get(oid)
+            version = (self._global_version, self._version.get(oid, 0))
+        if cached is not None and (settings.KEYWORD_MATCHER_CACHE_TTL <= 0
+                                   or time.monotonic() - cached[0] < settings.KEYWORD_MATCHER_CACHE_TTL):
+            return cached[1]
+
+        matcher = AhoCorasick(self._loader(session, oid))
+        with self._lock:
+            # 构建期间被失效过，结果可能已过期，不写入缓存
+            if version == (self._global_version, self._version.get(oid, 0)):
+                self._cache[oid] = (time.monotonic(), matcher)
+        return matcher
+
+    def invalidate(self, oid: Optional[int] = None):
+        with self._lock:
+            if oid is None:
+                self._global_version += 1
+                self._cache.clear()
+            else:
+                self._version[oid] = self._version.get(oid, 0) + 1
+                self._cache.pop(oid, None)
+
+    def invalidate_many(self, oids: Iterable[Optional[int]]):
+        # 组织未知（oid 为空）时全部失效
+        oids = set(oids)
+        if None in oids:
+            self.invalidate()
+            return
+        for oid in oids:
+            self.invalidate(oid)
@@ -0,0 +1,218 @@
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Awaitable, Callable, Optional
+
+from common.core.config import settings
+from common.error import TaskRejectedError
+from common.utils.utils import SQLBotLogUtil
+
+# pool names
+CHAT_POOL = 'chat'
+ANALYSIS_POOL = 'analysis'
+RECOMMEND_POOL = 'recommend'
+EMBEDDING_POOL = 'embedding'
+
+# 异步模式下同步调用使用的线程池：SQLBot 自身数据库、目标数据源分开，慢数据源不影响其他对话的元数据读写
+DB_EXECUTOR = 'db'
+DATASOURCE_EXECUTOR = 'datasource'
+
+
+class TaskPool:
+    """
+    有界线程池：
+    - max_workers: 并发数
+    - max_queue: 排队上限，超出时 submit/submit_async 抛出 TaskRejectedError
+    - priority: 数值越小优先级越高，各池线程相互独立，仅供后台批处理任务（如 embedding）在批次之间让出
+    """
+
+    def __init__(self, scheduler: 'TaskScheduler', name: str, max_workers: int, max_queue: int, priority: int):
+        self.scheduler = scheduler
+        self.name = name
+        self.max_workers = max(max_workers, 1)
+        self.max_queue = max(max_queue, 0)
+        self.priority = priority
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f'sqlbot-{name}')
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def reserve(self) -> float:
+        """
+        占用一个排队名额，超出 max_workers + max_queue 时抛出 TaskRejectedError，返回提交时间
+        """
+        with self._lock:
+            if self.queued + self.running >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                SQLBotLogUtil.error(f'Task pool [{self.name}] is full, running: {self.running}, '
+                                    f'queued: {self.queued}')
+                raise TaskRejectedError(f'Task pool [{self.name}] is busy, please try again later')
+            self.queued += 1
+            self.submitted += 1
+        return time.monotonic()
+
+    def _cancel(self):
+        with self._lock:
+            self.queued -= 1
+
+    def _start(self, submit_time: float):
+        wait = time.monotonic() - submit_time
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+        if wait > settings.TASK_QUEUE_WAIT_WARNING:
+            SQLBotLogUtil.info(f'Task pool [{self.name}] queue wait: {wait:.2f}s')
+
+    def _finish(self, success: bool):
+        with self._lock:
+            self.running -= 1
+            if success:
+                self.completed += 1
+            else:
+                self.failed += 1
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        submit_time = self.reserve()
+        try:
+            return self._executor.submit(self._run, submit_time, fn, *args, **kwargs)
+        except Exception:
+            self._cancel()
+            raise
+
+    def _run(self, submit_time: float, fn: Callable, *args, **kwargs):
+        self._start(submit_time)
+        success = False
+        try:
+            result = fn(*args, **kwargs)
+            success = True
+            return result
+        finally:
+            self._finish(success)
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+        return self._semaphore
+
+    def submit_async(self, fn: Callable[..., Awaitable], *args) -> asyncio.Task:
+        """
+        异步模式：任务运行在当前事件循环中，与线程模式使用相同的排队上限（超出抛出 TaskRejectedError），
+        同时运行的任务数不超过 max_workers，需在事件循环中调用
+        """
+        submit_time = self.reserve()
+        try:
+            return asyncio.create_task(self._run_async(submit_time, fn, *args))
+        except Exception:
+            self._cancel()
+            raise
+
+    async def _run_async(self, submit_time: float, fn: Callable[..., Awaitable], *args):
+        try:
+            await self._get_semaphore().acquire()
+        except BaseException:
+            self._cancel()
+            raise
+        try:
+            self._start(submit_time)
+            success = False
+            try:
+                result = await fn(*args)
+                success = True
+                return result
+            finally:
+                self._finish(success)
+        finally:
+            self._get_semaphore().release()
+
+    def status(self) -> dict:
+        with self._lock:
+            started = self.completed + self.failed + self.running
+            return {
+                "name": self.name,
+                "priority": self.priority,
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "running": self.running,
+                "queued": self.queued,
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "completed": self.completed,
+                "failed": self.failed,
+                "avg_wait": round(self.total_wait / started, 4) if started > 0 else 0.0,
+                "max_wait": round(self.max_wait, 4),
+            }
+
+
+class TaskScheduler:
+
+    def __init__(self):
+        self._pools: dict[str, TaskPool] = {}
+        self._executors: dict[str, ThreadPoolExecutor] = {}
+
+    def register(self, name: str, max_workers: int, max_queue: int, priority: int) -> TaskPool:
+        pool = TaskPool(self, name, max_workers, max_queue, priority)
+        self._pools[name] = pool
+        return pool
+
+    def get_pool(self, name: str) -> TaskPool:
+        return self._pools[name]
+
+    def submit(self, pool_name: str, fn: Callable, *args, **kwargs) -> Future:
+        return self.get_pool(pool_name).submit(fn, *args, **kwargs)
+
+    def submit_async(self, pool_name: str, fn: Callable[..., Awaitable], *args) -> asyncio.Task:
+        return self.get_pool(pool_name).submit_async(fn, *args)
+
+    def register_executor(self, name: str, max_workers: int):
+        self._executors[name] = ThreadPoolExecutor(max_workers=max(max_workers, 1),
+                                                   thread_name_prefix=f'sqlbot-sync-{name}')
+
+    async def run_blocking(self, executor_name: str, fn: Callable, *args, **kwargs):
+        """
+        在指定的有界线程池中执行同步调用，并带上当前的 contextvars（与 asyncio.to_thread 一致）
+        """
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()
+        return await loop.run_in_executor(self._executors[executor_name],
+                                          functools.partial(ctx.run, fn, *args, **kwargs))
+
+    def has_pending(self, priority: int) -> bool:
+        """
+        是否有比 priority 更高优先级的任务在排队
+        """
+        return any(pool.priority < priority and pool.queued > 0 for pool in self._pools.values())
+
+    def wait_for_higher_priority(self, priority: int, timeout: float = None):
+        """
+        低优先级任务让出：等待更高优先级的排队任务被调度，最多等待 timeout 秒，避免饿死
+        仅供长时间运行的后台任务（如 embedding 补全）在每批之间调用，不能在任务启动时调用，否则会占着线程空等
+        """
+        if timeout is None:
+            timeout = settings.TASK_PRIORITY_MAX_DELAY
+        deadline = time.monotonic() + timeout
+        while self.has_pending(priority) and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def status(self) -> list[dict]:
+        return [pool.status() for pool in self._pools.values()]
+
+
+scheduler = TaskScheduler()
+scheduler.register(CHAT_POOL, settings.TASK_CHAT_WORKERS, settings.TASK_CHAT_QUEUE_SIZE, 0)
+scheduler.register(ANALYSIS_POOL, settings.TASK_ANALYSIS_WORKERS, settings.TASK_ANALYSIS_QUEUE_SIZE, 1)
+scheduler.register(RECOMMEND_POOL, settings.TASK_RECOMMEND_WORKERS, settings.TASK_RECOMMEND_QUEUE_SIZE, 2)
+scheduler.register(EMBEDDING_POOL, settings.TASK_EMBEDDING_WORKERS, settings.TASK_EMBEDDING_QUEUE_SIZE, 9)
+scheduler.register_executor(DB_EXECUTOR, settings.TASK_ASYNC_DB_WORKERS)
+scheduler.register_executor(DATASOURCE_EXECUTOR, settings.TASK_ASYNC_DATASOURCE_WORKERS)
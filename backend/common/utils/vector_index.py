@@ -0,0 +1,69 @@
+import threading
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from common.utils.utils import SQLBotLogUtil
+
+# pgvector 的 hnsw 索引最多支持 2000 维
+HNSW_MAX_DIMENSIONS = 2000
+
+_index_lock = threading.Lock()
+_created_indexes: set[str] = set()
+
+
+def hnsw_index_name(table_name: str, dim: int) -> str:
+    return f'{table_name}_embedding_hnsw_{dim}'
+
+
+def embedding_distance(dim: int, column: str = 'embedding', param: str = 'embedding_array') -> str:
+    """
+    embedding 列不限定维度，按维度建立部分表达式索引：
+    CREATE INDEX ... USING hnsw ((embedding::vector(dim)) vector_cosine_ops) WHERE vector_dims(embedding) = dim
+    查询时需使用相同的表达式和条件才能命中索引
+    """
+    return f'({column}::vector({dim}) <=> CAST(:{param} AS vector({dim})))'
+
+
+def embedding_dimension_filter(dim: int, column: str = 'embedding') -> str:
+    return f'vector_dims({column}) = {dim}'
+
+
+def get_index_valid(conn, index_name: str):
+    """
+    返回索引是否可用，索引不存在时返回 None；CREATE INDEX CONCURRENTLY 失败时会留下不可用的索引
+    """
+    return conn.execute(text(
+        'SELECT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid WHERE c.relname = :name'),
+        {'name': index_name}).scalar()
+
+
+def ensure_embedding_index(session: Session, table_name: str, dim: int):
+    """
+    保证 table_name 上存在 dim 维的 hnsw 索引，每个进程每个维度只检查一次
+    使用 CREATE INDEX CONCURRENTLY 在独立的 autocommit 连接上创建，建索引期间不阻塞表的写入
+    """
+    if not dim or dim > HNSW_MAX_DIMENSIONS:
+        return
+    index_name = hnsw_index_name(table_name, dim)
+    if index_name in _created_indexes:
+        return
+    with _index_lock:
+        if index_name in _created_indexes:
+            return
+        try:
+            # CONCURRENTLY 需等待已开始的事务结束，先结束 session 中的事务，避免互相等待
+            session.commit()
+            with session.get_bind().connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                valid = get_index_valid(conn, index_name)
+                if valid is False:
+                    conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {index_name}'))
+                if not valid:
+                    conn.execute(text(
+                        f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} ON {table_name} '
+                        f'USING hnsw ((embedding::vector({dim})) vector_cosine_ops) '
+                        f'WHERE vector_dims(embedding) = {dim}'))
+            _created_indexes.add(index_name)
+        except Exception as e:
+            session.rollback()
+            SQLBotLogUtil.error(f'Create embedding index {index_name} failed: {e}')
@@ -27,6 +27,7 @@ from common.core.response_middleware import ResponseMiddleware, exception_handle
 from common.core.sqlbot_cache import init_sqlbot_cache
 from common.utils.embedding_threads import fill_empty_terminology_embeddings, fill_empty_data_training_embeddings, \
     fill_empty_table_and_ds_embeddings
+from common.utils.export_stream import EXPORT_TRUNCATED_HEADER
 from common.utils.utils import SQLBotLogUtil
 
 
@@ -197,6 +198,7 @@ if settings.all_cors_origins:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=[EXPORT_TRUNCATED_HEADER],
     )
 
 app.add_middleware(TokenMiddleware)